@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nlq_project.settings')
+# Answer questions with the async views so the event loop isn't blocked on the LLM, e.g.
+#   uvicorn nlq_project.asgi:application
+os.environ.setdefault('ASYNC_QUERY_VIEWS', 'True')
 
 application = get_asgi_application()
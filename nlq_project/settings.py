@@ -22,12 +22,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its Server-Timing total covers the other middleware too
+    'query_app.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After authentication, which tells it whether a profile was asked for by a staff user
+    'query_app.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -57,6 +61,33 @@ DATABASES = {
     'default': dj_database_url.config(default=f'sqlite:///{BASE_DIR}/db.sqlite3', conn_max_age=600)
 }
 
+# Uploaded tables live in their own database so bulk loads and analytical scans don't
+# contend with sessions and ORM writes: ANALYTICS_DATABASE_URL, or by default a SQLite
+# file next to a SQLite default database (db_analytics.sqlite3), else the default database
+ANALYTICS_DATABASE = 'analytics'
+if os.getenv('ANALYTICS_DATABASE_URL'):
+    DATABASES[ANALYTICS_DATABASE] = dj_database_url.parse(os.getenv('ANALYTICS_DATABASE_URL'), conn_max_age=600)
+elif DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    _root, _ext = os.path.splitext(str(DATABASES['default']['NAME']))
+    DATABASES[ANALYTICS_DATABASE] = dict(DATABASES['default'], NAME=f'{_root}_analytics{_ext}')
+else:
+    DATABASES[ANALYTICS_DATABASE] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+DATABASE_ROUTERS = ['query_app.db.AnalyticsRouter']
+
+# SQLite tuning applied to every new connection by query_app.db (ignored on other
+# backends): WAL so readers never block the writer, NORMAL fsyncs (durable in WAL
+# mode), a 64MB page cache, 256MB of memory-mapped I/O, and waiting up to
+# SQLITE_BUSY_TIMEOUT ms for the write lock instead of failing with "database is locked"
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', 'True') == 'True'
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'normal'),
+    'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', str(64 * 1024))),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000')),
+    'temp_store': os.getenv('SQLITE_TEMP_STORE', 'memory'),
+} if SQLITE_TUNING else {}
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -87,3 +118,133 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Upload ingestion: rows read and inserted per batch (bounds peak memory)
+INGEST_CHUNK_ROWS = int(os.getenv('INGEST_CHUNK_ROWS', '50000'))
+# Rows sampled from the first chunk to infer column types
+INGEST_SAMPLE_ROWS = int(os.getenv('INGEST_SAMPLE_ROWS', '1000'))
+
+# Natural-language -> SQL cache: entry lifetime in seconds and LRU size bound
+SQL_CACHE_TTL = int(os.getenv('SQL_CACHE_TTL', str(7 * 24 * 3600)))
+SQL_CACHE_MAX_ENTRIES = int(os.getenv('SQL_CACHE_MAX_ENTRIES', '5000'))
+
+# LLM provider: 'gemini', 'offline' (deterministic, no network) or a dotted LLMProvider path
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'gemini')
+LLM_MODEL = os.getenv('LLM_MODEL', 'gemini-2.0-flash')
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '30'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_RETRY_BACKOFF = float(os.getenv('LLM_RETRY_BACKOFF', '0.5'))
+# Pooled clients, one per API key in use
+LLM_CLIENT_POOL_SIZE = int(os.getenv('LLM_CLIENT_POOL_SIZE', '32'))
+# Model call scheduling per API key and process: attempts in flight, attempts a minute and the
+# burst allowed above that rate (0 = no limit), seconds a call may wait for its turn (0 = no
+# limit; turns go round-robin across users), and sharing one call between identical prompts
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '0'))
+LLM_RATE_PER_MINUTE = float(os.getenv('LLM_RATE_PER_MINUTE', '0'))
+LLM_RATE_BURST = int(os.getenv('LLM_RATE_BURST', '5'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '60'))
+LLM_COALESCE = os.getenv('LLM_COALESCE', 'True') == 'True'
+# Injected seconds per call for the offline provider (load tests)
+OFFLINE_LLM_LATENCY = float(os.getenv('OFFLINE_LLM_LATENCY', '0'))
+OFFLINE_LLM_TOKEN_LATENCY = float(os.getenv('OFFLINE_LLM_TOKEN_LATENCY', '0'))
+
+# Background query jobs: worker threads per process, SSE poll interval and
+# seconds without progress before a job is reported as failed
+QUERY_JOB_WORKERS = int(os.getenv('QUERY_JOB_WORKERS', '16'))
+QUERY_JOB_POLL_INTERVAL = float(os.getenv('QUERY_JOB_POLL_INTERVAL', '0.5'))
+QUERY_JOB_TIMEOUT = int(os.getenv('QUERY_JOB_TIMEOUT', '300'))
+
+# Metrics: Server-Timing header with per-stage durations on every response, and the bearer
+# token a scraper sends to /metrics (staff users may always read it; empty = staff only)
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Request profiling: staff requests with ?profile=1 or an X-Profile: 1 header, plus a random
+# PROFILING_SAMPLE_RATE (0-1) of all requests; sampling (folded stacks for flame graphs, one
+# sample every PROFILING_INTERVAL seconds) or cprofile; the latest PROFILING_MAX_FILES are kept
+PROFILING = os.getenv('PROFILING', 'True') == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_MODE = os.getenv('PROFILING_MODE', 'sampling')
+PROFILING_INTERVAL = float(os.getenv('PROFILING_INTERVAL', '0.001'))
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', '200'))
+
+# Serve /process_query/ (and its streaming version) with the async views (set by asgi.py for uvicorn deployments)
+ASYNC_QUERY_VIEWS = os.getenv('ASYNC_QUERY_VIEWS', 'False') == 'True'
+
+# Streamed answers: send questions from the chat page to the streaming endpoint (chat text and
+# SQL show as they are generated), and seconds between keep-alives on a quiet stream. On by
+# default only with the async views: under sync workers a stream holds a worker for the whole
+# answer, so the page uses background jobs there
+QUERY_STREAMING = os.getenv('QUERY_STREAMING', str(ASYNC_QUERY_VIEWS)) == 'True'
+QUERY_STREAM_KEEPALIVE = float(os.getenv('QUERY_STREAM_KEEPALIVE', '15'))
+
+# Query results: rows per page, and the most rows a result can be paged through
+RESULT_PAGE_SIZE = int(os.getenv('RESULT_PAGE_SIZE', '50'))
+RESULT_MAX_ROWS = int(os.getenv('RESULT_MAX_ROWS', '10000'))
+
+# Chat history: turns rendered per page, and the reply size above which a result is collapsed
+CONVERSATION_PAGE_SIZE = int(os.getenv('CONVERSATION_PAGE_SIZE', '20'))
+CONVERSATION_COLLAPSE_CHARS = int(os.getenv('CONVERSATION_COLLAPSE_CHARS', '20000'))
+
+# Query guardrails (per-user overrides: the QueryLimit admin): seconds a question's SQL may run,
+# most rows a result can return (pages and exports), most rows EXPLAIN QUERY PLAN may estimate
+# a query examines, and how often a running query checks whether its job was cancelled; 0 = no limit
+QUERY_TIMEOUT = float(os.getenv('QUERY_TIMEOUT', '30'))
+QUERY_MAX_ROWS = int(os.getenv('QUERY_MAX_ROWS', '1000000'))
+QUERY_MAX_COST = int(os.getenv('QUERY_MAX_COST', '1000000000'))
+QUERY_CANCEL_CHECK_INTERVAL = float(os.getenv('QUERY_CANCEL_CHECK_INTERVAL', '0.5'))
+
+# Rows fetched and encoded per chunk when streaming a result export
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', '5000'))
+
+# Shared cache; with several worker processes point REDIS_URL at Redis so they share cached entries
+REDIS_URL = os.getenv('REDIS_URL')
+CACHES = {
+    'default': (
+        {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}
+        if REDIS_URL else
+        {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    ),
+}
+
+# Schema catalogs: cache alias, process-local LRU size and shared-cache lifetime (seconds)
+SCHEMA_CATALOG_CACHE = os.getenv('SCHEMA_CATALOG_CACHE', 'default')
+SCHEMA_CATALOG_LRU_SIZE = int(os.getenv('SCHEMA_CATALOG_LRU_SIZE', '256'))
+SCHEMA_CATALOG_TTL = int(os.getenv('SCHEMA_CATALOG_TTL', str(24 * 60 * 60)))
+
+# Result cache for read-only statements (see query_app/result_cache.py): on/off, bytes of results kept
+# per process, largest result cached, and a shared cache alias with its entry lifetime (seconds);
+# results are shared between workers by default only when REDIS_URL is set ('' = process-local only)
+RESULT_CACHING = os.getenv('RESULT_CACHING', 'True') == 'True'
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv('RESULT_CACHE_MAX_ENTRY_BYTES', str(1024 * 1024)))
+RESULT_CACHE = os.getenv('RESULT_CACHE', 'default' if REDIS_URL else '')
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', str(60 * 60)))
+
+# Schema pruning for SQL prompts: only databases with more columns than
+# SCHEMA_PRUNE_MIN_COLUMNS are pruned, to at most this many tables/columns per table
+SCHEMA_PRUNING = os.getenv('SCHEMA_PRUNING', 'True') == 'True'
+SCHEMA_PRUNE_MIN_COLUMNS = int(os.getenv('SCHEMA_PRUNE_MIN_COLUMNS', '60'))
+SCHEMA_PRUNE_MAX_TABLES = int(os.getenv('SCHEMA_PRUNE_MAX_TABLES', '5'))
+SCHEMA_PRUNE_MAX_COLUMNS = int(os.getenv('SCHEMA_PRUNE_MAX_COLUMNS', '25'))
+
+# Optional columnar engine: 'sqlite' runs generated SQL on the analytics database; 'duckdb'
+# (needs the duckdb package) runs SELECTs on DuckDB over Parquet snapshots of the uploaded
+# tables, falling back to SQLite for writes and for SQL DuckDB can't run
+QUERY_ENGINE = os.getenv('QUERY_ENGINE', 'sqlite')
+# Snapshot directory: next to a SQLite analytics database (db_analytics_snapshots/), else under MEDIA_ROOT
+if DATABASES[ANALYTICS_DATABASE]['ENGINE'] == 'django.db.backends.sqlite3':
+    _default_snapshot_dir = f"{os.path.splitext(str(DATABASES[ANALYTICS_DATABASE]['NAME']))[0]}_snapshots"
+else:
+    _default_snapshot_dir = os.path.join(MEDIA_ROOT, 'snapshots')
+COLUMNAR_SNAPSHOT_DIR = os.getenv('COLUMNAR_SNAPSHOT_DIR', _default_snapshot_dir)
+# Rows per Parquet file when a snapshot is built from SQLite
+COLUMNAR_SNAPSHOT_ROWS = int(os.getenv('COLUMNAR_SNAPSHOT_ROWS', '500000'))
+# DuckDB threads (0 = one per core) and memory limit (e.g. '2GB'; empty = DuckDB's default) per process
+DUCKDB_THREADS = int(os.getenv('DUCKDB_THREADS', '0'))
+DUCKDB_MEMORY_LIMIT = os.getenv('DUCKDB_MEMORY_LIMIT', '')
+# Write a Parquet snapshot of each upload (needs pyarrow) for previews, exports, statistics and re-ingestion
+DATASET_SNAPSHOTS = os.getenv('DATASET_SNAPSHOTS', 'True') == 'True'
+# Keep the uploaded CSV/Excel file under media/datasets/ (False drops it once its snapshot is written)
+KEEP_UPLOADED_FILES = os.getenv('KEEP_UPLOADED_FILES', 'True') == 'True'
@@ -2,8 +2,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from query_app import views
 
 urlpatterns = [
+    # Ahead of the admin, whose catch-all would otherwise answer these
+    path('admin/profiles/', views.request_profiles, name='request_profiles'),
+    path('admin/profiles/<str:profile_id>/', views.download_profile, name='download_profile'),
     path('admin/', admin.site.urls),
     path('', include('query_app.urls')),
 ]
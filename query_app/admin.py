@@ -1,3 +1,8 @@
 from django.contrib import admin
+from .models import QueryLimit
 
-# Register your models here.
+
+@admin.register(QueryLimit)
+class QueryLimitAdmin(admin.ModelAdmin):
+    list_display = ('user', 'timeout', 'max_rows', 'max_cost')
+    search_fields = ('user__username',)
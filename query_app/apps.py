@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class QueryAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'query_app'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .db import apply_sqlite_pragmas
+
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='query_app.apply_sqlite_pragmas')
@@ -0,0 +1,248 @@
+"""
+Column statistics (profiles) computed while a table is ingested.
+
+A profile holds, per column: non-null and null counts, min/max, mean and
+variance (numeric columns), a HyperLogLog sketch for the number of distinct
+values and a bounded table of the most frequent values. Every part can be
+merged, so each ingest chunk is profiled on its own, appended files are
+merged into the stored profile, and nothing ever needs a second pass over the
+table. Profiles are plain JSON and live in ``Dataset.profile``.
+"""
+import base64
+import math
+import numpy as np
+import pandas as pd
+from .db import analytics_connection
+
+
+PROFILE_VERSION = 1
+
+# 2**10 HyperLogLog registers: ~3% standard error, 1KB per column
+HLL_PRECISION = 10
+# Frequent values kept per column; more than displayed so merged counts stay accurate
+TOP_VALUES_TRACKED = 50
+
+NUMERIC_TYPES = ('INTEGER', 'REAL', 'BOOLEAN')
+TEMPORAL_TYPES = ('DATE', 'DATETIME')
+
+_POWERS_OF_TWO = np.array([1 << i for i in range(64)], dtype=np.uint64)
+
+
+def _hll_registers(text_values):
+    """HyperLogLog registers for a Series of non-null values rendered as text."""
+    registers = np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+    if text_values.empty:
+        return registers
+    hashes = pd.util.hash_pandas_object(text_values, index=False).to_numpy(dtype=np.uint64)
+    buckets = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    remainder = hashes << np.uint64(HLL_PRECISION)
+    # Rank = position of the first set bit of what remains (64 - bit_length + 1)
+    bit_length = np.searchsorted(_POWERS_OF_TWO, remainder, side='right')
+    ranks = np.minimum(65 - bit_length, 64 - HLL_PRECISION + 1).astype(np.uint8)
+    np.maximum.at(registers, buckets, ranks)
+    return registers
+
+
+def _encode_registers(registers):
+    return base64.b64encode(registers.tobytes()).decode('ascii')
+
+
+def _decode_registers(encoded):
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.uint8).copy()
+
+
+def estimate_distinct(encoded_registers):
+    """Estimate the number of distinct values from a column's encoded HLL registers."""
+    registers = _decode_registers(encoded_registers)
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        # Small-range correction (linear counting)
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+def _numeric_stats(values):
+    numbers = pd.to_numeric(values, errors='coerce').dropna().astype(float)
+    if numbers.empty:
+        return None
+    mean = float(numbers.mean())
+    return {
+        'n': int(len(numbers)),
+        'min': float(numbers.min()),
+        'max': float(numbers.max()),
+        'mean': mean,
+        'm2': float(((numbers - mean) ** 2).sum()),
+    }
+
+
+def _merge_numeric(a, b):
+    """Combine two (n, mean, M2) summaries (Chan et al.'s parallel variance)."""
+    if not a or not b:
+        return a or b
+    n = a['n'] + b['n']
+    delta = b['mean'] - a['mean']
+    return {
+        'n': n,
+        'min': min(a['min'], b['min']),
+        'max': max(a['max'], b['max']),
+        'mean': a['mean'] + delta * b['n'] / n,
+        'm2': a['m2'] + b['m2'] + delta * delta * a['n'] * b['n'] / n,
+    }
+
+
+def _temporal_range(values, col_type):
+    parsed = pd.to_datetime(values, format='ISO8601', errors='coerce').dropna()
+    if parsed.empty:
+        return None, None
+    fmt = '%Y-%m-%d' if col_type == 'DATE' else '%Y-%m-%d %H:%M:%S'
+    return parsed.min().strftime(fmt), parsed.max().strftime(fmt)
+
+
+def _top_values(counts):
+    """Keep the TOP_VALUES_TRACKED most frequent values of a {value: count} dict."""
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return [[value, count] for value, count in ranked[:TOP_VALUES_TRACKED]]
+
+
+def profile_column(series, col_type):
+    """Profile one chunk of a column."""
+    values = series.dropna()
+    # Text form: what HLL hashes and frequent values are keyed on, so an int read
+    # back from the table matches the same value profiled at ingest
+    text_values = values.astype(str)
+    stats = {
+        'type': col_type,
+        'count': int(len(values)),
+        'nulls': int(len(series) - len(values)),
+        'hll': _encode_registers(_hll_registers(text_values)),
+        'numeric': None,
+        'min': None,
+        'max': None,
+        'top': None,
+    }
+    if col_type in NUMERIC_TYPES:
+        stats['numeric'] = _numeric_stats(values)
+    elif col_type in TEMPORAL_TYPES:
+        stats['min'], stats['max'] = _temporal_range(values, col_type)
+    if col_type != 'REAL':
+        # Continuous values rarely repeat; frequent values are only useful for the rest
+        counts = text_values.value_counts().head(TOP_VALUES_TRACKED)
+        stats['top'] = _top_values(counts.to_dict())
+    return stats
+
+
+def merge_column_stats(a, b):
+    """Merge the profiles of two disjoint sets of rows of the same column."""
+    registers = np.maximum(_decode_registers(a['hll']), _decode_registers(b['hll']))
+    merged = {
+        'type': b['type'],
+        'count': a['count'] + b['count'],
+        'nulls': a['nulls'] + b['nulls'],
+        'hll': _encode_registers(registers),
+        'numeric': _merge_numeric(a['numeric'], b['numeric']),
+        'min': min(filter(None, [a['min'], b['min']]), default=None),
+        'max': max(filter(None, [a['max'], b['max']]), default=None),
+        'top': None,
+    }
+    if a['type'] != b['type']:
+        # A date column widened to TEXT: its range no longer covers every value
+        merged['min'] = merged['max'] = None
+    if a['top'] is not None or b['top'] is not None:
+        counts = {}
+        for value, count in (a['top'] or []) + (b['top'] or []):
+            counts[value] = counts.get(value, 0) + count
+        merged['top'] = _top_values(counts)
+    return merged
+
+
+def profile_chunk(chunk, column_types):
+    """Profile a DataFrame chunk whose columns hold values coerced to ``column_types``."""
+    return {
+        'version': PROFILE_VERSION,
+        'row_count': int(len(chunk)),
+        'columns': {col: profile_column(chunk[col], column_types.get(col, 'TEXT')) for col in chunk.columns},
+    }
+
+
+def merge_profiles(a, b):
+    """Merge the profiles of two disjoint sets of rows of the same table (either may be None)."""
+    if not a or not b:
+        return a or b
+    columns = {}
+    for name in list(a['columns']) + [c for c in b['columns'] if c not in a['columns']]:
+        left, right = a['columns'].get(name), b['columns'].get(name)
+        if left and right:
+            columns[name] = merge_column_stats(left, right)
+        else:
+            # A column missing from one side was NULL for all of that side's rows
+            present, missing_rows = (left, b['row_count']) if left else (right, a['row_count'])
+            columns[name] = dict(present, nulls=present['nulls'] + missing_rows)
+    return {'version': PROFILE_VERSION, 'row_count': a['row_count'] + b['row_count'], 'columns': columns}
+
+
+def _table_batches(table_name, chunk_rows):
+    """Yield a table's column names, then lists of at most ``chunk_rows`` of its rows."""
+    from .ingest import quote_identifier
+
+    with analytics_connection().cursor() as cursor:
+        cursor.execute(f'SELECT * FROM {quote_identifier(table_name)}')
+        yield [col[0] for col in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+
+
+def _table_frames(table_name, chunk_rows):
+    """Like _table_batches, but yielding DataFrames (object columns) of the rows."""
+    batches = _table_batches(table_name, chunk_rows)
+    columns = next(batches)
+    yield columns
+    for rows in batches:
+        yield pd.DataFrame.from_records(rows, columns=columns).astype(object)
+
+
+def profile_table(table_name, column_types, chunk_rows=50000):
+    """
+    Profile an existing table in one streaming pass (for datasets ingested without a profile).
+
+    The rows come from the table's Parquet snapshot when there is one.
+    """
+    from .snapshots import snapshot_frames
+
+    profile = None
+    chunks = snapshot_frames(table_name, chunk_rows)
+    if chunks is None:
+        chunks = _table_frames(table_name, chunk_rows)
+    columns = next(chunks)
+    for chunk in chunks:
+        profile = merge_profiles(profile, profile_chunk(chunk, column_types))
+    return profile or {
+        'version': PROFILE_VERSION,
+        'row_count': 0,
+        'columns': {col: profile_column(pd.Series([], dtype=object), column_types.get(col, 'TEXT')) for col in columns},
+    }
+
+
+def summarize_profile(profile, top_k=10):
+    """Human-facing statistics per column: counts, range, mean/stddev, distinct estimate, top values."""
+    summary = {}
+    for name, stats in profile['columns'].items():
+        numeric = stats['numeric']
+        column = {
+            'type': stats['type'],
+            'count': stats['count'],
+            'nulls': stats['nulls'],
+            'distinct': min(estimate_distinct(stats['hll']), stats['count']),
+            'min': numeric['min'] if numeric else stats['min'],
+            'max': numeric['max'] if numeric else stats['max'],
+            'mean': numeric['mean'] if numeric else None,
+            'stddev': math.sqrt(numeric['m2'] / (numeric['n'] - 1)) if numeric and numeric['n'] > 1 else None,
+            'top': (stats['top'] or [])[:top_k],
+        }
+        summary[name] = column
+    return summary
@@ -0,0 +1,326 @@
+"""
+Optional columnar execution of generated SQL on DuckDB.
+
+Generated SQL is mostly scans, filters, group-bys and aggregates, which
+SQLite's row store runs on one core. With QUERY_ENGINE = 'duckdb' such
+SELECTs run on DuckDB instead, over a Parquet snapshot of each uploaded table.
+
+The analytics database stays the source of truth. Uploads write the
+snapshots as they ingest (see snapshots); a table without one (uploaded
+before snapshots, or changed by a generated write since) gets one built from
+the table in a background thread the first time a query needs it, and until
+then queries on it run on SQLite.
+Every process reads the snapshots through its own in-memory DuckDB database,
+so any number of gunicorn workers can share them (a DuckDB database file only
+admits one writing process).
+
+DuckDB is set up to behave like SQLite where generated SQL relies on it:
+integer division, NULLs sorting first, and LIKE matching case-insensitively.
+Writes, PRAGMAs and anything DuckDB rejects (SQLite-only functions, bare
+columns in GROUP BY) run on SQLite as before.
+
+Generated SQL comes from a model that users can steer, so the DuckDB database
+can only touch files under COLUMNAR_SNAPSHOT_DIR, with its configuration
+locked, and a query is refused with QueryRejected unless it reads nothing but
+the dataset's tables: no table functions (read_text, read_csv, ...), file
+paths or system catalogs.
+"""
+import contextlib
+import functools
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import sqlparse
+from sqlparse import tokens as T
+from django.conf import settings
+from django.db import DatabaseError, connections
+from .db import analytics_connection
+from .guardrails import QueryRejected
+from .snapshots import has_snapshot, new_build_dir, part_name, publish_snapshot, snapshot_path, snapshot_version
+
+logger = logging.getLogger(__name__)
+
+# Parquet column types for the column types recorded at ingest. BOOLEAN stays
+# 0/1 as in SQLite, so SUM(active) and active = 1 keep working
+DUCKDB_TYPES = {
+    'INTEGER': 'BIGINT',
+    'REAL': 'DOUBLE',
+    'BOOLEAN': 'BIGINT',
+    'DATE': 'DATE',
+    'DATETIME': 'TIMESTAMP',
+    'TEXT': 'VARCHAR',
+}
+
+# LIKE / NOT LIKE operator tokens, in any case
+LIKE_RE = re.compile(r'\bLIKE$', re.IGNORECASE)
+
+_database = None
+_database_lock = threading.Lock()
+_local = threading.local()
+
+_builder = None
+_pending = set()
+# Table -> snapshot version whose build failed, so it isn't retried until the data changes
+_failed = {}
+_builder_lock = threading.Lock()
+
+
+def engine_enabled():
+    """Whether SELECTs should be tried on DuckDB."""
+    return settings.QUERY_ENGINE == 'duckdb' and _duckdb_installed()
+
+
+@functools.lru_cache(maxsize=None)
+def _duckdb_installed():
+    try:
+        import duckdb  # noqa: F401
+    except ImportError:
+        logger.warning("QUERY_ENGINE is 'duckdb' but the duckdb package is not installed; using SQLite")
+        return False
+    return True
+
+
+def _quote_path(path):
+    return "'" + path.replace("'", "''") + "'"
+
+
+def build_snapshot(table_name):
+    """
+    Write a Parquet snapshot of a table from the analytics database.
+
+    Returns False if the table is gone, its data changed while the snapshot was
+    written, or a column holds values its declared type can't (ingest keeps
+    values that don't fit the inferred type as text).
+    """
+    from .ingest import get_table_column_types, quote_identifier
+
+    version = snapshot_version(table_name)
+    build_dir = new_build_dir(table_name)
+    try:
+        duck = _duckdb_cursor()
+        batch_rows = settings.COLUMNAR_SNAPSHOT_ROWS
+        with analytics_connection().cursor() as cursor:
+            column_types = get_table_column_types(cursor, table_name)
+            if column_types is None:
+                shutil.rmtree(build_dir, ignore_errors=True)
+                return False
+            cursor.execute(f'SELECT * FROM {quote_identifier(table_name)}')
+            columns = [col[0] for col in cursor.description]
+            select_list = ', '.join(
+                f'CAST({quote_identifier(col)} AS {DUCKDB_TYPES[column_types.get(col, "TEXT")]}) '
+                f'AS {quote_identifier(col)}'
+                for col in columns
+            )
+            part = 0
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows and part:
+                    break
+                # An empty table still gets one (empty) file carrying the column types
+                duck.register('snapshot_batch', pd.DataFrame.from_records(rows, columns=columns))
+                try:
+                    duck.execute(
+                        f'COPY (SELECT {select_list} FROM snapshot_batch) '
+                        f'TO {_quote_path(os.path.join(build_dir, part_name(part)))} '
+                        f'(FORMAT parquet, COMPRESSION zstd)'
+                    )
+                finally:
+                    duck.unregister('snapshot_batch')
+                part += 1
+                if len(rows) < batch_rows:
+                    break
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    return publish_snapshot(table_name, build_dir, version)
+
+
+def _run_build(table_name, version):
+    try:
+        if build_snapshot(table_name):
+            logger.info(f"Built columnar snapshot of {table_name}")
+    except Exception as e:
+        logger.warning(f"Could not build a columnar snapshot of {table_name}: {str(e)}")
+        with _builder_lock:
+            _failed[table_name] = version
+    finally:
+        with _builder_lock:
+            _pending.discard(table_name)
+        # The builder thread gets its own connections; don't leak them
+        connections.close_all()
+
+
+def request_snapshot(table_name):
+    """Schedule a background build of a table's snapshot (once at a time per table)."""
+    global _builder
+    version = snapshot_version(table_name)
+    with _builder_lock:
+        if table_name in _pending or _failed.get(table_name) == version:
+            return
+        _pending.add(table_name)
+        if _builder is None:
+            _builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='columnar-snapshot')
+    _builder.submit(_run_build, table_name, version)
+
+
+def _duckdb_cursor():
+    """This thread's connection to the process-wide in-memory DuckDB database."""
+    global _database
+    cursor = getattr(_local, 'cursor', None)
+    if cursor is None:
+        import duckdb
+
+        with _database_lock:
+            if _database is None:
+                config = {}
+                if settings.DUCKDB_THREADS:
+                    config['threads'] = settings.DUCKDB_THREADS
+                if settings.DUCKDB_MEMORY_LIMIT:
+                    config['memory_limit'] = settings.DUCKDB_MEMORY_LIMIT
+                database = duckdb.connect(':memory:', config=config)
+                # SQLite semantics generated SQL may rely on
+                database.execute('SET GLOBAL integer_division = true')
+                database.execute("SET GLOBAL default_null_order = 'nulls_first_on_asc_last_on_desc'")
+                _restrict(database)
+                _database = database
+            cursor = _database.cursor()
+        _local.cursor = cursor
+    return cursor
+
+
+def _restrict(database):
+    """
+    Keep generated SQL away from the server's files: only the snapshot directory
+    can be read or written, unknown names don't resolve to Python variables, and
+    no setting can be changed afterwards (the last step).
+    """
+    snapshot_dir = os.path.join(os.path.abspath(settings.COLUMNAR_SNAPSHOT_DIR), '')
+    database.execute(f'SET allowed_directories = [{_quote_path(snapshot_dir)}]')
+    database.execute('SET enable_external_access = false')
+    database.execute('SET python_enable_replacements = false')
+    database.execute('SET lock_configuration = true')
+
+
+def _walk(node):
+    """Every dict in a json_serialize_sql tree."""
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def check_sources(cursor, sql, tables):
+    """
+    Raise QueryRejected unless ``sql`` only reads the ``tables`` (and its own CTEs).
+
+    Returns False when DuckDB can't parse ``sql`` as a single SELECT, so it
+    can't run it either.
+    """
+    tree = json.loads(cursor.execute('SELECT json_serialize_sql(?)', [sql]).fetchone()[0])
+    if tree.get('error') or len(tree['statements']) != 1:
+        return False
+    nodes = list(_walk(tree['statements']))
+    allowed = {table.lower() for table in tables}
+    allowed.update(
+        entry['key'].lower() for node in nodes if isinstance(node.get('cte_map'), dict)
+        for entry in node['cte_map']['map']
+    )
+    for node in nodes:
+        if node.get('type') == 'TABLE_FUNCTION':
+            source = node['function'].get('function_name', 'a table function')
+        elif node.get('type') == 'BASE_TABLE' and (
+                node['schema_name'] or node['catalog_name'] or node['table_name'].lower() not in allowed):
+            source = '.'.join(filter(None, [node['catalog_name'], node['schema_name'], node['table_name']]))
+        else:
+            continue
+        logger.warning(f"Refused a query reading {source}: {sql}")
+        raise QueryRejected(f"This query reads from {source}, which is not one of this database's tables.")
+    return True
+
+
+def to_duckdb_sql(sql):
+    """Rewrite SQLite SQL where DuckDB would run it differently: LIKE becomes ILIKE."""
+    statement = sqlparse.parse(sql)[0]
+    return ''.join(
+        LIKE_RE.sub('ILIKE', str(token)) if token.ttype in T.Operator.Comparison else str(token)
+        for token in statement.flatten()
+    )
+
+
+def referenced_tables(sql, tables):
+    """The names in ``tables`` that appear in ``sql`` as identifiers."""
+    return [
+        table for table in tables
+        if re.search(r'(?<![\w$])' + re.escape(table) + r'(?![\w$])', sql, re.IGNORECASE)
+    ]
+
+
+def run_select(sql, tables, max_rows=None, guard=None):
+    """
+    Run a SELECT on DuckDB over the snapshots of the ``tables`` it reads.
+
+    Returns (rows, columns), or None when the query has to run on SQLite: the
+    engine is off, a table it reads has no snapshot yet (one is scheduled), or
+    DuckDB can't run it. A QueryGuard ``guard`` interrupts it, raising its
+    QueryTimeout or QueryCancelled.
+    """
+    if not engine_enabled():
+        return None
+    import duckdb
+
+    used = referenced_tables(sql, tables)
+    if not used:
+        return None
+    missing = [table for table in used if not has_snapshot(table)]
+    for table in missing:
+        request_snapshot(table)
+    if missing:
+        return None
+
+    from .ingest import quote_identifier
+
+    cursor = _duckdb_cursor()
+    try:
+        duckdb_sql = to_duckdb_sql(sql)
+        if not check_sources(cursor, duckdb_sql, tables):
+            return None
+        for table in used:
+            cursor.execute(
+                f'CREATE OR REPLACE TEMP VIEW {quote_identifier(table)} AS '
+                f'SELECT * FROM read_parquet({_quote_path(os.path.join(snapshot_path(table), "*.parquet"))}, '
+                f'union_by_name = true)'
+            )
+        if max_rows:
+            # DuckDB computes the whole result before the first fetch; a LIMIT lets it stop early
+            duckdb_sql = f'SELECT * FROM ({duckdb_sql}) AS result_rows LIMIT {int(max_rows)}'
+        with guard.watching(cursor.interrupt) if guard else contextlib.nullcontext():
+            cursor.execute(duckdb_sql)
+            rows = cursor.fetchall()
+        columns = [col[0] for col in cursor.description] if cursor.description else []
+    except duckdb.Error as e:
+        if guard is not None and guard.reason is not None:
+            raise guard.interrupted_error() from None
+        logger.info(f"DuckDB could not run the query, using SQLite: {str(e).splitlines()[0]}")
+        return None
+    return rows, sqlite_column_names(sql) or columns
+
+
+def sqlite_column_names(sql):
+    """
+    The column names SQLite gives a query's result, e.g. COUNT(*) where DuckDB
+    says count_star(). SQLite stops a LIMIT 0 query before reading any rows.
+    """
+    try:
+        with analytics_connection().cursor() as cursor:
+            cursor.execute(f'SELECT * FROM ({sql}) AS result_columns LIMIT 0')
+            return [col[0] for col in cursor.description]
+    except DatabaseError:
+        return None
@@ -0,0 +1,48 @@
+"""
+Database connections: the analytics store and per-connection setup.
+
+Uploaded tables live in the ANALYTICS_DATABASE alias, apart from Django's
+own tables (users, sessions, datasets, conversations) in ``default``, so bulk
+loads and analytical scans never hold the lock ORM writes wait on. Code that
+touches user tables goes through analytics_connection() and
+``transaction.atomic(using=settings.ANALYTICS_DATABASE)``.
+
+Django opens a new SQLite connection per thread (and again after
+CONN_MAX_AGE), so settings that only live for a connection, such as the
+page cache, mmap size and busy timeout, are applied from the
+connection_created signal. journal_mode=WAL is stored in the database file;
+setting it again is a no-op.
+"""
+import logging
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+
+def analytics_connection():
+    """The connection holding uploaded tables."""
+    return connections[settings.ANALYTICS_DATABASE]
+
+
+class AnalyticsRouter:
+    """Keep Django's own tables out of the analytics database."""
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == settings.ANALYTICS_DATABASE and db != DEFAULT_DB_ALIAS:
+            return False
+        return None
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """connection_created receiver: run the SQLITE_PRAGMAS on a new SQLite connection."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+            if name == 'journal_mode':
+                mode = cursor.fetchone()[0]
+                # In-memory databases (tests) can't use WAL and report "memory"
+                if mode.lower() != str(value).lower() and mode != 'memory':
+                    logger.warning(f"SQLite journal_mode is {mode}, not {value}")
@@ -0,0 +1,216 @@
+"""
+Streaming export of a conversation's query result as CSV, NDJSON or Parquet.
+
+The stored SELECT is re-run and rows are pulled from the cursor in batches of
+EXPORT_BATCH_ROWS, encoded and handed to StreamingHttpResponse one chunk at a
+time, so memory stays flat however large the result is. A SELECT that only
+picks columns of one table reads them from the table's Parquet snapshot when
+there is one; otherwise the cursor runs under the QueryGuard the caller
+passes, so an export stops at the user's time limit like any other query.
+Parquet needs pyarrow and writes one row group per batch. Under ASGI the
+chunks are handed over as an async iterator (see aiter_chunks).
+"""
+import contextlib
+import csv
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from .db import analytics_connection
+from .snapshots import snapshot_batches, table_projection
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def iter_row_batches(sql, batch_rows=None, guard=None):
+    """
+    Yield (columns, rows) batches of at most ``batch_rows`` rows for ``sql``.
+
+    An empty result still yields one (columns, []) batch so headers get written.
+    Reading the table is interrupted by the QueryGuard ``guard``, raising its
+    QueryTimeout or QueryCancelled.
+    """
+    batch_rows = batch_rows or settings.EXPORT_BATCH_ROWS
+    snapshot_rows = _iter_snapshot_batches(sql, batch_rows)
+    if snapshot_rows is not None:
+        yield from snapshot_rows
+        return
+    connection = analytics_connection()
+    with connection.cursor() as cursor, guard.running(connection) if guard else contextlib.nullcontext():
+        cursor.execute(sql)
+        columns = [col[0] for col in cursor.description] if cursor.description else []
+        rows = cursor.fetchmany(batch_rows)
+        yield columns, rows
+        while rows:
+            rows = cursor.fetchmany(batch_rows)
+            if rows:
+                yield columns, rows
+
+
+def _iter_snapshot_batches(sql, batch_rows):
+    """iter_row_batches from the snapshot, for a column projection of one table; else None."""
+    projection = table_projection(sql)
+    if projection is None:
+        return None
+    table_name, columns, limit = projection
+    batches = snapshot_batches(table_name, batch_rows, columns)
+    if batches is None:
+        return None
+
+    def rows():
+        columns = next(batches)
+        remaining = limit
+        yielded = False
+        for batch in batches:
+            if remaining is not None:
+                batch = batch[:remaining]
+                remaining -= len(batch)
+            if batch:
+                yield columns, batch
+                yielded = True
+            if remaining == 0:
+                break
+        if not yielded:
+            yield columns, []
+
+    return rows()
+
+
+class _LineBuffer:
+    """File-like object whose write() hands back what was written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(sql, batch_rows=None, guard=None):
+    writer = csv.writer(_LineBuffer())
+    header_written = False
+    for columns, rows in iter_row_batches(sql, batch_rows, guard):
+        chunk = [] if header_written else [writer.writerow(columns)]
+        header_written = True
+        chunk.extend(writer.writerow(row) for row in rows)
+        yield ''.join(chunk)
+
+
+def iter_ndjson(sql, batch_rows=None, guard=None):
+    for columns, rows in iter_row_batches(sql, batch_rows, guard):
+        yield ''.join(
+            json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n' for row in rows
+        )
+
+
+class _ChunkSink:
+    """Write-only file object that collects bytes until the caller drains them."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _arrow_column(values, arrow_type, pa):
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+        # SQLite columns can hold mixed types; values that don't fit the column's
+        # type (inferred from the first batch) are written as null
+        converted = []
+        for value in values:
+            try:
+                pa.array([value], type=arrow_type)
+                converted.append(value)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+                converted.append(None)
+        logger.warning(f"Parquet export: {converted.count(None) - values.count(None)} value(s) didn't fit {arrow_type}")
+        return pa.array(converted, type=arrow_type)
+
+
+def iter_parquet(sql, batch_rows=None, guard=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+    schema = None
+    try:
+        for columns, rows in iter_row_batches(sql, batch_rows, guard):
+            values = [[row[i] for row in rows] for i in range(len(columns))]
+            if writer is None:
+                fields = []
+                for name, col in zip(columns, values):
+                    arrow_type = pa.array(col).type
+                    # All-null first batch: fall back to strings
+                    fields.append(pa.field(name, pa.string() if pa.types.is_null(arrow_type) else arrow_type))
+                schema = pa.schema(fields)
+                writer = pq.ParquetWriter(sink, schema)
+            arrays = [_arrow_column(col, field.type, pa) for col, field in zip(values, schema)]
+            if rows:
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def iter_export(sql, export_format, batch_rows=None, guard=None):
+    """Return a chunk iterator encoding the rows of ``sql`` as ``export_format`` (see iter_row_batches for ``guard``)."""
+    if export_format == 'csv':
+        return iter_csv(sql, batch_rows, guard)
+    if export_format == 'ndjson':
+        return iter_ndjson(sql, batch_rows, guard)
+    if export_format == 'parquet':
+        # Fail before the response starts rather than halfway through it
+        import pyarrow  # noqa: F401
+        return iter_parquet(sql, batch_rows, guard)
+    raise ValueError(f"Unsupported export format: {export_format}")
+
+
+async def aiter_chunks(chunks):
+    """
+    Async iterator over the sync iterator ``chunks``, one batch at a time.
+
+    Under ASGI, StreamingHttpResponse reads a sync iterator to the end before
+    sending anything. Each step runs in the thread that runs the other sync
+    code (thread_sensitive), so the cursor stays on the thread of its connection.
+    """
+    done = object()
+    next_chunk = sync_to_async(next)
+    try:
+        while True:
+            # StopIteration can't be raised into a coroutine; ask for a sentinel instead
+            chunk = await next_chunk(chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        # Close the cursor even if the client went away mid-export
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,299 @@
+"""
+Guardrails for running generated SQL: cost checks, LIMITs, time limits and cancellation.
+
+Whatever the model writes runs against the analytics database, so one
+accidental cross join could otherwise pin a worker indefinitely. Before a
+question's statements run, SQLite's EXPLAIN QUERY PLAN is turned into an
+estimate of the rows they would examine, and statements over the user's
+max_cost are refused. A SELECT without a LIMIT gets one. While statements
+run, a QueryGuard interrupts them once they pass the user's timeout or their
+job is cancelled: through SQLite's progress handler, PostgreSQL's
+statement_timeout, or a watcher thread calling DuckDB's interrupt().
+
+Limits come from the QUERY_* settings, overridden per user by a QueryLimit
+row (editable in the Django admin). Cancelling a job sets a flag in the
+default cache; with several worker processes, point REDIS_URL at Redis so a
+cancel request reaches the process running the query.
+"""
+import contextlib
+import logging
+import threading
+import time
+from collections import defaultdict
+import sqlparse
+from sqlparse import tokens as T
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+# SQLite virtual machine instructions between two progress handler calls
+PROGRESS_HANDLER_OPS = 10000
+# Rows SQLite itself assumes an index equality lookup returns without statistics
+SEARCH_EQUALITY_ROWS = 10
+
+
+class QueryRejected(Exception):
+    """A query refused before it ran: it would examine too many rows, or reads what it may not (see columnar)."""
+
+
+class QueryTimeout(Exception):
+    """A query interrupted after running longer than its time limit."""
+
+
+class QueryCancelled(Exception):
+    """A query interrupted because its job was cancelled."""
+
+
+def get_query_limits(user_id=None):
+    """
+    Guardrail limits for a user (by id; None for anonymous): {'timeout', 'max_rows', 'max_cost'}.
+
+    Fields of the user's QueryLimit override the QUERY_TIMEOUT, QUERY_MAX_ROWS
+    and QUERY_MAX_COST settings; 0 means no limit.
+    """
+    from .models import QueryLimit
+
+    limits = {
+        'timeout': settings.QUERY_TIMEOUT,
+        'max_rows': settings.QUERY_MAX_ROWS,
+        'max_cost': settings.QUERY_MAX_COST,
+    }
+    if user_id is not None:
+        overrides = QueryLimit.objects.filter(user_id=user_id).values('timeout', 'max_rows', 'max_cost').first()
+        for name, value in (overrides or {}).items():
+            if value is not None:
+                limits[name] = value
+    return limits
+
+
+def is_select(sql):
+    """Whether ``sql`` is a SELECT, including one that opens with WITH."""
+    parsed = sqlparse.parse(sql)
+    return bool(parsed) and parsed[0].get_type() == 'SELECT'
+
+
+def is_read_statement(sql):
+    """Whether ``sql`` only reads: a SELECT (see is_select) or a PRAGMA."""
+    return sql.lstrip().upper().startswith('PRAGMA') or is_select(sql)
+
+
+def _has_top_level_limit(statement):
+    return any(token.ttype is T.Keyword and token.normalized == 'LIMIT' for token in statement.tokens)
+
+
+def add_limit(sql, max_rows):
+    """``sql`` with ``LIMIT max_rows`` appended when it is a SELECT without a LIMIT of its own."""
+    if not max_rows:
+        return sql
+    parsed = sqlparse.parse(sql)
+    if not parsed or parsed[0].get_type() != 'SELECT' or _has_top_level_limit(parsed[0]):
+        return sql
+    # On its own line, so a trailing -- comment can't swallow it
+    return f'{sql}\nLIMIT {int(max_rows)}'
+
+
+def _table_rows(cursor, sql):
+    """Approximate row counts of the tables ``sql`` mentions, by lower-cased name."""
+    from .columnar import referenced_tables
+    from .ingest import quote_identifier
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    rows = {}
+    for table in referenced_tables(sql, [name for (name,) in cursor.fetchall()]):
+        # The largest rowid: an index lookup, unlike COUNT(*)
+        cursor.execute(f'SELECT MAX(rowid) FROM {quote_identifier(table)}')
+        rows[table.lower()] = cursor.fetchone()[0] or 0
+    return rows
+
+
+def estimate_rows_examined(cursor, sql):
+    """
+    Estimate how many rows SQLite would visit to run ``sql``, from EXPLAIN QUERY PLAN.
+
+    Nested loops multiply: every table scanned inside another loop is visited
+    once per row of the loops around it. Scans are assumed to keep every row
+    and index equality lookups to find SEARCH_EQUALITY_ROWS, so the estimate
+    errs high. The plan names tables by their alias; an alias that isn't a
+    subquery counts as the largest table the query mentions.
+    """
+    cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+    children = defaultdict(list)
+    for node_id, parent, _, detail in cursor.fetchall():
+        children[parent].append((node_id, detail))
+    table_rows = _table_rows(cursor, sql)
+    largest = max(table_rows.values(), default=0)
+    subquery_rows = {}
+
+    def source_rows(name):
+        name = name.strip('"').lower()
+        return subquery_rows.get(name, table_rows.get(name, largest))
+
+    def walk(parent):
+        """(rows examined, rows produced) by the loops under ``parent``."""
+        examined, loop_rows, nested_rows = 0, 1, 0
+        for node_id, detail in children[parent]:
+            words = detail.split()
+            if words[0] in ('SCAN', 'SEARCH') and words[1] != 'CONSTANT':
+                rows = source_rows(words[1])
+                if words[0] == 'SEARCH':
+                    if 'AUTOMATIC' in detail:
+                        # SQLite builds a throwaway index over the whole table first
+                        examined += rows
+                    if '(rowid=?)' in detail:
+                        rows = 1
+                    elif '>' in detail or '<' in detail:
+                        rows = max(rows // 4, 1)
+                    else:
+                        rows = min(rows, SEARCH_EQUALITY_ROWS)
+                examined += loop_rows * rows
+                loop_rows *= max(rows, 1)
+            elif words[0] in ('MATERIALIZE', 'CO-ROUTINE'):
+                sub_examined, sub_rows = walk(node_id)
+                examined += sub_examined
+                subquery_rows[words[1].strip('"').lower()] = sub_rows
+            elif words[0] == 'CORRELATED':
+                # Re-run for every row of the loops so far
+                sub_examined, _ = walk(node_id)
+                examined += loop_rows * sub_examined
+            elif words[0] != 'USE':
+                # Subqueries run once, compound SELECT parts, OR-by-union index lookups
+                sub_examined, sub_rows = walk(node_id)
+                examined += sub_examined
+                nested_rows += sub_rows
+        return examined, max(loop_rows, nested_rows)
+
+    return walk(0)[0]
+
+
+def check_cost(connection, sql_statements, max_cost):
+    """
+    Raise QueryRejected if a statement would examine more than ``max_cost`` rows.
+
+    Only SQLite plans are read; a statement that can't be explained yet (it
+    uses a table an earlier statement creates) is left to the time limit.
+    """
+    if not max_cost or connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for sql in sql_statements:
+            try:
+                rows = estimate_rows_examined(cursor, sql)
+            except DatabaseError:
+                continue
+            if rows > max_cost:
+                logger.warning(f"Rejected a query estimated to examine {rows} rows: {sql}")
+                raise QueryRejected(
+                    f"This query would examine about {rows:,} rows, more than the {max_cost:,} allowed. "
+                    f"Try a narrower question, for example with a filter or without joining every row to every row."
+                )
+
+
+def cancel_key(job_id):
+    """Cache key request_cancel sets for job ``job_id``, polled by its QueryGuard."""
+    return f'query-job-cancelled:{job_id}'
+
+
+def request_cancel(job_id):
+    """Ask the process running ``job_id``'s query to interrupt it."""
+    cache.set(cancel_key(job_id), True, settings.QUERY_JOB_TIMEOUT)
+
+
+class QueryGuard:
+    """
+    Time limit and cancellation for the statements of one question (or one result page).
+
+    The clock starts when the guard is created. ``job_id`` ties it to a
+    background job whose cancellation interrupts it.
+    """
+
+    def __init__(self, timeout=None, job_id=None):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.job_id = job_id
+        self.reason = None
+        self._next_cancel_check = 0
+
+    def should_interrupt(self):
+        """Whether the statements must stop now; remembers why."""
+        if self.reason is not None:
+            return True
+        now = time.monotonic()
+        if self.deadline is not None and now >= self.deadline:
+            self.reason = 'timeout'
+        elif self.job_id is not None and now >= self._next_cancel_check:
+            self._next_cancel_check = now + settings.QUERY_CANCEL_CHECK_INTERVAL
+            if cache.get(cancel_key(self.job_id)):
+                self.reason = 'cancelled'
+        return self.reason is not None
+
+    def interrupted_error(self):
+        if self.reason == 'cancelled':
+            return QueryCancelled("The query was cancelled.")
+        return QueryTimeout(
+            f"The query was stopped after {self.timeout:g} seconds. Try a narrower question."
+        )
+
+    @contextlib.contextmanager
+    def running(self, connection):
+        """Interrupt statements run on ``connection`` (a Django connection) inside the block."""
+        if connection.vendor == 'sqlite':
+            connection.ensure_connection()
+            raw_connection = connection.connection
+            interrupted = []
+
+            def progress():
+                # Only the running statement is interrupted, not the ROLLBACK after it
+                if not interrupted and self.should_interrupt():
+                    interrupted.append(True)
+                    return 1
+                return 0
+
+            raw_connection.set_progress_handler(progress, PROGRESS_HANDLER_OPS)
+            try:
+                yield
+            except OperationalError:
+                if self.reason is not None:
+                    raise self.interrupted_error() from None
+                raise
+            finally:
+                raw_connection.set_progress_handler(None, 0)
+        elif connection.vendor == 'postgresql' and self.deadline is not None:
+            # Cancellation is only noticed between statements here
+            with connection.cursor() as cursor:
+                remaining_ms = max(int((self.deadline - time.monotonic()) * 1000), 1)
+                cursor.execute(f'SET statement_timeout = {remaining_ms}')
+            try:
+                yield
+            except OperationalError as e:
+                if 'statement timeout' in str(e):
+                    self.reason = 'timeout'
+                    raise self.interrupted_error() from None
+                raise
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute('RESET statement_timeout')
+        else:
+            yield
+
+    @contextlib.contextmanager
+    def watching(self, interrupt):
+        """Call ``interrupt`` from a watcher thread once the statements must stop (for DuckDB)."""
+        if self.deadline is None and self.job_id is None:
+            yield
+            return
+        done = threading.Event()
+
+        def watch():
+            while not done.wait(settings.QUERY_CANCEL_CHECK_INTERVAL):
+                if self.should_interrupt():
+                    interrupt()
+                    return
+
+        watcher = threading.Thread(target=watch, name='query-guard', daemon=True)
+        watcher.start()
+        try:
+            yield
+        finally:
+            done.set()
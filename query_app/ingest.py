@@ -0,0 +1,418 @@
+"""
+Streaming ingestion of uploaded CSV/Excel files into database tables.
+
+Files are read in bounded chunks (CSV through pandas' chunked reader, Excel
+row-by-row through openpyxl's read-only mode) and every chunk is written with
+a batched ``executemany`` inside one transaction, so peak memory depends on
+the chunk size rather than the size of the upload.
+
+Cells are read as text. Column types are inferred once from a sample of the
+first chunk, the table is created with matching column types, and every chunk
+is coerced to those types before it is written. Queries then compare numbers
+and dates natively instead of as strings. A date column with a value that is
+no date, in whichever chunk it turns up, is widened to TEXT rather than lose
+the value (see widen_to_text).
+
+Each coerced chunk is also profiled (see column_stats) and written to the
+table's Parquet snapshot (see snapshots), so column statistics and the
+columnar copy come out of the same single pass over the file.
+"""
+import logging
+import re
+from datetime import datetime
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from . import column_stats
+from .db import analytics_connection
+from .snapshots import SnapshotWriter, snapshot_batches
+
+
+logger = logging.getLogger(__name__)
+
+# Column types recorded in Dataset.columns and used as declared SQL types
+COLUMN_TYPES = ('INTEGER', 'REAL', 'BOOLEAN', 'DATE', 'DATETIME', 'TEXT')
+
+# Integers with leading zeros (zip codes, IDs) or more digits than a float can
+# hold exactly are kept as text
+INTEGER_RE = re.compile(r'^[+-]?(0|[1-9]\d{0,14})$')
+REAL_RE = re.compile(r'^[+-]?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][+-]?\d+)?$')
+BOOLEAN_VALUES = {'true': 1, 'false': 0, 'yes': 1, 'no': 0, 't': 1, 'f': 0, 'y': 1, 'n': 0}
+
+# Candidate formats; ties for the format of most sampled values go to the first
+DATE_FORMATS = [
+    ('%Y-%m-%d', 'DATE'),
+    ('%m/%d/%Y', 'DATE'),
+    ('%d/%m/%Y', 'DATE'),
+    ('%d.%m.%Y', 'DATE'),
+    ('%Y-%m-%d %H:%M:%S', 'DATETIME'),
+    ('%Y-%m-%dT%H:%M:%S', 'DATETIME'),
+    ('%Y-%m-%d %H:%M', 'DATETIME'),
+    ('%m/%d/%Y %H:%M', 'DATETIME'),
+]
+OUTPUT_FORMATS = {'DATE': '%Y-%m-%d', 'DATETIME': '%Y-%m-%d %H:%M:%S'}
+DATE_FORMAT_TYPES = dict(DATE_FORMATS)
+
+# Declared types of tables created before type inference existed
+LEGACY_TYPES = {'BIGINT': 'INTEGER', 'FLOAT': 'REAL', 'DOUBLE': 'REAL', 'TIMESTAMP': 'DATETIME'}
+
+
+def quote_identifier(name):
+    """Quote a table or column name for use in SQL."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def infer_column_type(sample):
+    """
+    Infer the column type of a Series of strings.
+
+    Returns a (type, date_format) tuple; date_format is None for columns
+    without dates.
+    """
+    values = sample.dropna().astype(str).str.strip()
+    values = values[values != '']
+    if values.empty:
+        return 'TEXT', None
+
+    if values.str.match(INTEGER_RE).all():
+        return 'INTEGER', None
+    if values.str.match(REAL_RE).all():
+        return 'REAL', None
+    if values.str.lower().isin(BOOLEAN_VALUES.keys()).all():
+        return 'BOOLEAN', None
+
+    # Only try date formats on values that start like a date. The format most
+    # of them are in decides the type; a column with values that aren't dates
+    # of that type is TEXT with that format, as if it had been widened (see
+    # widen_to_text), so its dates are still written in canonical form.
+    looks_like_date = values.str.match(r'^\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}')
+    if looks_like_date.mean() > 0.5:
+        dates = values[looks_like_date]
+        matches = {fmt: pd.to_datetime(dates, format=fmt, errors='coerce').notna().sum() for fmt, _ in DATE_FORMATS}
+        date_format = max(matches, key=matches.get)
+        if format_dates(dates, DATE_FORMAT_TYPES[date_format], date_format).notna().all():
+            return (DATE_FORMAT_TYPES[date_format] if looks_like_date.all() else 'TEXT'), date_format
+
+    return 'TEXT', None
+
+
+def infer_column_types(chunk, sample_rows=None):
+    """Infer a (type, date_format) per column from an evenly spaced sample of ``chunk``."""
+    sample_rows = sample_rows or settings.INGEST_SAMPLE_ROWS
+    step = max(1, len(chunk) // sample_rows)
+    sample = chunk.iloc[::step]
+    return {col: infer_column_type(sample[col]) for col in chunk.columns}
+
+
+def parse_dates(series, date_format=None):
+    """
+    Parse a Series of strings as datetimes, value by value: in ``date_format``
+    first, then in the other DATE_FORMATS, then as ISO 8601. NaT where none fits.
+    """
+    values = series.where(series.isna(), series.astype(str).str.strip())
+    parsed = pd.Series(pd.NaT, index=series.index, dtype='datetime64[ns]')
+    formats = [date_format] if date_format else []
+    formats += [fmt for fmt, _ in DATE_FORMATS if fmt != date_format]
+    for fmt in formats + ['ISO8601']:
+        missing = parsed.isna() & values.notna()
+        if not missing.any():
+            break
+        if fmt == 'ISO8601':
+            # Offsets are converted to UTC; the columns have no time zone
+            converted = pd.to_datetime(values[missing], format=fmt, errors='coerce', utc=True).dt.tz_convert(None)
+        else:
+            converted = pd.to_datetime(values[missing], format=fmt, errors='coerce')
+        parsed[missing] = converted
+    return parsed
+
+
+def format_dates(series, col_type, date_format=None):
+    """
+    Values of ``series`` that are ``col_type`` ('DATE' or 'DATETIME') values,
+    as canonical text; NaN for the rest. A DATE value has no time of day.
+    """
+    parsed = parse_dates(series, date_format)
+    if col_type == 'DATE':
+        parsed = parsed.where(parsed == parsed.dt.normalize())
+    return parsed.dt.strftime(OUTPUT_FORMATS[col_type]).astype(object)
+
+
+def supplied_values(series):
+    """Mask of the cells of ``series`` holding a value (not missing or blank)."""
+    return series.notna() & (series.astype(str).str.strip() != '')
+
+
+def confirm_date_columns(chunk, column_types):
+    """
+    Make date columns TEXT when a value of ``chunk`` isn't a date (see widen_to_text).
+
+    The sample can miss such values; checking the whole first chunk before the
+    table is created saves rebuilding it for the first of them.
+    """
+    for col, (col_type, date_format) in column_types.items():
+        if col_type in OUTPUT_FORMATS:
+            series = chunk[col]
+            if (format_dates(series, col_type, date_format).isna() & supplied_values(series)).any():
+                column_types[col] = ('TEXT', date_format)
+    return column_types
+
+
+def coerce_series(series, col_type, date_format=None):
+    """
+    Convert a Series of strings to ``col_type``.
+
+    Values that don't fit the inferred type (the sample can miss them) are
+    kept as their original text rather than dropped. DATE and DATETIME
+    columns can't hold text (the database driver parses them on every read),
+    so values that aren't dates come back as NaN and ingest_file widens the
+    column to TEXT. A TEXT column with a ``date_format`` is such a widened
+    date column: its dates are written as canonical text, the rest as given.
+    """
+    if col_type == 'TEXT':
+        if date_format is None:
+            return series
+        dates = format_dates(series, DATE_FORMAT_TYPES[date_format], date_format)
+        return dates.where(dates.notna(), series)
+
+    if col_type in ('INTEGER', 'REAL'):
+        converted = pd.to_numeric(series, errors='coerce')
+        if col_type == 'INTEGER':
+            converted = converted.where(converted.round() == converted).astype('Int64')
+    elif col_type == 'BOOLEAN':
+        converted = series.str.strip().str.lower().map(BOOLEAN_VALUES).astype('Int64')
+    else:
+        return format_dates(series, col_type, date_format)
+
+    converted = converted.astype(object)
+    return converted.where(converted.notna() | series.isna(), series)
+
+
+def _excel_cell_to_text(value):
+    """Render an openpyxl cell value the way it would appear in a CSV export."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime):
+        if value.hour == value.minute == value.second == value.microsecond == 0:
+            return value.strftime('%Y-%m-%d')
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def iter_csv_chunks(file, chunk_rows):
+    """Yield DataFrames of at most ``chunk_rows`` rows from a CSV file."""
+    yield from pd.read_csv(file, chunksize=chunk_rows, dtype=str)
+
+
+def iter_excel_chunks(file, chunk_rows):
+    """Yield DataFrames of at most ``chunk_rows`` rows from the first sheet of a workbook."""
+    if file.name.lower().endswith('.xls'):
+        # openpyxl cannot open legacy .xls workbooks, so fall back to pandas
+        df = pd.read_excel(file, dtype=str)
+        for start in range(0, max(len(df), 1), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h) if h is not None else f'Unnamed: {i}' for i, h in enumerate(header)]
+        width = len(header)
+
+        batch = []
+        yielded = False
+        for row in rows:
+            # Read-only sheets may report ragged rows; pad/trim to the header width
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            if all(value is None for value in row):
+                continue
+            batch.append(tuple(_excel_cell_to_text(value) for value in row))
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame.from_records(batch, columns=header)
+                batch = []
+                yielded = True
+        if batch or not yielded:
+            yield pd.DataFrame.from_records(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def iter_file_chunks(file, chunk_rows):
+    """Pick the chunked reader matching the file extension."""
+    name = file.name.lower()
+    if name.endswith('.csv'):
+        return iter_csv_chunks(file, chunk_rows)
+    if name.endswith(('.xls', '.xlsx')):
+        return iter_excel_chunks(file, chunk_rows)
+    raise ValueError("Unsupported file format. Please upload CSV or Excel files.")
+
+
+def chunk_to_rows(chunk):
+    """Convert a DataFrame chunk to a list of DB-API parameter tuples."""
+    # astype(object) turns numpy scalars into plain Python values the driver can bind
+    chunk = chunk.astype(object).where(chunk.notna(), None)
+    return list(chunk.itertuples(index=False, name=None))
+
+
+def get_table_column_types(cursor, table_name):
+    """Return {column: type} for an existing table, or None if it doesn't exist."""
+    introspection = analytics_connection().introspection
+    if table_name not in introspection.table_names(cursor):
+        return None
+    column_types = {}
+    for field in introspection.get_table_description(cursor, table_name):
+        declared = str(field.type_code or '').upper()
+        declared = LEGACY_TYPES.get(declared, declared)
+        column_types[field.name] = declared if declared in COLUMN_TYPES else 'TEXT'
+    return column_types
+
+
+def widen_to_text(cursor, table_name, column):
+    """Change ``column`` of ``table_name`` to TEXT, keeping its rows (SQLite has to rebuild the table)."""
+    quoted_table = quote_identifier(table_name)
+    quoted_column = quote_identifier(column)
+    if analytics_connection().vendor != 'sqlite':
+        cursor.execute(f'ALTER TABLE {quoted_table} ALTER COLUMN {quoted_column} TYPE TEXT USING {quoted_column}::text')
+        return
+    column_types = get_table_column_types(cursor, table_name)
+    column_types[column] = 'TEXT'
+    column_defs = ', '.join(f'{quote_identifier(col)} {col_type}' for col, col_type in column_types.items())
+    rebuilt = quote_identifier(f'{table_name}__widened')
+    cursor.execute(f'CREATE TABLE {rebuilt} ({column_defs})')
+    cursor.execute(f'INSERT INTO {rebuilt} SELECT * FROM {quoted_table}')
+    cursor.execute(f'DROP TABLE {quoted_table}')
+    cursor.execute(f'ALTER TABLE {rebuilt} RENAME TO {quoted_table}')
+
+
+def ingest_file(file, table_name, mode='replace', chunk_rows=None):
+    """
+    Stream an uploaded file into ``table_name``.
+
+    Args:
+        file: File-like object with a ``name`` attribute (CSV, XLS or XLSX)
+        table_name: Destination table
+        mode: 'replace' drops and recreates the table, 'append' adds rows to it
+            (coercing to the existing column types)
+        chunk_rows: Rows per chunk/batch (defaults to settings.INGEST_CHUNK_ROWS)
+
+    Returns:
+        Tuple of (columns, number of rows written, profile), where columns is a
+        list of {"name", "type", "nulls"} dicts and profile the column_stats
+        profile of the rows written.
+    """
+    chunk_rows = chunk_rows or settings.INGEST_CHUNK_ROWS
+    chunks = iter_file_chunks(file, chunk_rows)
+    quoted_table = quote_identifier(table_name)
+    column_names = None
+    column_types = None
+    null_counts = None
+    insert_sql = None
+    total_rows = 0
+    profile = None
+
+    # The snapshot is published once the rows are committed, by the outermost transaction
+    with SnapshotWriter(table_name) as snapshot, transaction.atomic(using=settings.ANALYTICS_DATABASE), \
+            analytics_connection().cursor() as cursor:
+        for chunk in chunks:
+            if column_names is None:
+                column_names = [str(col) for col in chunk.columns]
+                chunk.columns = column_names
+                column_types = infer_column_types(chunk)
+
+                existing_types = get_table_column_types(cursor, table_name) if mode == 'append' else None
+                if existing_types:
+                    # Appended rows take the types of the table they land in; a date
+                    # column tries this file's own date format first
+                    for col in column_names:
+                        if col in existing_types:
+                            date_format = column_types[col][1]
+                            if DATE_FORMAT_TYPES.get(date_format) != existing_types[col]:
+                                date_format = None
+                            column_types[col] = (existing_types[col], date_format)
+                else:
+                    confirm_date_columns(chunk, column_types)
+                    column_defs = ', '.join(
+                        f'{quote_identifier(col)} {column_types[col][0]}' for col in column_names
+                    )
+                    if mode == 'replace':
+                        cursor.execute(f'DROP TABLE IF EXISTS {quoted_table}')
+                    cursor.execute(f'CREATE TABLE {quoted_table} ({column_defs})')
+                # An appended part covers every column of the table, in table order
+                snapshot.open(
+                    existing_types or {col: column_types[col][0] for col in column_names},
+                    append=bool(existing_types),
+                )
+
+                null_counts = dict.fromkeys(column_names, 0)
+                quoted_columns = ', '.join(quote_identifier(col) for col in column_names)
+                # Escape literal % so the driver's paramstyle translation leaves it alone
+                insert_sql = f'INSERT INTO {quoted_table} ({quoted_columns})'.replace('%', '%%')
+                insert_sql += f" VALUES ({', '.join(['%s'] * len(column_names))})"
+            else:
+                chunk.columns = column_names
+
+            for col in column_names:
+                col_type, date_format = column_types[col]
+                original = chunk[col]
+                coerced = coerce_series(original, col_type, date_format)
+                if col_type in OUTPUT_FORMATS and (coerced.isna() & supplied_values(original)).any():
+                    # A value that is no date: keep it, as text, rather than store NULL
+                    logger.info(f"{table_name}.{col} holds values that are not {col_type} values; widening it to TEXT")
+                    widen_to_text(cursor, table_name, col)
+                    snapshot.abandon(f"{col} was widened to TEXT")
+                    # The format keeps the column's dates canonical (see coerce_series)
+                    column_types[col] = ('TEXT', date_format or OUTPUT_FORMATS[col_type])
+                    coerced = coerce_series(original, *column_types[col])
+                chunk[col] = coerced
+                null_counts[col] += int(coerced.isna().sum())
+            profile = column_stats.merge_profiles(
+                profile, column_stats.profile_chunk(chunk, {col: column_types[col][0] for col in column_names})
+            )
+
+            snapshot.write(chunk)
+            rows = chunk_to_rows(chunk)
+            if rows:
+                cursor.executemany(insert_sql, rows)
+                total_rows += len(rows)
+
+    if column_names is None:
+        raise ValueError("The uploaded file contains no data.")
+
+    columns = [
+        {"name": col, "type": column_types[col][0], "nulls": null_counts[col]}
+        for col in column_names
+    ]
+    return columns, total_rows, profile
+
+
+def reingest_table(table_name, column_types, batch_rows=None):
+    """
+    Re-create ``table_name`` from its Parquet snapshot instead of the uploaded file.
+
+    ``column_types`` is {column: type} as recorded in Dataset.columns. Returns
+    the number of rows written, or None if the table has no usable snapshot.
+    """
+    batch_rows = batch_rows or settings.INGEST_CHUNK_ROWS
+    batches = snapshot_batches(table_name, batch_rows)
+    if batches is None:
+        return None
+    column_names = next(batches)
+    quoted_table = quote_identifier(table_name)
+    column_defs = ', '.join(f'{quote_identifier(col)} {column_types.get(col, "TEXT")}' for col in column_names)
+    insert_sql = f'INSERT INTO {quoted_table} ({", ".join(quote_identifier(col) for col in column_names)})'
+    insert_sql = insert_sql.replace('%', '%%') + f" VALUES ({', '.join(['%s'] * len(column_names))})"
+
+    total_rows = 0
+    with transaction.atomic(using=settings.ANALYTICS_DATABASE), analytics_connection().cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {quoted_table}')
+        cursor.execute(f'CREATE TABLE {quoted_table} ({column_defs})')
+        for rows in batches:
+            cursor.executemany(insert_sql, rows)
+            total_rows += len(rows)
+    return total_rows
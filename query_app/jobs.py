@@ -0,0 +1,120 @@
+"""
+Background execution of natural language queries.
+
+process_query answers a question inside the request, so under the sync
+gunicorn workers from the Procfile a few slow questions occupy every worker.
+In job mode the request only records a QueryJob and hands it to an
+in-process thread pool; the client then polls the job (or, under ASGI,
+listens to its server-sent events) for progress and the final Conversation. Job state lives
+in the database, so any worker process can answer the polls. A job can be
+cancelled while it is queued or running; a running job stops at its next
+stage, or mid-query through the guardrails (see guardrails).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+from .guardrails import QueryCancelled, request_cancel
+from .models import QueryJob
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide worker pool, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.QUERY_JOB_WORKERS,
+                thread_name_prefix='query-job',
+            )
+    return _executor
+
+
+def submit_query_job(query, dataset, api_key=None):
+    """Record a job for ``query`` and schedule it on the worker pool."""
+    job = QueryJob.objects.create(dataset=dataset, user_query=query)
+    get_executor().submit(run_query_job, job.id, api_key)
+    logger.info(f"Queued query job {job.id} for dataset {dataset.id}")
+    return job
+
+
+def run_query_job(job_id, api_key=None):
+    """Worker entry point: answer the job's question and record the outcome."""
+    # Imported here because views imports this module
+    from .views import answer_query
+
+    close_old_connections()
+    # Updates only apply while the job runs, so they never overwrite a cancellation
+    running = QueryJob.objects.filter(id=job_id, status='running')
+    try:
+        job = QueryJob.objects.select_related('dataset').get(id=job_id)
+        if not QueryJob.objects.filter(id=job_id, status='queued').update(
+                status='running', stage='running', updated_at=timezone.now()):
+            logger.info(f"Query job {job_id} was cancelled before it started")
+            return
+
+        def report(stage):
+            if not running.update(stage=stage, updated_at=timezone.now()):
+                raise QueryCancelled("The query was cancelled.")
+
+        conversation = answer_query(job.user_query, job.dataset, api_key=api_key, on_progress=report, job_id=job_id)
+        running.update(status='done', stage='done', conversation=conversation, updated_at=timezone.now())
+    except QueryCancelled:
+        logger.info(f"Query job {job_id} cancelled")
+    except Exception as e:
+        logger.error(f"Query job {job_id} failed: {str(e)}")
+        running.update(status='failed', stage='failed', error=str(e), updated_at=timezone.now())
+    finally:
+        # Worker threads get their own connections; don't leak them
+        connections.close_all()
+
+
+def cancel_query_job(job):
+    """Cancel a queued or running job and interrupt its query; returns the refreshed job."""
+    QueryJob.objects.filter(id=job.id, status__in=('queued', 'running')).update(
+        status='cancelled', stage='cancelled', error='Cancelled.', updated_at=timezone.now()
+    )
+    request_cancel(job.id)
+    job.refresh_from_db()
+    return job
+
+
+def expire_stale_job(job):
+    """Mark a job failed if its worker stopped reporting (e.g. the process was restarted)."""
+    if job.is_finished:
+        return job
+    if job.updated_at < timezone.now() - timedelta(seconds=settings.QUERY_JOB_TIMEOUT):
+        QueryJob.objects.filter(id=job.id, status=job.status).update(
+            status='failed', stage='failed', error='The job stopped responding. Please ask again.'
+        )
+        job.refresh_from_db()
+    return job
+
+
+def job_payload(job):
+    """JSON-serialisable view of a job for the status and events endpoints."""
+    payload = {
+        'id': str(job.id),
+        'status': job.status,
+        'stage': job.stage,
+        'finished': job.is_finished,
+        'error': job.error,
+    }
+    if job.conversation_id:
+        conversation = job.conversation
+        payload['conversation'] = {
+            'id': conversation.id,
+            'user_query': conversation.user_query,
+            'sql_query': conversation.sql_query,
+            'response': conversation.response,
+        }
+    return payload
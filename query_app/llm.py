@@ -0,0 +1,420 @@
+"""
+LLM providers used to classify questions and generate SQL or chat replies.
+
+Views call ``get_llm(api_key).generate(prompt)`` (or ``await ...agenerate(prompt)``
+from async views, or ``...stream(prompt)`` to get the reply as it is
+generated) instead of talking to google.generativeai directly. Providers are pooled per API key, so the
+Gemini client (and its gRPC channel) is built once rather than on every
+request, and every call gets the configured timeout and retry policy. Calls
+go through llm_scheduler, which coalesces identical prompts in flight and
+applies per-key concurrency and rate limits, queueing fairly across users.
+
+LLM_PROVIDER selects the implementation: 'gemini' (default), 'offline' for a
+deterministic rule-based stand-in that needs no network (load tests and
+benchmarks), or a dotted path to any LLMProvider subclass.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+from asgiref.sync import sync_to_async
+from google.api_core import exceptions as google_exceptions
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .ingest import quote_identifier
+from .llm_scheduler import scheduler
+from .metrics import LLM_CALLS, LLM_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying: the request may succeed if sent again a bit later
+RETRYABLE_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+)
+
+
+class LLMProvider:
+    """
+    Base provider: subclasses implement ``_generate(prompt)`` returning the reply text,
+    and may implement ``_stream(prompt)`` yielding it in pieces.
+    """
+    name = None
+
+    def __init__(self, api_key=None, model_name=None, timeout=None, max_retries=None, retry_backoff=None):
+        self.api_key = api_key
+        self.model_name = model_name or settings.LLM_MODEL
+        self.timeout = timeout if timeout is not None else settings.LLM_TIMEOUT
+        self.max_retries = max_retries if max_retries is not None else settings.LLM_MAX_RETRIES
+        self.retry_backoff = retry_backoff if retry_backoff is not None else settings.LLM_RETRY_BACKOFF
+        self.call_count = 0
+        self._count_lock = threading.Lock()
+
+    @property
+    def scheduling_key(self):
+        """Calls sharing this key share its concurrency and rate limits (see llm_scheduler)."""
+        return (self.name or type(self).__name__, self.api_key)
+
+    def generate(self, prompt):
+        """
+        Return the model's reply to ``prompt``, retrying transient failures with backoff.
+        Identical prompts in flight share one call, and each attempt waits its turn under the key's limits.
+        """
+        return scheduler.coalesce(
+            (*self.scheduling_key, self.model_name, prompt), lambda: self._generate_with_retries(prompt)
+        )
+
+    def _generate_with_retries(self, prompt):
+        attempt = 0
+        while True:
+            with scheduler.turn(self.scheduling_key):
+                with self._count_lock:
+                    self.call_count += 1
+                start = time.perf_counter()
+                try:
+                    reply = self._generate(prompt).strip()
+                except RETRYABLE_ERRORS as e:
+                    self._record_call(start, 'error' if attempt >= self.max_retries else 'retried')
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self.retry_backoff * (2 ** attempt)
+                    logger.warning(f"{self.name} call failed ({e}); retrying in {delay:.1f}s")
+                except Exception:
+                    self._record_call(start, 'error')
+                    raise
+                else:
+                    self._record_call(start, 'ok')
+                    return reply
+            # Back off without holding a turn
+            time.sleep(delay)
+            attempt += 1
+
+    async def agenerate(self, prompt):
+        """Async version of ``generate`` for ASGI views; waits without holding a thread where possible."""
+        return await scheduler.acoalesce(
+            (*self.scheduling_key, self.model_name, prompt), lambda: self._agenerate_with_retries(prompt)
+        )
+
+    async def _agenerate_with_retries(self, prompt):
+        attempt = 0
+        while True:
+            async with scheduler.aturn(self.scheduling_key):
+                with self._count_lock:
+                    self.call_count += 1
+                start = time.perf_counter()
+                try:
+                    reply = (await self._agenerate(prompt)).strip()
+                except RETRYABLE_ERRORS as e:
+                    self._record_call(start, 'error' if attempt >= self.max_retries else 'retried')
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self.retry_backoff * (2 ** attempt)
+                    logger.warning(f"{self.name} call failed ({e}); retrying in {delay:.1f}s")
+                except Exception:
+                    self._record_call(start, 'error')
+                    raise
+                else:
+                    self._record_call(start, 'ok')
+                    return reply
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stream(self, prompt):
+        """
+        Yield the model's reply to ``prompt`` in pieces as it is generated.
+        Each attempt waits its turn like ``generate``, but streams are not coalesced,
+        and a transient failure is only retried until the first piece has been yielded.
+        """
+        attempt = 0
+        while True:
+            yielded = False
+            with scheduler.turn(self.scheduling_key):
+                with self._count_lock:
+                    self.call_count += 1
+                start = time.perf_counter()
+                try:
+                    for piece in self._stream(prompt):
+                        if piece:
+                            yielded = True
+                            yield piece
+                except RETRYABLE_ERRORS as e:
+                    # Text already shown can't be taken back
+                    final = yielded or attempt >= self.max_retries
+                    self._record_call(start, 'error' if final else 'retried')
+                    if final:
+                        raise
+                    delay = self.retry_backoff * (2 ** attempt)
+                    logger.warning(f"{self.name} stream failed ({e}); retrying in {delay:.1f}s")
+                except Exception:
+                    self._record_call(start, 'error')
+                    raise
+                else:
+                    self._record_call(start, 'ok')
+                    return
+            time.sleep(delay)
+            attempt += 1
+
+    def _record_call(self, start, outcome):
+        provider = self.name or type(self).__name__
+        LLM_CALLS.inc(provider=provider, outcome=outcome)
+        LLM_SECONDS.observe(time.perf_counter() - start, provider=provider)
+
+    def _generate(self, prompt):
+        raise NotImplementedError
+
+    async def _agenerate(self, prompt):
+        # Providers without a native async client block a worker thread instead
+        return await sync_to_async(self._generate, thread_sensitive=False)(prompt)
+
+    def _stream(self, prompt):
+        # Providers without a streaming API send the whole reply as one piece
+        yield self._generate(prompt)
+
+
+class _TimeoutClient:
+    """
+    Wraps a generative service client so every call carries the provider's
+    timeout and skips the client's built-in retries (LLMProvider.generate retries).
+    """
+
+    def __init__(self, client, timeout):
+        self._client = client
+        self._timeout = timeout
+
+    def generate_content(self, request, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        kwargs.setdefault('retry', None)
+        return self._client.generate_content(request, **kwargs)
+
+    def stream_generate_content(self, request, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        kwargs.setdefault('retry', None)
+        return self._client.stream_generate_content(request, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through google-generativeai, with a client bound to one API key."""
+    name = 'gemini'
+
+    def __init__(self, api_key=None, **kwargs):
+        super().__init__(api_key=api_key, **kwargs)
+        self.model = genai.GenerativeModel(self.model_name)
+        # genai.configure() sets one process-wide key; give this model its own client instead
+        client = glm.GenerativeServiceClient(client_options={'api_key': api_key})
+        self.model._client = _TimeoutClient(client, self.timeout)
+        # gRPC asyncio channels belong to the event loop that created them
+        self._async_models = weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
+
+    def _generate(self, prompt):
+        return self.model.generate_content([{"role": "user", "parts": [prompt]}]).text
+
+    def _async_model(self):
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            model = self._async_models.get(loop)
+            if model is None:
+                model = genai.GenerativeModel(self.model_name)
+                client = glm.GenerativeServiceAsyncClient(client_options={'api_key': self.api_key})
+                model._async_client = _TimeoutClient(client, self.timeout)
+                self._async_models[loop] = model
+        return model
+
+    async def _agenerate(self, prompt):
+        response = await self._async_model().generate_content_async([{"role": "user", "parts": [prompt]}])
+        return response.text
+
+    def _stream(self, prompt):
+        for chunk in self.model.generate_content([{"role": "user", "parts": [prompt]}], stream=True):
+            # A chunk closing the stream (e.g. with its finish reason) may carry no text
+            if chunk.parts:
+                yield chunk.text
+
+
+class OfflineProvider(LLMProvider):
+    """
+    Deterministic, network-free stand-in for a real model.
+
+    It recognises the prompts built in views.py and answers them from simple
+    templates, sleeping OFFLINE_LLM_LATENCY seconds per call plus
+    OFFLINE_LLM_TOKEN_LATENCY seconds per 1,000 prompt tokens (without blocking
+    the event loop in ``agenerate``), so load tests and benchmarks can measure
+    the request path without Gemini. ``stream`` yields the reply a word at a
+    time: the prompt's share of the delay comes before the first word, like a
+    real model reading its prompt, and OFFLINE_LLM_LATENCY is spread over the words.
+    """
+    name = 'offline'
+
+    DATA_REQUEST = re.compile(
+        r'\b(show|list|display|select|get|fetch|find|count|sum|total|average|avg|mean|top|max|min|highest|'
+        r'lowest|which|who|update|delete|remove|insert|sort|order|group)\b',
+        re.IGNORECASE
+    )
+    STRUCTURE = re.compile(r'\b(columns?|schema|structure|tables|databases?)\b', re.IGNORECASE)
+    AGGREGATES = [
+        (re.compile(r'\b(average|avg|mean)\b'), 'AVG'),
+        (re.compile(r'\b(sum|total)\b'), 'SUM'),
+        (re.compile(r'\b(max|maximum|highest|largest)\b'), 'MAX'),
+        (re.compile(r'\b(min|minimum|lowest|smallest)\b'), 'MIN'),
+    ]
+
+    def __init__(self, api_key=None, latency=None, token_latency=None, **kwargs):
+        super().__init__(api_key=api_key, **kwargs)
+        self.latency = latency if latency is not None else settings.OFFLINE_LLM_LATENCY
+        self.token_latency = token_latency if token_latency is not None else settings.OFFLINE_LLM_TOKEN_LATENCY
+
+    def delay_for(self, prompt):
+        # Roughly 4 characters per token
+        return self.latency + self.token_latency * len(prompt) / 4000
+
+    def _generate(self, prompt):
+        delay = self.delay_for(prompt)
+        if delay:
+            time.sleep(delay)
+        return self.answer(prompt)
+
+    async def _agenerate(self, prompt):
+        delay = self.delay_for(prompt)
+        if delay:
+            await asyncio.sleep(delay)
+        return self.answer(prompt)
+
+    def _stream(self, prompt):
+        reply = self.answer(prompt)
+        words = re.findall(r'\S+\s*', reply) or [reply]
+        prompt_delay = self.delay_for(prompt) - self.latency
+        if prompt_delay:
+            time.sleep(prompt_delay)
+        for word in words:
+            if self.latency:
+                time.sleep(self.latency / len(words))
+            yield word
+
+    def answer(self, prompt):
+        """Reply to one of the views' prompts from the templates below."""
+        question = self._question(prompt)
+        tables = self._tables(prompt)
+        primary = re.search(r'Primary Table: (\S+)', prompt)
+        primary = primary.group(1) if primary else next(iter(tables), 'data')
+        is_data_request = bool(self.DATA_REQUEST.search(question)) and not self.STRUCTURE.search(question)
+
+        if 'Classify this user message' in prompt:
+            return 'SQL' if is_data_request else 'CHAT'
+        if 'Respond ONLY with a JSON object' in prompt:
+            if is_data_request:
+                return json.dumps({'type': 'SQL', 'sql': self.template_sql(question, primary, tables.get(primary, []))})
+            return json.dumps({'type': 'CHAT', 'message': self.template_chat(question, tables)})
+        if 'SQL expert' in prompt:
+            return self.template_sql(question, primary, tables.get(primary, []))
+        return self.template_chat(question, tables)
+
+    @staticmethod
+    def _question(prompt):
+        match = re.search(r'(?:User Request|User Message|User Question|USER|Classify this user message):\s*"(.*?)"', prompt, re.S)
+        return match.group(1) if match else ''
+
+    @staticmethod
+    def _tables(prompt):
+        """Parse the "N. Table 'name': col, col" lines of format_database_context."""
+        tables = {}
+        for name, cols in re.findall(r"Table '([^']+)': (.*)", prompt):
+            tables[name] = [c.strip() for c in cols.split(',') if c.strip()]
+        return tables
+
+    def template_sql(self, question, table, columns):
+        """Build a plausible SELECT for ``question`` from a handful of phrasing templates."""
+        q = question.lower()
+        quoted_table = quote_identifier(table)
+        # Longest names first so 'order_date' wins over 'order'
+        mentioned = [c for c in sorted(columns, key=len, reverse=True) if c.lower() in q]
+        group_match = re.search(r'\b(?:by|per|for each)\s+(.*)$', q)
+        group_col = next((c for c in mentioned if group_match and c.lower() in group_match.group(1)), None)
+        metric_col = next((c for c in mentioned if c != group_col), None)
+        top = re.search(r'\btop (\d+)', q)
+        limit = int(top.group(1)) if top else 10
+
+        aggregate = next((func for pattern, func in self.AGGREGATES if pattern.search(q)), None)
+        if re.search(r'\b(count|how many)\b', q):
+            aggregate, metric_col = 'COUNT', None
+
+        if aggregate:
+            target = f'{aggregate}({quote_identifier(metric_col)})' if metric_col else 'COUNT(*)'
+            if group_col:
+                group = quote_identifier(group_col)
+                return f'SELECT {group}, {target} FROM {quoted_table} GROUP BY {group}'
+            return f'SELECT {target} FROM {quoted_table}'
+        if top and group_col:
+            return f'SELECT * FROM {quoted_table} ORDER BY {quote_identifier(group_col)} DESC LIMIT {limit}'
+        return f'SELECT * FROM {quoted_table} LIMIT {limit}'
+
+    def template_chat(self, question, tables):
+        if self.STRUCTURE.search(question) and tables:
+            described = '; '.join(f"{name} ({', '.join(cols)})" for name, cols in tables.items())
+            return f"This database has {len(tables)} table(s): {described}."
+        return "Hello! Ask me anything about your data, for example 'show the table' or 'count rows by city'."
+
+
+PROVIDERS = {
+    'gemini': GeminiProvider,
+    'offline': OfflineProvider,
+}
+
+_pool = OrderedDict()
+_pool_lock = threading.Lock()
+
+
+def get_provider_class(name=None):
+    name = name or settings.LLM_PROVIDER
+    if name in PROVIDERS:
+        return PROVIDERS[name]
+    return import_string(name)
+
+
+def get_llm(api_key=None, provider=None):
+    """
+    Return a pooled provider for ``api_key`` (falling back to GEMINI_API_KEY).
+
+    Raises:
+        ValueError: if the provider needs an API key and none is available.
+    """
+    provider_class = get_provider_class(provider)
+    if provider_class is OfflineProvider:
+        pool_key = (provider_class, None)
+    else:
+        api_key = api_key or os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError("No API key provided. Please provide your Gemini API key through the popup modal.")
+        pool_key = (provider_class, api_key)
+
+    with _pool_lock:
+        llm = _pool.get(pool_key)
+        if llm is None:
+            llm = provider_class(api_key=pool_key[1])
+            _pool[pool_key] = llm
+            # Users can bring their own keys, so keep the pool bounded
+            while len(_pool) > settings.LLM_CLIENT_POOL_SIZE:
+                _pool.popitem(last=False)
+        else:
+            _pool.move_to_end(pool_key)
+    return llm
+
+
+def reset_pool():
+    """Forget pooled providers (after changing LLM settings, e.g. in benchmarks)."""
+    with _pool_lock:
+        _pool.clear()
@@ -0,0 +1,338 @@
+"""
+Scheduling of model calls: coalescing, per-key limits and fair queueing.
+
+Every call LLMProvider.generate (or agenerate) makes goes through here:
+
+- Identical prompts to the same provider and key while one is in flight
+  share that call's reply (LLM_COALESCE), so a question asked from several
+  tabs or by several users of a shared dataset costs one model call.
+- Each API key allows at most LLM_MAX_CONCURRENCY attempts in flight and
+  LLM_RATE_PER_MINUTE attempts a minute (a token bucket holding up to
+  LLM_RATE_BURST), so one deployment stays inside its quota. Retries take a
+  turn like any other attempt; their backoff does not hold one.
+- Calls that can't start at once queue per user, and free turns go to the
+  users round-robin: a user with a burst of questions waits behind their own
+  questions, not in front of everyone else's. Users are told apart by
+  account (``llm_user``); anonymous users share one queue. A call waiting
+  longer than LLM_QUEUE_TIMEOUT seconds fails with LLMQueueTimeout.
+
+Both limits default to 0 (none), so queueing starts only when they are set.
+State is per process: with several workers, divide the key's quota between
+them. A key's state is dropped once nothing is in flight or queued and its
+bucket has refilled, so keys that are no longer used don't pile up. Queue
+depth, calls in flight, waits, timeouts and coalesced calls are exported on
+/metrics, and a wait shows as ``llm_queue`` in Server-Timing.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from django.conf import settings
+from .metrics import LLM_COALESCED, LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_TIMEOUTS, LLM_QUEUE_WAIT, record_span
+
+
+# User the model calls of the current question are made for (None: anonymous)
+_current_user = contextvars.ContextVar('llm_user', default=None)
+
+
+class LLMQueueTimeout(Exception):
+    """A model call waited longer than LLM_QUEUE_TIMEOUT for its turn."""
+
+
+@contextlib.contextmanager
+def llm_user(user_id):
+    """Queue the model calls made inside the block as ``user_id``'s (None: anonymous)."""
+    token = _current_user.set(user_id)
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+class TokenBucket:
+    """``rate`` tokens a second, holding at most ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take a token: 0 when one was available, else the seconds until one will be."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def full(self):
+        """Whether the bucket has refilled to ``burst``."""
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.burst
+
+
+class _Waiter:
+    """A queued call, woken from whichever thread frees a turn."""
+
+    def __init__(self, user, loop=None):
+        self.user = user
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _KeyState:
+    """Turns of one provider and API key: attempts in flight, rate bucket and per-user queues."""
+
+    def __init__(self, key):
+        self.key = key
+        self.provider = key[0]
+        self.active = 0
+        self.bucket = None
+        self.queues = OrderedDict()
+        self.timer = None
+
+    def take_token(self):
+        rate = settings.LLM_RATE_PER_MINUTE / 60
+        if not rate:
+            self.bucket = None
+            return 0
+        if self.bucket is None or (self.bucket.rate, self.bucket.burst) != (rate, max(1, settings.LLM_RATE_BURST)):
+            self.bucket = TokenBucket(rate, settings.LLM_RATE_BURST)
+        return self.bucket.take()
+
+    def idle(self):
+        """Whether dropping the state loses nothing: no attempt, waiter or timer, and a full bucket."""
+        if self.active or self.queues or self.timer is not None:
+            return False
+        return self.bucket is None or self.bucket.full()
+
+
+class LLMScheduler:
+    """Coalesces identical calls and hands out per-key turns fairly across users."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._in_flight = {}
+
+    # Turns
+
+    def _state(self, key):
+        state = self._keys.get(key)
+        if state is None:
+            # States left with a draining bucket are only dropped here, once it has refilled
+            for stale in [other for other in self._keys.values() if other.idle()]:
+                del self._keys[stale.key]
+            state = self._keys[key] = _KeyState(key)
+        return state
+
+    def _forget(self, state):
+        """Drop ``state`` if it is idle (lock held)."""
+        if state.idle() and self._keys.get(state.key) is state:
+            del self._keys[state.key]
+
+    def _try_start(self, state):
+        """Start an attempt if the limits allow one now (lock held)."""
+        limit = settings.LLM_MAX_CONCURRENCY
+        if limit and state.active >= limit:
+            return False
+        delay = state.take_token()
+        if delay:
+            # Nothing else frees a turn when the bucket is the limit: look again once it has refilled
+            if state.timer is None:
+                state.timer = threading.Timer(delay, self._refilled, [state])
+                state.timer.daemon = True
+                state.timer.start()
+            return False
+        state.active += 1
+        LLM_IN_FLIGHT.inc(provider=state.provider)
+        return True
+
+    def _dispatch(self, state):
+        """Hand free turns to queued calls, one user at a time (lock held)."""
+        while state.queues and self._try_start(state):
+            user, queue = next(iter(state.queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                state.queues.move_to_end(user)
+            else:
+                del state.queues[user]
+            LLM_QUEUE_DEPTH.dec(provider=state.provider)
+            waiter.grant()
+
+    def _refilled(self, state):
+        with self._lock:
+            state.timer = None
+            self._dispatch(state)
+            self._forget(state)
+
+    def _enqueue(self, key, loop=None):
+        """Take a turn for ``key`` at once (None) or queue a waiter for one (lock held)."""
+        state = self._state(key)
+        # Calls already waiting go first
+        if not state.queues and self._try_start(state):
+            return state, None
+        waiter = _Waiter(_current_user.get(), loop)
+        state.queues.setdefault(waiter.user, deque()).append(waiter)
+        LLM_QUEUE_DEPTH.inc(provider=state.provider)
+        return state, waiter
+
+    def _abandon(self, state, waiter):
+        """Take a waiter that gave up out of its queue; True if it got its turn meanwhile (lock held)."""
+        if waiter.granted:
+            return True
+        queue = state.queues[waiter.user]
+        queue.remove(waiter)
+        if not queue:
+            del state.queues[waiter.user]
+        LLM_QUEUE_DEPTH.dec(provider=state.provider)
+        self._forget(state)
+        return False
+
+    def _release(self, state):
+        with self._lock:
+            state.active -= 1
+            LLM_IN_FLIGHT.dec(provider=state.provider)
+            self._dispatch(state)
+            self._forget(state)
+
+    @staticmethod
+    def _waited(state, start):
+        waited = time.perf_counter() - start
+        LLM_QUEUE_WAIT.observe(waited, provider=state.provider)
+        if waited > 0.001:
+            record_span('llm_queue', waited)
+
+    def _timed_out(self, state):
+        LLM_QUEUE_TIMEOUTS.inc(provider=state.provider)
+        return LLMQueueTimeout(
+            f"The model is busy: no turn for this request within {settings.LLM_QUEUE_TIMEOUT:g} seconds. "
+            "Please try again."
+        )
+
+    @contextlib.contextmanager
+    def turn(self, key):
+        """Run the block as one attempt of ``key`` = (provider name, API key), waiting for a turn if needed."""
+        start = time.perf_counter()
+        with self._lock:
+            state, waiter = self._enqueue(key)
+        if waiter is not None and not waiter.event.wait(settings.LLM_QUEUE_TIMEOUT or None):
+            with self._lock:
+                if not self._abandon(state, waiter):
+                    raise self._timed_out(state)
+        self._waited(state, start)
+        try:
+            yield
+        finally:
+            self._release(state)
+
+    @contextlib.asynccontextmanager
+    async def aturn(self, key):
+        """Async version of ``turn``: waits on the event loop."""
+        start = time.perf_counter()
+        with self._lock:
+            state, waiter = self._enqueue(key, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.future, settings.LLM_QUEUE_TIMEOUT or None)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    if not self._abandon(state, waiter):
+                        raise self._timed_out(state)
+            except asyncio.CancelledError:
+                with self._lock:
+                    granted = self._abandon(state, waiter)
+                if granted:
+                    self._release(state)
+                raise
+        self._waited(state, start)
+        try:
+            yield
+        finally:
+            self._release(state)
+
+    # Coalescing
+
+    def _join(self, key):
+        """The in-flight call for ``key`` and whether this caller must make it."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, False
+            future = self._in_flight[key] = concurrent.futures.Future()
+            # A running future can't be cancelled by a waiter that goes away
+            future.set_running_or_notify_cancel()
+            return future, True
+
+    def _settle(self, key, future, result=None, error=None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        else:
+            # Waiters shouldn't see the maker's own cancellation
+            future.set_exception(error if isinstance(error, Exception) else RuntimeError('The model call was interrupted'))
+
+    def coalesce(self, key, call):
+        """``call()``, or the reply of the identical call already in flight under ``key`` = (provider name, ...)."""
+        if not settings.LLM_COALESCE:
+            return call()
+        future, leader = self._join(key)
+        if not leader:
+            LLM_COALESCED.inc(provider=key[0])
+            return future.result()
+        try:
+            result = call()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    async def acoalesce(self, key, call):
+        """Async version of ``coalesce``: ``call`` returns an awaitable."""
+        if not settings.LLM_COALESCE:
+            return await call()
+        future, leader = self._join(key)
+        if not leader:
+            LLM_COALESCED.inc(provider=key[0])
+            return await asyncio.wrap_future(future)
+        try:
+            result = await call()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    def stats(self):
+        """Attempts in flight and calls queued, per (provider, key) with any state."""
+        with self._lock:
+            return {
+                key: {'active': state.active, 'queued': sum(len(queue) for queue in state.queues.values())}
+                for key, state in self._keys.items()
+            }
+
+
+scheduler = LLMScheduler()
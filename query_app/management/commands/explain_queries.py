@@ -0,0 +1,146 @@
+"""
+Audit the query plans of the app's ORM queries.
+
+Every read-only page is requested for one dataset (inside a transaction that
+is rolled back) and the queries it runs are captured; the queries behind
+POST handlers and background jobs are added from their querysets. Each one
+is explained and any full table scan or temporary sort is flagged.
+
+    python manage.py explain_queries [--dataset ID] [--fail-on-scan]
+"""
+import re
+import uuid
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from query_app.models import CachedQuery, Conversation, Dataset, QueryJob
+from query_app.schema_catalog import group_datasets
+
+
+# Plan lines that mean every row of a table (or index) is visited, per backend
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'^SCAN (?!CONSTANT ROW)|USE TEMP B-TREE'),
+    'postgresql': re.compile(r'Seq Scan|Sort Method: external'),
+}
+# Walking an index in order is fine when the query stops after a few rows
+INDEX_WALK_PATTERN = re.compile(r'^SCAN \S+ USING (COVERING )?INDEX|Index (Only )?Scan')
+LIMIT_PATTERN = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+# Sorting is free when every table is reached by primary key (e.g. .first() on a pk lookup)
+TEMP_SORT_PATTERN = re.compile(r'^USE TEMP B-TREE')
+TABLE_ACCESS_PATTERN = re.compile(r'^(SCAN|SEARCH) ')
+UNIQUE_LOOKUP_PATTERN = re.compile(
+    r'^SEARCH \S+ USING (INTEGER PRIMARY KEY \(rowid=\?\)|INDEX sqlite_autoindex_\S+ \(\w+=\?\))'
+)
+
+
+def finds_one_row(plan):
+    accesses = [line.strip() for line in plan if TABLE_ACCESS_PATTERN.search(line.strip())]
+    return bool(accesses) and all(UNIQUE_LOOKUP_PATTERN.search(line) for line in accesses)
+
+
+def is_full_scan(plan_line, sql, plan=()):
+    line = plan_line.strip()
+    if not FULL_SCAN_PATTERNS[connection.vendor].search(line):
+        return False
+    if TEMP_SORT_PATTERN.search(line) and finds_one_row(plan):
+        return False
+    return not (INDEX_WALK_PATTERN.search(line) and LIMIT_PATTERN.search(sql))
+
+
+class Command(BaseCommand):
+    help = "Explain the ORM queries used by the views and flag full table scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, help="Dataset to exercise the pages with (default: the first one)")
+        parser.add_argument('--fail-on-scan', action='store_true', help="Exit with an error if any query scans a table")
+
+    def handle(self, *args, **options):
+        if connection.vendor not in FULL_SCAN_PATTERNS:
+            raise CommandError(f"explain_queries does not support the {connection.vendor} backend")
+
+        datasets = Dataset.objects.select_related('user').order_by('id')
+        dataset = datasets.filter(id=options['dataset']).first() if options['dataset'] else datasets.first()
+        if dataset is None:
+            raise CommandError("No dataset found; upload one first or pass --dataset")
+
+        queries = self.page_queries(dataset) + self.handler_queries(dataset)
+        model_tables = {model._meta.db_table for model in apps.get_models()}
+        flagged = 0
+        seen = set()
+        for label, sql, params in queries:
+            # Result pages and exports scan the user's own tables by design
+            if sql in seen or not any(f'"{table}"' in sql for table in model_tables):
+                continue
+            seen.add(sql)
+            plan = self.explain(sql, params)
+            scans = [line for line in plan if is_full_scan(line, sql, plan)]
+            flagged += bool(scans)
+            style = self.style.WARNING if scans else self.style.SUCCESS
+            self.stdout.write(style(f"{'SCAN' if scans else 'OK  '} {label}"))
+            self.stdout.write(f"     {sql}")
+            for line in plan:
+                self.stdout.write(f"       {line}")
+
+        summary = f"{len(seen)} queries explained, {flagged} with full scans"
+        if flagged and options['fail_on_scan']:
+            raise CommandError(summary)
+        self.stdout.write(self.style.WARNING(summary) if flagged else self.style.SUCCESS(summary))
+
+    def page_queries(self, dataset):
+        """Request the read-only pages and capture the queries they run."""
+        latest = Conversation.objects.filter(dataset=dataset).order_by('-id').first()
+        job = QueryJob.objects.filter(dataset=dataset).first()
+        urls = ['/query/', f'/query/?dataset={dataset.id}', '/upload/']
+        if latest:
+            urls += [
+                f'/conversations/?dataset={dataset.id}&before={latest.id}',
+                f'/conversations/{latest.id}/',
+                f'/conversations/{latest.id}/results/',
+            ]
+        if job:
+            urls.append(f'/jobs/{job.id}/')
+
+        client = Client()
+        queries = []
+        with override_settings(ALLOWED_HOSTS=['*']), transaction.atomic():
+            if dataset.user:
+                client.force_login(dataset.user)
+            for url in urls:
+                with CaptureQueriesContext(connection) as captured:
+                    client.get(url)
+                queries += [(f'GET {url}', query['sql'], None) for query in captured.captured_queries]
+            transaction.set_rollback(True)
+        return queries
+
+    def handler_queries(self, dataset):
+        """Queries of POST handlers, the SQL cache and background jobs, from their querysets."""
+        # The filter get_user_filter applies for the dataset's owner
+        user_filter = {'user': dataset.user} if dataset.user else {'user__isnull': True}
+        owner_filter = {f'dataset__{key}': value for key, value in user_filter.items()}
+        querysets = [
+            ('process_query: dataset', Dataset.objects.filter(id=dataset.id, **user_filter)),
+            ('upload: existing table', Dataset.objects.filter(table_name=dataset.table_name, **user_filter)),
+            ('upload: existing database', Dataset.objects.filter(
+                database_group__iexact=dataset.database_group, **user_filter)),
+            ('schema catalog', group_datasets(dataset).only('table_name', 'columns', 'profile')),
+            ('sql cache: lookup', CachedQuery.objects.filter(
+                fingerprint='0' * 64, normalized_query='question', dataset=dataset)),
+            ('sql cache: eviction', CachedQuery.objects.order_by('last_used_at').values_list('pk', flat=True)[:1]),
+            ('sql cache: invalidation', CachedQuery.objects.filter(dataset__in=[dataset])),
+            ('clear conversation', Conversation.objects.filter(dataset=dataset)),
+            ('job status', QueryJob.objects.select_related('conversation').filter(id=uuid.uuid4(), **owner_filter)),
+        ]
+        return [(label, *queryset.query.sql_with_params()) for label, queryset in querysets]
+
+    def explain(self, sql, params):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            # Captured queries come with their parameters already interpolated (params=None)
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+        # SQLite returns (id, parent, notused, detail); PostgreSQL one text column
+        return [row[-1] for row in rows]
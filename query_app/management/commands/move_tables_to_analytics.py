@@ -0,0 +1,82 @@
+"""
+Copy uploaded tables from the default database into the analytics database.
+
+Installs from before the analytics store kept every dataset's table next to
+Django's own tables. This copies each table that is still only in ``default``
+(column types included) in batches, and with ``--drop`` removes the original.
+
+    python manage.py move_tables_to_analytics [--drop] [--batch-rows 50000]
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from query_app.db import analytics_connection
+from query_app.ingest import quote_identifier
+from query_app.models import Dataset
+
+
+class Command(BaseCommand):
+    help = "Move uploaded tables from the default database to the analytics database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop', action='store_true', help="Drop each table from the default database once copied")
+        parser.add_argument('--batch-rows', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        source, target = connections[DEFAULT_DB_ALIAS], analytics_connection()
+        if source.settings_dict['NAME'] == target.settings_dict['NAME'] and \
+                source.settings_dict.get('HOST') == target.settings_dict.get('HOST'):
+            self.stdout.write("The analytics database is the default database; nothing to move.")
+            return
+
+        with source.cursor() as cursor:
+            source_tables = set(source.introspection.table_names(cursor))
+        with target.cursor() as cursor:
+            target_tables = set(target.introspection.table_names(cursor))
+
+        moved = 0
+        for dataset in Dataset.objects.only('table_name', 'columns').order_by('id'):
+            table_name = dataset.table_name
+            if table_name not in source_tables:
+                continue
+            if table_name in target_tables:
+                self.stdout.write(f"{table_name}: already in the analytics database, skipped")
+                continue
+            rows = self.copy_table(source, target, dataset, options['batch_rows'])
+            source_tables.discard(table_name)
+            if options['drop']:
+                with source.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE {quote_identifier(table_name)}')
+            moved += 1
+            self.stdout.write(f"{table_name}: {rows} rows copied")
+        self.stdout.write(self.style.SUCCESS(f"{moved} tables moved to the analytics database"))
+
+    def copy_table(self, source, target, dataset, batch_rows):
+        table_name = dataset.table_name
+        quoted_table = quote_identifier(table_name)
+        with source.cursor() as cursor:
+            description = source.introspection.get_table_description(cursor, table_name)
+        # Types recorded at ingest; SQLite's declared type otherwise (other backends report type codes)
+        recorded_types = {column['name']: column.get('type') for column in dataset.columns}
+        column_defs = ', '.join(
+            f"{quote_identifier(field.name)} "
+            f"{recorded_types.get(field.name) or (field.type_code if isinstance(field.type_code, str) else 'TEXT')}"
+            for field in description
+        )
+        quoted_columns = ', '.join(quote_identifier(field.name) for field in description)
+        insert_sql = f'INSERT INTO {quoted_table} ({quoted_columns})'.replace('%', '%%')
+        insert_sql += f" VALUES ({', '.join(['%s'] * len(description))})"
+
+        rows = 0
+        with transaction.atomic(using=settings.ANALYTICS_DATABASE), target.cursor() as write_cursor:
+            write_cursor.execute(f'CREATE TABLE {quoted_table} ({column_defs})')
+            with source.cursor() as read_cursor:
+                read_cursor.execute(f'SELECT {quoted_columns} FROM {quoted_table}')
+                while True:
+                    batch = read_cursor.fetchmany(batch_rows)
+                    if not batch:
+                        break
+                    write_cursor.executemany(insert_sql, batch)
+                    rows += len(batch)
+        return rows
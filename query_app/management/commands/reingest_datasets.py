@@ -0,0 +1,52 @@
+"""
+Re-create uploaded tables from their Parquet snapshots.
+
+Restores datasets whose table is missing from the analytics database (a new
+or rebuilt analytics store) without the original upload: each table is
+rebuilt from its snapshot with the column types recorded at ingest. With
+``--replace`` tables that still exist are rebuilt as well.
+
+    python manage.py reingest_datasets [--dataset ID] [--replace] [--batch-rows 50000]
+"""
+from django.core.management.base import BaseCommand
+
+from query_app.db import analytics_connection
+from query_app.ingest import reingest_table
+from query_app.models import Dataset
+from query_app.result_cache import bump_table_versions
+from query_app.schema_catalog import invalidate_schema_catalog
+
+
+class Command(BaseCommand):
+    help = "Re-create uploaded tables from their Parquet snapshots."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, help="Only this dataset id")
+        parser.add_argument('--replace', action='store_true', help="Also rebuild tables that still exist")
+        parser.add_argument('--batch-rows', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        connection = analytics_connection()
+        with connection.cursor() as cursor:
+            existing_tables = set(connection.introspection.table_names(cursor))
+
+        datasets = Dataset.objects.only('table_name', 'columns', 'user_id', 'database_group').order_by('id')
+        if options['dataset'] is not None:
+            datasets = datasets.filter(id=options['dataset'])
+
+        rebuilt = 0
+        for dataset in datasets:
+            table_name = dataset.table_name
+            if table_name in existing_tables and not options['replace']:
+                continue
+            column_types = {column['name']: column.get('type') or 'TEXT' for column in dataset.columns}
+            rows = reingest_table(table_name, column_types, options['batch_rows'])
+            if rows is None:
+                self.stdout.write(f"{table_name}: no snapshot, skipped")
+                continue
+            bump_table_versions([table_name])
+            # Catalogs built while the table was missing or stale must not be served
+            invalidate_schema_catalog(dataset)
+            rebuilt += 1
+            self.stdout.write(f"{table_name}: {rows} rows re-ingested")
+        self.stdout.write(self.style.SUCCESS(f"{rebuilt} tables re-ingested from snapshots"))
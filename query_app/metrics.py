@@ -0,0 +1,239 @@
+"""
+Latency and throughput metrics for the query pipeline.
+
+Each stage of answering a question (schema lookup, SQL cache, model calls,
+SQL execution, rendering, saving) runs inside ``timed(stage)``, which records
+its duration in the ``nlq_stage_duration_seconds`` histogram. During a
+request, ServerTimingMiddleware also collects the spans and returns them in
+a ``Server-Timing`` header, so the browser's network panel shows where a slow
+question spent its time. Counters track model calls, rows returned and bytes
+of HTML rendered, and gauges the model call scheduler's queue; cache hits are
+read from the caches when /metrics is scraped.
+
+Metrics live in the process and are written in the Prometheus text format
+without a client library. Under several worker processes each keeps its
+own, so scrape every worker (or run one) for complete numbers. Buckets reach
+120 seconds, so slow model calls still land in a bucket rather than only +Inf.
+"""
+import bisect
+import contextlib
+import contextvars
+import itertools
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+# Seconds: from cached lookups (milliseconds) to retried model calls (a minute or more)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_lock = threading.Lock()
+_registry = []
+# Spans of the current request as [(stage, seconds)]; None outside a request
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """A count that only goes up, per combination of label values."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with _lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(list(zip(self.labels, key)))} {value}'
+
+
+class Gauge(Counter):
+    """A value that goes up and down, per combination of label values."""
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """Observations counted into cumulative ``le`` buckets, with their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        # Only the smallest bucket holding the value is counted here; samples() accumulates
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self):
+        with _lock:
+            values = {key: (list(counts), total[0]) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            pairs = list(zip(self.labels, key))
+            cumulative = list(itertools.accumulate(counts))
+            for bound, count in zip(self.buckets + ('+Inf',), cumulative):
+                yield f'{self.name}_bucket{_format_labels(pairs + [("le", bound)])} {count}'
+            yield f'{self.name}_sum{_format_labels(pairs)} {total}'
+            yield f'{self.name}_count{_format_labels(pairs)} {cumulative[-1]}'
+
+
+STAGE_SECONDS = Histogram(
+    'nlq_stage_duration_seconds', 'Time spent in each stage of answering a question.', ['stage']
+)
+QUESTION_SECONDS = Histogram(
+    'nlq_question_duration_seconds', 'Time to answer a question, by how it was answered.', ['answer']
+)
+REQUEST_SECONDS = Histogram(
+    'nlq_request_duration_seconds', 'Time to respond to a request, by URL name.', ['view']
+)
+LLM_CALLS = Counter(
+    'nlq_llm_calls_total', 'Model calls by provider and outcome (ok, retried or error).', ['provider', 'outcome']
+)
+LLM_SECONDS = Histogram(
+    'nlq_llm_call_duration_seconds', 'Duration of single model calls, retries counted separately.', ['provider']
+)
+ROWS_RETURNED = Counter(
+    'nlq_rows_returned_total', 'Result rows returned, by answers and by result pages.', ['source']
+)
+RENDERED_BYTES = Counter('nlq_rendered_bytes_total', 'Bytes of HTML rendered into replies.')
+LLM_QUEUE_DEPTH = Gauge('nlq_llm_queue_depth', 'Model calls waiting for a turn under the per-key limits.', ['provider'])
+LLM_IN_FLIGHT = Gauge('nlq_llm_in_flight', 'Model calls being sent or answered.', ['provider'])
+LLM_QUEUE_WAIT = Histogram(
+    'nlq_llm_queue_wait_seconds', 'Time model calls waited for a turn (0 when one was free).', ['provider']
+)
+LLM_QUEUE_TIMEOUTS = Counter('nlq_llm_queue_timeouts_total', 'Model calls that gave up waiting for a turn.', ['provider'])
+LLM_COALESCED = Counter(
+    'nlq_llm_coalesced_total', 'Model calls answered by an identical call already in flight.', ['provider']
+)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Record the time the block takes as ``stage``, and in the request's Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+def record_span(stage, seconds):
+    """Record ``seconds`` spent in ``stage`` (see timed)."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+def _collected_samples():
+    """Samples read from elsewhere at scrape time: cache hit counts."""
+    from . import result_cache, sql_cache
+
+    lines = [
+        '# HELP nlq_cache_lookups_total Cache lookups in this process by cache and result.',
+        '# TYPE nlq_cache_lookups_total counter',
+    ]
+    result_stats = result_cache.cache_stats()
+    for cache_name, stats in (('sql', sql_cache.cache_stats()), ('result', result_stats)):
+        for result, key in (('hit', 'hits'), ('miss', 'misses')):
+            labels = _format_labels([('cache', cache_name), ('result', result)])
+            lines.append(f'nlq_cache_lookups_total{labels} {stats[key]}')
+    lines += [
+        '# HELP nlq_result_cache_bytes Bytes of results held by this process\'s result cache.',
+        '# TYPE nlq_result_cache_bytes gauge',
+        f'nlq_result_cache_bytes {result_stats["bytes"]}',
+    ]
+    return lines
+
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format."""
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.help_text}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    lines.extend(_collected_samples())
+    return '\n'.join(lines) + '\n'
+
+
+def format_server_timing(spans, total):
+    """Server-Timing header value: each stage's total milliseconds in first-seen order, then the whole request."""
+    durations = {}
+    for stage, seconds in spans:
+        durations[stage] = durations.get(stage, 0) + seconds
+    durations['total'] = total
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in durations.items())
+
+
+class ServerTimingMiddleware:
+    """Collect the stage spans of each request into a Server-Timing header and time the request."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        return self.finish(request, response, spans, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        return self.finish(request, response, spans, time.perf_counter() - start)
+
+    def finish(self, request, response, spans, elapsed):
+        match = request.resolver_match
+        REQUEST_SECONDS.observe(elapsed, view=match.url_name if match and match.url_name else 'other')
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = format_server_timing(spans, elapsed)
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.6 on 2026-10-18 00:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('query_app', '0003_dataset_user_alter_conversation_sql_query_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('normalized_query', models.TextField()),
+                ('sql_query', models.TextField()),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='query_app.dataset')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fingerprint'], name='cachedquery_fingerprint_idx'), models.Index(fields=['last_used_at'], name='cachedquery_last_used_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-18 00:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('query_app', '0005_queryjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='result_columns',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='result_has_more',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='result_sql',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
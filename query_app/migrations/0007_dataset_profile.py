@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('query_app', '0006_conversation_result_handle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='profile',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.6 on 2026-10-18 01:13
+
+from django.db import migrations, models
+
+
+def populate_database_group(apps, schema_editor):
+    Dataset = apps.get_model('query_app', 'Dataset')
+    for dataset in Dataset.objects.all():
+        dataset.database_group = dataset.name.split('.')[0].rstrip('_0123456789')
+        dataset.save(update_fields=['database_group'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('query_app', '0007_dataset_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='database_group',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='schema_version',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.RunPython(populate_database_group, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['user', 'database_group'], name='dataset_user_group_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.6 on 2026-10-18 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('query_app', '0008_dataset_database_group'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='dataset',
+            name='dataset_user_group_idx',
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['dataset', 'id'], name='conversation_dataset_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['user', 'name'], name='dataset_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['user', 'table_name'], name='dataset_user_table_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['user', 'database_group', 'name'], name='dataset_user_group_name_idx'),
+        ),
+    ]
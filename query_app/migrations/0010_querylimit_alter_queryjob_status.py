@@ -0,0 +1,31 @@
+# Generated by Django 4.2.6 on 2026-10-18 03:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('query_app', '0009_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='queryjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=16),
+        ),
+        migrations.CreateModel(
+            name='QueryLimit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timeout', models.FloatField(blank=True, help_text="Seconds a question's SQL may run (0 = no limit)", null=True)),
+                ('max_rows', models.PositiveIntegerField(blank=True, help_text='Most rows a result can be paged or exported through (0 = no limit)', null=True)),
+                ('max_cost', models.BigIntegerField(blank=True, help_text='Most rows a query may be estimated to examine (0 = no limit)', null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='query_limit', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
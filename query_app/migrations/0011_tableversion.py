@@ -0,0 +1,21 @@
+# Generated by Django 4.2.6 on 2026-10-18 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('query_app', '0010_querylimit_alter_queryjob_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=255, unique=True)),
+                ('version', models.PositiveBigIntegerField(db_index=True, default=0)),
+            ],
+        ),
+    ]
@@ -1,17 +1,131 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
 
+def database_group_for(name):
+    """Database a file uploaded as ``name`` belongs to: its name without extension or copy suffix."""
+    return name.split('.')[0].rstrip('_0123456789')
+
+
 class Dataset(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)  # Allow per-user datasets
     name = models.CharField(max_length=255)
     table_name = models.CharField(max_length=255)
+    # Database (group of tables) this dataset belongs to; set at upload and kept across renames
+    database_group = models.CharField(max_length=255, blank=True)
+    # Changes whenever a table of the group changes; part of the schema catalog cache key
+    schema_version = models.CharField(max_length=32, blank=True)
     columns = models.JSONField()
+    # Column statistics from column_stats; None until computed (e.g. after a write query)
+    profile = models.JSONField(blank=True, null=True)
     file = models.FileField(upload_to='datasets/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Datasets are always looked up within one user's: listed by name, matched by
+        # table name, and grouped by database (ordered by name for the schema catalog)
+        indexes = [
+            models.Index(fields=['user', 'name'], name='dataset_user_name_idx'),
+            models.Index(fields=['user', 'table_name'], name='dataset_user_table_idx'),
+            models.Index(fields=['user', 'database_group', 'name'], name='dataset_user_group_name_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.database_group:
+            self.database_group = database_group_for(self.name)
+        super().save(*args, **kwargs)
+
 class Conversation(models.Model):
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE)
     user_query = models.TextField()
     sql_query = models.TextField(blank=True, null=True)
     response = models.TextField()
+    # Result handle: the SELECT that produced the result, re-run page by page by query_results_page
+    result_sql = models.TextField(blank=True, null=True)
+    result_columns = models.JSONField(blank=True, null=True)
+    result_has_more = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # The chat history pages by id within a dataset (SQLite's foreign key index
+        # already includes the rowid; other backends need it spelled out)
+        indexes = [
+            models.Index(fields=['dataset', 'id'], name='conversation_dataset_id_idx'),
+        ]
+
+    @property
+    def read_sql(self):
+        """The trailing SELECT of sql_query, safe to re-run for paging and exports."""
+        from .guardrails import is_select
+
+        statements = [stmt.strip() for stmt in (self.sql_query or '').split(';') if stmt.strip()]
+        if statements and is_select(statements[-1]):
+            return statements[-1]
+        return None
+
+class CachedQuery(models.Model):
+    """Generated SQL for a normalized question, valid for one schema fingerprint."""
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE)
+    fingerprint = models.CharField(max_length=64)
+    normalized_query = models.TextField()
+    sql_query = models.TextField()
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fingerprint'], name='cachedquery_fingerprint_idx'),
+            models.Index(fields=['last_used_at'], name='cachedquery_last_used_idx'),
+        ]
+
+
+class QueryJob(models.Model):
+    """A question answered in the background; polled by the client until finished."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE)
+    user_query = models.TextField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='queued')
+    stage = models.CharField(max_length=32, default='queued')
+    conversation = models.ForeignKey(Conversation, on_delete=models.SET_NULL, null=True, blank=True)
+    error = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+
+class QueryLimit(models.Model):
+    """Per-user overrides of the query guardrails (see guardrails); blank fields use the QUERY_* settings."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='query_limit')
+    timeout = models.FloatField(null=True, blank=True, help_text="Seconds a question's SQL may run (0 = no limit)")
+    max_rows = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Most rows a result can be paged or exported through (0 = no limit)"
+    )
+    max_cost = models.BigIntegerField(
+        null=True, blank=True, help_text="Most rows a query may be estimated to examine (0 = no limit)"
+    )
+
+    def __str__(self):
+        return f"Query limits for {self.user}"
+
+
+class TableVersion(models.Model):
+    """Version of an analytics table, raised whenever its data changes; cached results record the versions they read."""
+    # Lower-cased: SQLite table names are case-insensitive
+    table_name = models.CharField(max_length=255, unique=True)
+    # Raised to one past the highest version of any table, so it never repeats
+    version = models.PositiveBigIntegerField(default=0, db_index=True)
+
+    def __str__(self):
+        return f"{self.table_name} v{self.version}"
@@ -0,0 +1,345 @@
+"""
+On-demand request profiling.
+
+A request is profiled when a staff user asks for it with ``?profile=1`` or an
+``X-Profile: 1`` header, and at random for PROFILING_SAMPLE_RATE of all
+other requests. A sampling profiler (the default, PROFILING_MODE=sampling)
+records the request thread's stack every PROFILING_INTERVAL seconds and
+writes the stacks in the collapsed "folded" format read by flamegraph.pl,
+speedscope and inferno; PROFILING_MODE=cprofile writes a cProfile ``.prof``
+file for pstats or snakeviz instead, with exact call counts at a higher
+overhead. Every SQL query the request runs is counted and timed, per
+database, and statements run more than once are listed so N+1 lookups stand
+out.
+
+Each profile is a data file and a ``.json`` summary (view, path, status,
+duration, SQL, hottest functions) in PROFILING_DIR, keeping the latest
+PROFILING_MAX_FILES. The staff page at /admin/profiles/ lists them by view.
+
+Only the time until a streaming response (exports, job events) starts is
+profiled. Under ASGI the sampler records every thread of the process (sync
+views and ORM calls run in executor threads), so concurrent requests show up
+in each other's profiles, and SQL run in those threads is not counted.
+"""
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# Profile ids are generated here; anything else asked of the download view is refused
+PROFILE_ID = re.compile(r'^\d{8}-\d{9}-[0-9a-f]{8}$')
+DATA_EXTENSIONS = {'sampling': '.folded', 'cprofile': '.prof'}
+# Entries kept in a summary: hottest functions, slowest and most repeated statements
+TOP_FUNCTIONS = 15
+TOP_QUERIES = 10
+
+# Where idle pool threads wait for work, left out when every thread is sampled
+IDLE_FRAMES = {('_worker', os.path.join('concurrent', 'futures', 'thread.py')), ('wait', 'threading.py')}
+# One cProfile at a time: from Python 3.12 it is process-wide rather than per thread
+_cprofile_lock = threading.Lock()
+
+
+def profile_flag(request):
+    """Whether ``request`` asks to be profiled (honoured for staff users only)."""
+    flag = request.GET.get('profile') or request.headers.get('X-Profile')
+    return bool(flag) and flag not in ('0', 'false')
+
+
+def profile_requested(request):
+    """Whether ``request`` should be profiled, and why ('requested' or 'sampled'); None when not."""
+    if not settings.PROFILING:
+        return None
+    user = getattr(request, 'user', None)
+    if profile_flag(request) and user is not None and user.is_staff:
+        return 'requested'
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return 'sampled'
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _source_roots():
+    """Directories stripped from file names in stacks: the project, site-packages, the standard library."""
+    packages = sorted({path for path in sys.path if path.endswith('-packages')})
+    return (str(settings.BASE_DIR), *packages, sysconfig.get_paths()['stdlib'])
+
+
+@functools.lru_cache(maxsize=4096)
+def _frame_label(code):
+    filename = code.co_filename
+    for root in _source_roots():
+        if filename.startswith(root + os.sep):
+            filename = filename[len(root) + 1:]
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+def _is_idle(code):
+    return any(code.co_name == name and code.co_filename.endswith(filename) for name, filename in IDLE_FRAMES)
+
+
+class SamplingProfiler:
+    """Stacks of one thread (or of all others, ``thread_id=None``) sampled from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if self.thread_id is not None:
+                frames = {self.thread_id: frames.get(self.thread_id)}
+            for thread_id, frame in frames.items():
+                if frame is None or thread_id == own_id:
+                    continue
+                if self.thread_id is None and _is_idle(frame.f_code):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as fh:
+            for stack, count in self.stacks.most_common():
+                fh.write(f'{stack} {count}\n')
+
+    def summary(self):
+        own = Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        return {
+            'samples': sum(self.stacks.values()),
+            'top': [{'function': name, 'samples': count} for name, count in own.most_common(TOP_FUNCTIONS)],
+        }
+
+
+class CProfileProfiler:
+    """cProfile of the calling thread; hold _cprofile_lock while it runs."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        _cprofile_lock.release()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+    def summary(self):
+        stats = pstats.Stats(self.profile).stats
+        # (file, line, name) -> (primitive calls, calls, own time, cumulative time, callers)
+        ranked = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FUNCTIONS]
+        return {
+            'calls': sum(entry[1] for entry in stats.values()),
+            'top': [
+                {'function': f'{name} ({filename}:{line})', 'calls': calls, 'own_ms': round(own * 1000, 2)}
+                for (filename, line, name), (_, calls, own, _, _) in ranked
+            ],
+        }
+
+
+class QueryRecorder:
+    """Count and time the SQL run on this thread's connections (a Django execute wrapper)."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((context['connection'].alias, sql, time.perf_counter() - start))
+
+    def summary(self):
+        by_database = Counter(alias for alias, _, _ in self.queries)
+        repeated = Counter(sql for _, sql, _ in self.queries)
+        slowest = sorted(self.queries, key=lambda query: query[2], reverse=True)[:TOP_QUERIES]
+        return {
+            'count': len(self.queries),
+            'ms': round(sum(seconds for _, _, seconds in self.queries) * 1000, 2),
+            'by_database': dict(by_database),
+            'slowest': [
+                {'database': alias, 'sql': sql[:500], 'ms': round(seconds * 1000, 2)} for alias, sql, seconds in slowest
+            ],
+            'repeated': [
+                {'sql': sql[:500], 'count': count} for sql, count in repeated.most_common(TOP_QUERIES) if count > 1
+            ],
+        }
+
+
+def _new_profiler(thread_id):
+    """A profiler for the request, or None when cProfile is already busy with another one."""
+    if settings.PROFILING_MODE == 'cprofile':
+        return CProfileProfiler() if _cprofile_lock.acquire(blocking=False) else None
+    return SamplingProfiler(thread_id, settings.PROFILING_INTERVAL)
+
+
+def _save(request, response, trigger, profiler, recorder, elapsed):
+    """Write the profile data and summary; returns the profile id."""
+    profile_dir = settings.PROFILING_DIR
+    os.makedirs(profile_dir, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    # Milliseconds in the id keep the ids of one second in order
+    profile_id = f'{now.strftime("%Y%m%d-%H%M%S%f")[:-3]}-{uuid.uuid4().hex[:8]}'
+    mode = 'cprofile' if isinstance(profiler, CProfileProfiler) else 'sampling'
+    data_file = profile_id + DATA_EXTENSIONS[mode]
+    profiler.write(os.path.join(profile_dir, data_file))
+
+    match = request.resolver_match
+    summary = {
+        'id': profile_id,
+        'created': now.isoformat(timespec='seconds'),
+        'view': match.url_name if match and match.url_name else 'other',
+        'method': request.method,
+        'path': request.get_full_path()[:500],
+        'status': response.status_code,
+        'duration_ms': round(elapsed * 1000, 2),
+        'trigger': trigger,
+        'mode': mode,
+        'data_file': data_file,
+        'profile': profiler.summary(),
+        'sql': recorder.summary() if recorder is not None else None,
+    }
+    with open(os.path.join(profile_dir, f'{profile_id}.json'), 'w') as fh:
+        json.dump(summary, fh, indent=1)
+    prune_profiles()
+    logger.info(f"Profiled {request.method} {summary['path']} ({trigger}): {profile_id}")
+    return profile_id
+
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first."""
+    profile_dir = settings.PROFILING_DIR
+    try:
+        names = sorted((name for name in os.listdir(profile_dir) if name.endswith('.json')), reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        try:
+            with open(os.path.join(profile_dir, name)) as fh:
+                summary = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        profiles.append(summary)
+    return profiles
+
+
+def prune_profiles():
+    """Delete the oldest profiles beyond PROFILING_MAX_FILES."""
+    profile_dir = settings.PROFILING_DIR
+    ids = sorted(name[:-5] for name in os.listdir(profile_dir) if name.endswith('.json'))
+    for profile_id in ids[:max(0, len(ids) - settings.PROFILING_MAX_FILES)]:
+        for extension in ('.json', *DATA_EXTENSIONS.values()):
+            try:
+                os.remove(os.path.join(profile_dir, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+def profile_data_path(profile_id):
+    """Path of a stored profile's data file, or None."""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    for extension in DATA_EXTENSIONS.values():
+        path = os.path.join(settings.PROFILING_DIR, profile_id + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class ProfilingMiddleware:
+    """Profile the requests profile_requested() picks (needs request.user: place after AuthenticationMiddleware)."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trigger = profile_requested(request)
+        profiler = _new_profiler(threading.get_ident()) if trigger else None
+        if profiler is None:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+        return self.finish(request, response, trigger, profiler, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        # Checking is_staff loads the user from the database
+        if settings.PROFILING and profile_flag(request):
+            trigger = await sync_to_async(profile_requested)(request)
+        else:
+            trigger = profile_requested(request)
+        # The view may run in an executor thread, so sample them all; see the module docstring
+        profiler = _new_profiler(None) if trigger else None
+        if profiler is None:
+            return await self.get_response(request)
+
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.stop()
+        return self.finish(request, response, trigger, profiler, None, time.perf_counter() - start)
+
+    def finish(self, request, response, trigger, profiler, recorder, elapsed):
+        try:
+            profile_id = _save(request, response, trigger, profiler, recorder, elapsed)
+        except OSError as e:
+            logger.error(f"Could not save request profile: {str(e)}")
+            return response
+        if trigger == 'requested':
+            response['X-Profile-Id'] = profile_id
+        return response
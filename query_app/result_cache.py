@@ -0,0 +1,302 @@
+"""
+Result cache: rows of read-only statements, reused while their tables are unchanged.
+
+The same generated SELECTs (a table's first rows, dashboard-style
+aggregates) are asked again and again. Their results are kept under a key
+made of the normalized SQL (comments dropped, whitespace collapsed, keywords
+upper-cased) and the row limit. Each entry records the version of every
+table the statements read, as SQLite's authorizer reports them while they
+run, including tables read through views. A TableVersion row per table is
+raised by uploads, appends, renames and deletes, and by every write
+execute_sql_statements runs (again from the authorizer, so an UPDATE of one
+table leaves results over the others cached). An entry whose tables have
+moved on is never served, so a hit costs one indexed query on the default
+database and none on the analytics one, even across worker processes.
+
+Entries hold the rows as pickled tuples, zlib-compressed past
+COMPRESS_MIN_BYTES: for results of a page or so this is two to three times
+smaller than Arrow IPC, whose schema and offsets dominate, and dates come
+back as dates. They are kept in a process-local LRU bounded by
+RESULT_CACHE_MAX_BYTES, backed by the shared cache alias RESULT_CACHE when
+one is configured.
+Statements that read SQLite's own tables or call functions such as random()
+or date('now') are never cached.
+"""
+import contextlib
+import hashlib
+import logging
+import pickle
+import re
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+import sqlparse
+from sqlparse import tokens as T
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max
+from .guardrails import is_read_statement, is_select
+from .models import Dataset, TableVersion
+
+
+logger = logging.getLogger(__name__)
+
+# Functions whose result changes between runs of the same statement
+VOLATILE_FUNCTIONS = {'random', 'randomblob', 'changes', 'total_changes', 'last_insert_rowid'}
+VOLATILE_KEYWORDS = {'CURRENT_DATE', 'CURRENT_TIME', 'CURRENT_TIMESTAMP'}
+# SQLite's own tables and PRAGMA table-valued functions describe the schema, which has no version
+SCHEMA_SOURCES = re.compile(r'\b(sqlite_|pragma_)', re.IGNORECASE)
+# Smaller payloads aren't worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+# Authorizer actions that change a table's rows or definition
+WRITE_ACTIONS = {
+    sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE,
+    sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_CREATE_TEMP_TABLE,
+    sqlite3.SQLITE_CREATE_VIEW, sqlite3.SQLITE_CREATE_TEMP_VIEW,
+    sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_DROP_TEMP_TABLE,
+    sqlite3.SQLITE_DROP_VIEW, sqlite3.SQLITE_DROP_TEMP_VIEW,
+    sqlite3.SQLITE_ALTER_TABLE,
+}
+
+_local = OrderedDict()
+_local_bytes = 0
+_local_lock = threading.Lock()
+_tracking = threading.local()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def normalize_sql(sql):
+    """
+    ``sql`` with comments dropped, whitespace collapsed and keywords upper-cased;
+    None when it calls a function whose result changes between runs or reads the schema.
+    """
+    if SCHEMA_SOURCES.search(sql):
+        return None
+    parts = []
+    for token in sqlparse.parse(sql)[0].flatten() if sql.strip() else []:
+        if token.ttype in T.Comment:
+            parts.append(' ')
+        elif token.is_whitespace:
+            parts.append(' ')
+        elif token.is_keyword:
+            if token.normalized in VOLATILE_KEYWORDS:
+                return None
+            parts.append(token.normalized)
+        elif token.ttype in T.Name and token.value.lower() in VOLATILE_FUNCTIONS:
+            return None
+        elif token.ttype in T.String.Single and token.value.lower() == "'now'":
+            return None
+        else:
+            parts.append(token.value)
+    return ' '.join(''.join(parts).split())
+
+
+def result_key(sql_statements, max_rows):
+    """Cache key for the result of SELECT ``sql_statements``, or None when it can't be cached."""
+    normalized = []
+    for sql in sql_statements:
+        if not is_select(sql):
+            return None
+        sql = normalize_sql(sql)
+        if sql is None:
+            return None
+        normalized.append(sql)
+    if not normalized:
+        return None
+    raw = f'{max_rows}\n' + ';\n'.join(normalized)
+    return 'result_cache:' + hashlib.sha256(raw.encode()).hexdigest()
+
+
+class TableAccess:
+    """Tables read and written by the statements run inside tracking_tables (lower-cased names)."""
+
+    def __init__(self, tracked):
+        self.tracked = tracked
+        self.read = set()
+        self.written = set()
+
+
+@contextlib.contextmanager
+def tracking_tables(connection):
+    """
+    Record the tables statements run on ``connection`` (a Django connection)
+    inside the block read and write. Blocks may nest; each sees its statements.
+    """
+    if connection.vendor != 'sqlite':
+        yield TableAccess(tracked=False)
+        return
+    connection.ensure_connection()
+    raw_connection = connection.connection
+    access = TableAccess(tracked=True)
+    # Connections are per thread, so the stack of open blocks is too
+    accesses = getattr(_tracking, 'accesses', None)
+    outermost = not accesses
+    if outermost:
+        accesses = _tracking.accesses = []
+
+        def authorize(action, arg1, arg2, db_name, source):
+            if action == sqlite3.SQLITE_READ and arg1:
+                for tracked in accesses:
+                    tracked.read.add(arg1.lower())
+            elif action in WRITE_ACTIONS:
+                # ALTER TABLE passes the database name first
+                table = arg2 if action == sqlite3.SQLITE_ALTER_TABLE else arg1
+                for tracked in accesses if table else ():
+                    tracked.written.add(table.lower())
+            return sqlite3.SQLITE_OK
+
+        # Setting an authorizer expires prepared statements, so cached ones are checked again
+        raw_connection.set_authorizer(authorize)
+    accesses.append(access)
+    try:
+        yield access
+    finally:
+        accesses.remove(access)
+        if outermost:
+            raw_connection.set_authorizer(None)
+
+
+def latest_version():
+    """The highest version of any table."""
+    return TableVersion.objects.aggregate(latest=Max('version'))['latest'] or 0
+
+
+def table_versions(table_names):
+    """Current version of each of ``table_names`` (0 for a table never changed)."""
+    versions = dict.fromkeys(table_names, 0)
+    versions.update(TableVersion.objects.filter(table_name__in=versions).values_list('table_name', 'version'))
+    return versions
+
+
+def bump_table_versions(table_names):
+    """Give ``table_names`` a new version after their data changed, so results that read them are stale."""
+    names = {name.lower() for name in table_names if name}
+    if not names:
+        return
+    with transaction.atomic():
+        version = latest_version() + 1
+        TableVersion.objects.bulk_create([TableVersion(table_name=name) for name in names], ignore_conflicts=True)
+        TableVersion.objects.filter(table_name__in=names).update(version=version)
+
+
+def bump_written_tables(access, sql_statements):
+    """
+    Bump the tables written by statements run inside tracking_tables. Without
+    the authorizer (other databases), every known table they mention is bumped.
+    """
+    if access.tracked:
+        bump_table_versions(access.written)
+        return
+    from .columnar import referenced_tables
+
+    sql_statements = [sql for sql in sql_statements if not is_read_statement(sql)]
+    if not sql_statements:
+        return
+    known = set(TableVersion.objects.values_list('table_name', flat=True))
+    known.update(name.lower() for name in Dataset.objects.values_list('table_name', flat=True))
+    bump_table_versions({table for sql in sql_statements for table in referenced_tables(sql, known)})
+
+
+def encode_result(rows):
+    """Serialize result rows: (format, bytes)."""
+    payload = pickle.dumps([tuple(row) for row in rows], pickle.HIGHEST_PROTOCOL)
+    if len(payload) > COMPRESS_MIN_BYTES:
+        return 'pickle+zlib', zlib.compress(payload, 1)
+    return 'pickle', payload
+
+
+def decode_result(entry):
+    """Rows of a cache entry, as tuples."""
+    payload = entry['payload']
+    if entry['format'] == 'pickle+zlib':
+        payload = zlib.decompress(payload)
+    return pickle.loads(payload)
+
+
+def _record(outcome):
+    with _local_lock:
+        _stats[outcome] += 1
+
+
+def _get_entry(key):
+    with _local_lock:
+        entry = _local.get(key)
+        if entry is not None:
+            _local.move_to_end(key)
+            return entry
+    if not settings.RESULT_CACHE:
+        return None
+    entry = caches[settings.RESULT_CACHE].get(key)
+    if entry is not None:
+        _remember(key, entry)
+    return entry
+
+
+def _remember(key, entry):
+    global _local_bytes
+    with _local_lock:
+        previous = _local.pop(key, None)
+        if previous is not None:
+            _local_bytes -= len(previous['payload'])
+        _local[key] = entry
+        _local_bytes += len(entry['payload'])
+        while _local_bytes > settings.RESULT_CACHE_MAX_BYTES and _local:
+            _, evicted = _local.popitem(last=False)
+            _local_bytes -= len(evicted['payload'])
+
+
+def _store(key, versions, rows, columns):
+    result_format, payload = encode_result(rows)
+    if len(payload) > settings.RESULT_CACHE_MAX_ENTRY_BYTES:
+        return
+    entry = {'versions': versions, 'columns': columns, 'format': result_format, 'payload': payload}
+    _remember(key, entry)
+    if settings.RESULT_CACHE:
+        caches[settings.RESULT_CACHE].set(key, entry, settings.RESULT_CACHE_TTL)
+
+
+def cached_select(sql_statements, max_rows, run, connection):
+    """
+    Rows and columns of the SELECT ``sql_statements``: from the cache while the
+    tables they read are unchanged, otherwise from ``run()``, which must
+    return (rows, columns) holding at most ``max_rows`` rows and run them on
+    ``connection``.
+    """
+    key = result_key(sql_statements, max_rows) if settings.RESULT_CACHING else None
+    if key is None:
+        return run()
+
+    entry = _get_entry(key)
+    if entry is not None and table_versions(entry['versions']) == entry['versions']:
+        _record('hits')
+        return decode_result(entry), entry['columns']
+    _record('misses')
+
+    # Versions are read after the statements run; a change committed meanwhile
+    # must not be recorded as the version the rows came from
+    before = latest_version()
+    with tracking_tables(connection) as access:
+        rows, columns = run()
+    # Nothing read means the authorizer didn't see the statements (or there is nothing worth caching)
+    if access.tracked and access.read:
+        versions = table_versions(access.read)
+        if max(versions.values(), default=0) <= before:
+            _store(key, versions, rows, columns)
+    return rows, columns
+
+
+def cache_stats():
+    """Hit/miss counters, entries and bytes held by this process."""
+    with _local_lock:
+        return dict(_stats, entries=len(_local), bytes=_local_bytes)
+
+
+def clear_local_results():
+    """Forget process-local results (tests and benchmarks)."""
+    global _local_bytes
+    with _local_lock:
+        _local.clear()
+        _local_bytes = 0
@@ -0,0 +1,137 @@
+"""
+Schema catalog: the tables and columns of a database, ready for prompts.
+
+Every model call needs the schema of the dataset's database (all tables in
+its group) and the text block describing it. Catalogs are built once per
+schema version and kept in a process-local LRU backed by the shared Django
+cache (SCHEMA_CATALOG_CACHE). The key includes ``Dataset.schema_version``,
+which invalidate_schema_catalog changes on upload, append, rename and delete,
+and whenever a column profile (whose frequent values the catalog carries) is
+dropped or rebuilt.
+Since the dataset row is already loaded by the view, a warm lookup costs no
+database query and is never stale, even across worker processes.
+
+Each catalog also carries the schema_pruning index, so prompts for wide
+databases can be reduced to the tables and columns a question is about.
+"""
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from .models import Dataset
+from .schema_pruning import build_schema_index, prune_context
+
+
+_local = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def format_database_context(context):
+    """Format database context for display in prompts."""
+    formatted = f"Available Database: {context['database_name']}\n"
+    formatted += f"Total Tables: {context['table_count']}\n\n"
+    formatted += "Tables and their columns:\n"
+
+    for idx, table in enumerate(context['tables'], 1):
+        formatted += f"{idx}. Table '{table['name']}': "
+        formatted += f"{', '.join(table['columns'])}\n"
+        if table.get('omitted_columns'):
+            formatted += f"   ({table['omitted_columns']} less relevant columns not shown)\n"
+
+    if context.get('omitted_tables'):
+        formatted += f"({context['omitted_tables']} less relevant tables not shown)\n"
+
+    return formatted
+
+
+def group_datasets(dataset):
+    """Datasets (tables) in the same database as ``dataset``."""
+    return Dataset.objects.filter(
+        user_id=dataset.user_id,
+        database_group=dataset.database_group,
+    ).order_by('name')
+
+
+def build_schema_catalog(dataset):
+    """Read the database's tables from the Dataset rows and render the prompt block."""
+    tables = []
+    samples = {}
+    for ds in group_datasets(dataset).only('table_name', 'columns', 'profile'):
+        tables.append({'name': ds.table_name, 'columns': [c['name'] for c in ds.columns]})
+        # Frequent values let questions like "orders from Paris" find the city column
+        profile_columns = (ds.profile or {}).get('columns', {})
+        samples[ds.table_name] = {
+            name: [value for value, _ in stats['top']]
+            for name, stats in profile_columns.items()
+            if stats.get('top') and stats['type'] == 'TEXT'
+        }
+    context = {
+        'database_name': dataset.database_group,
+        'table_count': len(tables),
+        'tables': tables,
+    }
+    return {
+        'context': context,
+        'prompt': format_database_context(context),
+        'index': build_schema_index(tables, samples),
+    }
+
+
+def _catalog_key(dataset):
+    # Group names are user text; hash them into a key every cache backend accepts
+    raw = f'{dataset.user_id}:{dataset.database_group}:{dataset.schema_version}'
+    return 'schema_catalog:' + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get_schema_catalog(dataset):
+    """
+    Return {'context', 'prompt'} for the database ``dataset`` belongs to.
+
+    The result is shared between callers and must not be modified.
+    """
+    key = _catalog_key(dataset)
+    with _local_lock:
+        catalog = _local.get(key)
+        if catalog is not None:
+            _local.move_to_end(key)
+            return catalog
+
+    shared = caches[settings.SCHEMA_CATALOG_CACHE]
+    catalog = shared.get(key)
+    if catalog is None:
+        catalog = build_schema_catalog(dataset)
+        shared.set(key, catalog, settings.SCHEMA_CATALOG_TTL)
+
+    with _local_lock:
+        _local[key] = catalog
+        while len(_local) > settings.SCHEMA_CATALOG_LRU_SIZE:
+            _local.popitem(last=False)
+    return catalog
+
+
+def get_prompt_schema(dataset, query=None):
+    """
+    Schema block for a prompt about ``query``: pruned to the relevant tables and
+    columns when the database is wide, otherwise the full catalog prompt.
+    """
+    catalog = get_schema_catalog(dataset)
+    if query and settings.SCHEMA_PRUNING:
+        pruned = prune_context(catalog['context'], catalog['index'], query, dataset.table_name)
+        if pruned is not None:
+            return format_database_context(pruned)
+    return catalog['prompt']
+
+
+def invalidate_schema_catalog(dataset):
+    """Give the database ``dataset`` belongs to a new schema version after its tables or profiles changed."""
+    version = uuid.uuid4().hex
+    group_datasets(dataset).update(schema_version=version)
+    dataset.schema_version = version
+
+
+def clear_local_catalogs():
+    """Forget process-local catalogs (tests and benchmarks)."""
+    with _local_lock:
+        _local.clear()
@@ -0,0 +1,130 @@
+"""
+Relevance ranking of tables and columns for the SQL prompt.
+
+Wide spreadsheets and databases with many tables make the schema block the
+bulk of every prompt. Each catalog carries a small lexical index: tokens from
+table and column names (split on underscores and camelCase, lightly stemmed)
+and from frequent values recorded in the column profiles, weighted by inverse
+document frequency. A question is scored against it and only the best
+matching tables and columns are kept. Small schemas, and questions that match
+nothing, fall back to the full schema.
+"""
+import math
+import re
+from collections import Counter
+from django.conf import settings
+
+
+TOKEN_RE = re.compile(r'[A-Za-z]+|\d+')
+CAMEL_RE = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+KEY_COLUMN_RE = re.compile(r'(^id$|_id$|^id_|key$)', re.IGNORECASE)
+STOPWORDS = {
+    'a', 'all', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'each', 'for', 'from', 'get', 'give',
+    'has', 'have', 'how', 'i', 'in', 'is', 'it', 'list', 'many', 'me', 'much', 'of', 'on', 'or', 'per', 'please',
+    'show', 'than', 'that', 'the', 'their', 'them', 'there', 'to', 'was', 'were', 'what', 'when', 'where',
+    'which', 'who', 'with',
+}
+
+# Frequent values per column indexed from the profile, and their weight relative to a name match
+SAMPLE_VALUES = 10
+VALUE_WEIGHT = 0.5
+TABLE_NAME_WEIGHT = 2.0
+
+
+def _stem(token):
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Lowercased, stemmed word tokens of ``text``, splitting snake_case and camelCase."""
+    words = TOKEN_RE.findall(CAMEL_RE.sub(' ', str(text)))
+    return [_stem(word.lower()) for word in words if word.lower() not in STOPWORDS]
+
+
+def build_schema_index(tables, samples):
+    """
+    Build the lexical index for a catalog.
+
+    Args:
+        tables: [{'name', 'columns'}] as in the catalog context
+        samples: {table_name: {column: [frequent values]}}
+    """
+    documents = []
+    for table in tables:
+        table_samples = samples.get(table['name'], {})
+        columns = []
+        for column in table['columns']:
+            name_tokens = set(tokenize(column))
+            value_tokens = set()
+            for value in table_samples.get(column, [])[:SAMPLE_VALUES]:
+                value_tokens.update(tokenize(value))
+            columns.append((column, name_tokens, value_tokens - name_tokens))
+        documents.append({'name': table['name'], 'tokens': set(tokenize(table['name'])), 'columns': columns})
+
+    # One "document" per column (name and values) for document frequencies
+    frequency = Counter()
+    column_count = 0
+    for document in documents:
+        for _, name_tokens, value_tokens in document['columns']:
+            frequency.update(name_tokens | value_tokens)
+            column_count += 1
+    idf = {token: math.log(1 + column_count / count) for token, count in frequency.items()}
+    return {'tables': documents, 'idf': idf, 'column_count': column_count}
+
+
+def _score(question_tokens, tokens, idf):
+    return sum(idf.get(token, 1.0) for token in question_tokens if token in tokens)
+
+
+def prune_context(context, index, query, primary_table):
+    """
+    Return a copy of ``context`` reduced to the tables and columns relevant to ``query``.
+
+    Returns None when the full schema should be used: the schema is small
+    enough already, or nothing in the question matched it.
+    """
+    if index['column_count'] <= settings.SCHEMA_PRUNE_MIN_COLUMNS:
+        return None
+    question_tokens = set(tokenize(query))
+    if not question_tokens:
+        return None
+
+    idf = index['idf']
+    ranked_tables = []
+    for document in index['tables']:
+        column_scores = {
+            column: _score(question_tokens, name_tokens, idf) + VALUE_WEIGHT * _score(question_tokens, value_tokens, idf)
+            for column, name_tokens, value_tokens in document['columns']
+        }
+        best = sorted(column_scores.values(), reverse=True)[:3]
+        table_score = TABLE_NAME_WEIGHT * _score(question_tokens, document['tokens'], idf) + sum(best)
+        ranked_tables.append((table_score, document, column_scores))
+
+    if not any(score for score, _, _ in ranked_tables):
+        return None
+
+    max_tables = settings.SCHEMA_PRUNE_MAX_TABLES
+    max_columns = settings.SCHEMA_PRUNE_MAX_COLUMNS
+    # The primary table is always kept; the rest by score
+    ranked_tables.sort(key=lambda item: (item[1]['name'] != primary_table, -item[0]))
+    selected = [item for item in ranked_tables if item[0] > 0 or item[1]['name'] == primary_table][:max_tables]
+
+    tables = []
+    for _, document, column_scores in selected:
+        all_columns = [column for column, _, _ in document['columns']]
+        matched = sorted((c for c in all_columns if column_scores[c] > 0), key=lambda c: -column_scores[c])
+        keys = [c for c in all_columns if KEY_COLUMN_RE.search(c) and c not in matched]
+        # A table chosen by name alone still gets a preview of its leading columns
+        chosen = set((matched + keys)[:max_columns]) if matched else set((keys + all_columns)[:max_columns])
+        columns = [c for c in all_columns if c in chosen]
+        tables.append({
+            'name': document['name'],
+            'columns': columns,
+            'omitted_columns': len(all_columns) - len(columns),
+        })
+
+    return dict(context, tables=tables, omitted_tables=context['table_count'] - len(tables))
@@ -0,0 +1,403 @@
+"""
+Parquet snapshots of uploaded tables.
+
+Ingestion writes every uploaded table a second time as a compressed columnar
+Parquet snapshot (one row group per ingest chunk), next to the SQLite copy.
+Exports of plain column selections, profile rebuilds and re-ingestion read
+the snapshot through memory-mapped files and only the columns they need,
+instead of re-parsing the upload or scanning the table; the columnar engine
+(see columnar) queries the same files.
+
+A snapshot is a directory of part files under COLUMNAR_SNAPSHOT_DIR: an
+upload writes one part, each appended file adds one, and a rebuild from the
+table writes several. The analytics database stays the source of truth: any
+change the snapshot doesn't follow (a generated write, a value that didn't fit
+its column's type) drops the snapshot, and readers fall back to the table.
+Snapshots need pyarrow (in requirements.txt); without it uploads only go
+to the table, with a warning.
+"""
+import logging
+import os
+import re
+import shutil
+import uuid
+import weakref
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Set once the missing-pyarrow warning has been logged
+_warned_no_pyarrow = False
+
+# A SELECT that only picks columns of one table, with an optional LIMIT
+IDENTIFIER = r'(?:"(?:[^"]|"")+"|\w+)'
+TABLE_PROJECTION_RE = re.compile(
+    rf'^\s*SELECT\s+(?P<columns>\*|{IDENTIFIER}(?:\s*,\s*{IDENTIFIER})*)\s+'
+    rf'FROM\s+(?P<table>{IDENTIFIER})\s*(?:LIMIT\s+(?P<limit>\d+)\s*)?;?\s*$',
+    re.IGNORECASE,
+)
+
+
+def snapshots_enabled():
+    """Whether uploads write snapshots (DATASET_SNAPSHOTS on and pyarrow installed)."""
+    global _warned_no_pyarrow
+    if not settings.DATASET_SNAPSHOTS:
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        if not _warned_no_pyarrow:
+            _warned_no_pyarrow = True
+            logger.warning("DATASET_SNAPSHOTS is on but pyarrow is not installed; uploads get no Parquet snapshot")
+        return False
+    return True
+
+
+def snapshot_path(table_name):
+    """Directory holding the Parquet files of a table's snapshot."""
+    return os.path.join(settings.COLUMNAR_SNAPSHOT_DIR, table_name)
+
+
+def has_snapshot(table_name):
+    return os.path.isdir(snapshot_path(table_name))
+
+
+def _version_path(table_name):
+    return os.path.join(settings.COLUMNAR_SNAPSHOT_DIR, f'{table_name}.version')
+
+
+def snapshot_version(table_name):
+    """Token that changes whenever the table's data changes; a snapshot built across a change is discarded."""
+    try:
+        with open(_version_path(table_name)) as fh:
+            return fh.read()
+    except FileNotFoundError:
+        return ''
+
+
+def _bump_version(table_name):
+    os.makedirs(settings.COLUMNAR_SNAPSHOT_DIR, exist_ok=True)
+    version_path = _version_path(table_name)
+    temp_path = f'{version_path}.{uuid.uuid4().hex}'
+    with open(temp_path, 'w') as fh:
+        fh.write(uuid.uuid4().hex)
+    os.replace(temp_path, version_path)
+
+
+def invalidate_snapshots(table_names):
+    """
+    Drop the snapshots of tables whose data just changed.
+
+    Call it after the change is committed. The version file is bumped first, so
+    a build that started from the old data notices and throws its result away.
+    """
+    if not os.path.isdir(settings.COLUMNAR_SNAPSHOT_DIR):
+        return
+    for table_name in table_names:
+        _bump_version(table_name)
+        shutil.rmtree(snapshot_path(table_name), ignore_errors=True)
+
+
+def rename_snapshot(old_table_name, new_table_name):
+    """Move a snapshot along with its renamed table."""
+    if not has_snapshot(old_table_name):
+        invalidate_snapshots([new_table_name])
+        return
+    _bump_version(old_table_name)
+    _bump_version(new_table_name)
+    shutil.rmtree(snapshot_path(new_table_name), ignore_errors=True)
+    try:
+        os.rename(snapshot_path(old_table_name), snapshot_path(new_table_name))
+    except OSError as e:
+        logger.warning(f"Could not move the snapshot of {old_table_name}: {str(e)}")
+        invalidate_snapshots([old_table_name, new_table_name])
+
+
+def new_build_dir(table_name):
+    """A private directory to write a snapshot into before publish_snapshot makes it visible."""
+    os.makedirs(settings.COLUMNAR_SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(settings.COLUMNAR_SNAPSHOT_DIR, f'.{table_name}.{uuid.uuid4().hex}.tmp')
+    os.makedirs(path)
+    return path
+
+
+def publish_snapshot(table_name, build_dir, version):
+    """
+    Make ``build_dir`` the table's snapshot if the data is still at ``version``.
+
+    Returns whether it was published; ``build_dir`` is gone either way.
+    """
+    try:
+        if snapshot_version(table_name) != version:
+            return False
+        final_dir = snapshot_path(table_name)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        try:
+            os.rename(build_dir, final_dir)
+        except OSError:
+            # Another process published its snapshot first
+            return has_snapshot(table_name)
+        # The data may have changed between the check and the rename
+        if snapshot_version(table_name) != version:
+            shutil.rmtree(final_dir, ignore_errors=True)
+            return False
+        return True
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def _directory_id(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def part_name(index):
+    return f'part-{index:05d}.parquet'
+
+
+def _arrow_type(col_type, pa):
+    # BOOLEAN stays 0/1 as in SQLite
+    return {
+        'INTEGER': pa.int64(),
+        'REAL': pa.float64(),
+        'BOOLEAN': pa.int64(),
+        'DATE': pa.date32(),
+        'DATETIME': pa.timestamp('s'),
+    }.get(col_type, pa.string())
+
+
+class SnapshotWriter:
+    """
+    Context manager writing one ingest's chunks as a snapshot part.
+
+    Entered before the table's transaction and left after it. The part is
+    published once the rows are committed, through an on_commit callback of
+    the analytics database, so an ingest inside an outer transaction waits for
+    that one too; it is discarded if ingestion fails or the transaction rolls
+    back. open() starts the file once the table's columns are known; an
+    append adds the part to the existing snapshot. A chunk holding a value its
+    column's type can't (ingest keeps those as text), or a column widened to
+    TEXT mid-ingest, abandons the part, and the table's snapshot is dropped
+    instead.
+    """
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.writer = None
+        self.failed = False
+
+    def open(self, column_types, append=False):
+        """Start the part for a table with ``column_types`` ({name: type}, in table order)."""
+        if not snapshots_enabled():
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.append = append
+        self.version = snapshot_version(self.table_name)
+        # The snapshot an appended part belongs to; it must still be the same one at commit
+        self.snapshot_id = _directory_id(snapshot_path(self.table_name))
+        self.schema = pa.schema([pa.field(name, _arrow_type(t, pa)) for name, t in column_types.items()])
+        self.build_dir = new_build_dir(self.table_name)
+        # A rolled-back transaction drops its on_commit callbacks, and with them this writer
+        weakref.finalize(self, shutil.rmtree, self.build_dir, ignore_errors=True)
+        self.writer = pq.ParquetWriter(os.path.join(self.build_dir, part_name(0)), self.schema, compression='zstd')
+
+    def abandon(self, reason):
+        """Give up the part, and drop the table's snapshot at commit: the table changed in a way it can't follow."""
+        if self.writer is not None and not self.failed:
+            logger.warning(f"Snapshot of {self.table_name} abandoned: {reason}")
+            self.failed = True
+
+    def write(self, chunk):
+        """Append a coerced DataFrame chunk as a row group."""
+        if self.writer is None or self.failed:
+            return
+        import pyarrow as pa
+
+        try:
+            arrays = []
+            for field in self.schema:
+                if field.name not in chunk:
+                    arrays.append(pa.nulls(len(chunk), type=field.type))
+                elif pa.types.is_date(field.type) or pa.types.is_timestamp(field.type):
+                    # Coerced dates are ISO text
+                    arrays.append(pa.array(chunk[field.name], type=pa.string(), from_pandas=True).cast(field.type))
+                else:
+                    arrays.append(pa.array(chunk[field.name], type=field.type, from_pandas=True))
+            self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError) as e:
+            logger.warning(f"Snapshot of {self.table_name} abandoned: {str(e)}")
+            self.failed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.writer is None:
+            return
+        self.writer.close()
+        if exc_type is not None:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+            return
+        transaction.on_commit(self._publish, using=settings.ANALYTICS_DATABASE)
+
+    def _publish(self):
+        try:
+            self._commit()
+        except OSError as e:
+            # The upload itself succeeded; readers fall back to the table
+            logger.warning(f"Could not publish the snapshot of {self.table_name}: {str(e)}")
+            invalidate_snapshots([self.table_name])
+
+    def _commit(self):
+        if self.failed:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+            invalidate_snapshots([self.table_name])
+            return
+        if not self.append:
+            # A build from the table started before this upload must not win
+            _bump_version(self.table_name)
+            publish_snapshot(self.table_name, self.build_dir, snapshot_version(self.table_name))
+            return
+        try:
+            final_dir = snapshot_path(self.table_name)
+            if (snapshot_version(self.table_name) != self.version or self.snapshot_id is None
+                    or _directory_id(final_dir) != self.snapshot_id):
+                # Without exactly the table's other rows, the part is no use
+                invalidate_snapshots([self.table_name])
+                return
+            _bump_version(self.table_name)
+            parts = [name for name in os.listdir(final_dir) if name.endswith('.parquet')]
+            os.rename(os.path.join(self.build_dir, part_name(0)), os.path.join(final_dir, part_name(len(parts))))
+        finally:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+
+
+def _open_snapshot(table_name, columns=None):
+    """
+    Memory-map a snapshot's part files: (files, [(output name, file column)]), or None.
+
+    ``columns`` are matched case-insensitively, as SQLite matches identifiers;
+    None if one is missing.
+    """
+    if not has_snapshot(table_name):
+        return None
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return None
+
+    path = snapshot_path(table_name)
+    try:
+        # Opened up front: a snapshot dropped mid-read stays readable through its maps
+        files = [
+            pq.ParquetFile(os.path.join(path, name), memory_map=True)
+            for name in sorted(os.listdir(path)) if name.endswith('.parquet')
+        ]
+    except (OSError, pa.ArrowInvalid) as e:
+        logger.warning(f"Could not open the snapshot of {table_name}: {str(e)}")
+        return None
+    if not files:
+        return None
+    names = files[0].schema_arrow.names
+    if columns is None:
+        return files, [(name, name) for name in names]
+    by_lower = {name.lower(): name for name in names}
+    if any(column.lower() not in by_lower for column in columns):
+        return None
+    return files, [(column, by_lower[column.lower()]) for column in columns]
+
+
+def _column_values(column, pa):
+    """
+    A column as a list of Python values (None for nulls, dates as date/datetime, as from SQLite).
+
+    Goes through NumPy: an order of magnitude faster than to_pylist().
+    """
+    if not column.null_count or pa.types.is_string(column.type):
+        return column.to_numpy(zero_copy_only=False).tolist()
+    if column.null_count == len(column):
+        return [None] * len(column)
+    # NumPy has no null for ints and dates: fill with any value, convert, then put the Nones back
+    values = column.fill_null(column.drop_null()[0]).to_numpy(zero_copy_only=False).tolist()
+    for i in np.flatnonzero(column.is_null().to_numpy(zero_copy_only=False)):
+        values[i] = None
+    return values
+
+
+def _iter_columns(files, projection, batch_rows):
+    """Yield lists of column value lists."""
+    import pyarrow as pa
+
+    source_columns = list(dict.fromkeys(source for _, source in projection))
+    for parquet_file in files:
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=source_columns):
+            values = {name: _column_values(column, pa) for name, column in zip(batch.schema.names, batch.columns)}
+            yield [values[source] for _, source in projection]
+
+
+def snapshot_batches(table_name, batch_rows, columns=None):
+    """
+    Read a table's rows from its snapshot, only the ``columns`` asked for (all by default).
+
+    Returns a generator yielding the column names, then lists of at most
+    ``batch_rows`` row tuples; None when there is no usable snapshot.
+    """
+    opened = _open_snapshot(table_name, columns)
+    if opened is None:
+        return None
+    files, projection = opened
+
+    def batches():
+        yield [name for name, _ in projection]
+        for column_values in _iter_columns(files, projection, batch_rows):
+            yield list(zip(*column_values))
+
+    return batches()
+
+
+def snapshot_frames(table_name, batch_rows, columns=None):
+    """Like snapshot_batches, but yielding DataFrames of plain Python values (object columns)."""
+    opened = _open_snapshot(table_name, columns)
+    if opened is None:
+        return None
+    files, projection = opened
+
+    def frames():
+        names = [name for name, _ in projection]
+        yield names
+        for column_values in _iter_columns(files, projection, batch_rows):
+            yield pd.DataFrame({
+                name: pd.Series(values, dtype=object) for name, values in zip(names, column_values)
+            })
+
+    return frames()
+
+
+def _unquote(identifier):
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+def table_projection(sql):
+    """
+    (table, columns, limit) when ``sql`` only selects columns of one table, else None.
+
+    columns is None for ``SELECT *`` and limit None without a LIMIT.
+    """
+    match = TABLE_PROJECTION_RE.match(sql)
+    if not match:
+        return None
+    columns = None
+    if match.group('columns') != '*':
+        columns = [_unquote(name) for name in re.findall(IDENTIFIER, match.group('columns'))]
+    limit = int(match.group('limit')) if match.group('limit') is not None else None
+    return _unquote(match.group('table')), columns, limit
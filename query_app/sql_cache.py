@@ -0,0 +1,113 @@
+"""
+Persistent cache of natural-language question -> generated SQL.
+
+Entries are keyed by a normalized form of the question plus a fingerprint of
+the schema the SQL was generated against (the output of get_database_context
+and the primary table), so a cached statement is only reused when the model
+would have seen exactly the same prompt context. Entries expire after
+SQL_CACHE_TTL seconds, the least recently used ones are evicted beyond
+SQL_CACHE_MAX_ENTRIES, and a dataset group's entries are dropped whenever one
+of its tables is uploaded to, appended to, renamed or deleted.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from .models import CachedQuery
+
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def normalize_question(query):
+    """Reduce a question to a canonical form so trivial rephrasings share an entry."""
+    text = query.lower().strip()
+    # Punctuation and quoting style don't change the meaning of the request
+    text = re.sub(r"[^\w\s'%<>=.-]", ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip(' .')
+    text = re.sub(r'^(please|can you|could you|kindly) ', '', text)
+    text = re.sub(r' please$', '', text)
+    return text
+
+
+def schema_fingerprint(db_context, primary_table):
+    """Hash of the schema context a question's SQL was generated against."""
+    payload = json.dumps({'context': db_context, 'primary': primary_table}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def get_cached_sql(query, dataset, db_context):
+    """Return cached SQL for ``query`` against ``dataset``'s current schema, or None."""
+    fingerprint = schema_fingerprint(db_context, dataset.table_name)
+    entry = CachedQuery.objects.filter(
+        fingerprint=fingerprint,
+        normalized_query=normalize_question(query),
+        dataset=dataset,
+    ).first()
+
+    if entry and entry.created_at < timezone.now() - timedelta(seconds=settings.SQL_CACHE_TTL):
+        entry.delete()
+        entry = None
+
+    if not entry:
+        _record('misses')
+        return None
+
+    # Bump recency for LRU eviction without a read-modify-write race on hit_count
+    CachedQuery.objects.filter(pk=entry.pk).update(hit_count=F('hit_count') + 1, last_used_at=timezone.now())
+    _record('hits')
+    logger.info(f"SQL cache hit for dataset {dataset.id}: {entry.normalized_query!r}")
+    return entry.sql_query
+
+
+def cache_sql(query, dataset, db_context, sql_query):
+    """Store generated SQL for ``query`` and evict least recently used entries beyond the limit."""
+    try:
+        CachedQuery.objects.update_or_create(
+            dataset=dataset,
+            fingerprint=schema_fingerprint(db_context, dataset.table_name),
+            normalized_query=normalize_question(query),
+            defaults={'sql_query': sql_query},
+        )
+
+        excess = CachedQuery.objects.count() - settings.SQL_CACHE_MAX_ENTRIES
+        if excess > 0:
+            stale_ids = list(CachedQuery.objects.order_by('last_used_at').values_list('pk', flat=True)[:excess])
+            CachedQuery.objects.filter(pk__in=stale_ids).delete()
+    except DatabaseError as e:
+        # The cache is an optimisation; a busy database must not fail the question
+        logger.warning(f"Could not cache SQL for dataset {dataset.id}: {str(e)}")
+
+
+def evict_question(query, dataset):
+    """Drop cached SQL for one question, e.g. after it failed to execute."""
+    CachedQuery.objects.filter(dataset=dataset, normalized_query=normalize_question(query)).delete()
+
+
+def invalidate_datasets(datasets):
+    """Drop every cached statement generated for any of ``datasets``."""
+    deleted, _ = CachedQuery.objects.filter(dataset__in=datasets).delete()
+    if deleted:
+        logger.info(f"Invalidated {deleted} cached SQL entries")
+
+
+def cache_stats():
+    """Hit/miss counters for this process plus the number of stored entries."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['entries'] = CachedQuery.objects.count()
+    return stats
@@ -0,0 +1,63 @@
+"""Helpers shared by the query_app tests: small CSV datasets in the analytics test database."""
+import shutil
+import tempfile
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from ..db import analytics_connection
+from ..ingest import ingest_file
+from ..models import Dataset
+from ..result_cache import clear_local_results
+from ..schema_catalog import clear_local_catalogs
+
+
+def csv_file(text, name='sales.csv'):
+    return ContentFile(text.encode(), name=name)
+
+
+def make_dataset(text, name='sales.csv', chunk_rows=None, user=None):
+    """Ingest CSV ``text`` into a table named after ``name`` and register it as a Dataset of ``user``."""
+    table_name = name.split('.')[0]
+    columns, _, profile = ingest_file(csv_file(text, name), table_name, chunk_rows=chunk_rows)
+    return Dataset.objects.create(
+        user=user, name=name, table_name=table_name, columns=columns, profile=profile, file=f'datasets/{name}'
+    )
+
+
+def numbered_csv(rows):
+    return 'id,city,amount\n' + ''.join(f'{i},{"ab"[i % 2]},{i * 10}\n' for i in range(1, rows + 1))
+
+
+def read_table(table_name):
+    with analytics_connection().cursor() as cursor:
+        cursor.execute(f'SELECT * FROM "{table_name}" ORDER BY rowid')
+        return cursor.fetchall()
+
+
+@override_settings(
+    DATASET_SNAPSHOTS=False,
+    QUERY_ENGINE='sqlite',
+    LLM_PROVIDER='offline',
+    OFFLINE_LLM_LATENCY=0,
+    OFFLINE_LLM_TOKEN_LATENCY=0,
+    RESULT_CACHE='',
+)
+class DatasetTestCase(TestCase):
+    """TestCase over both databases, with uploads and snapshots written to a scratch directory."""
+    databases = {'default', 'analytics'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.scratch_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.scratch_dir, ignore_errors=True)
+        scratch = override_settings(MEDIA_ROOT=cls.scratch_dir, COLUMNAR_SNAPSHOT_DIR=f'{cls.scratch_dir}/snapshots')
+        scratch.enable()
+        cls.addClassCleanup(scratch.disable)
+        super().setUpClass()
+
+    def setUp(self):
+        clear_local_results()
+        clear_local_catalogs()
+        # Datasets made here start at the same (blank) schema version in every test
+        caches[settings.SCHEMA_CATALOG_CACHE].clear()
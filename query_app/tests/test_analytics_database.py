@@ -0,0 +1,70 @@
+import io
+from django.core.management import call_command
+from django.db import connections
+from ..db import AnalyticsRouter, analytics_connection
+from ..models import Dataset
+from .base import DatasetTestCase, make_dataset, numbered_csv, read_table
+
+
+def table_names(connection):
+    with connection.cursor() as cursor:
+        return set(connection.introspection.table_names(cursor))
+
+
+class AnalyticsRouterTests(DatasetTestCase):
+    def test_django_tables_stay_out_of_the_analytics_database(self):
+        router = AnalyticsRouter()
+
+        self.assertFalse(router.allow_migrate('analytics', 'query_app', 'dataset'))
+        self.assertIsNone(router.allow_migrate('default', 'query_app', 'dataset'))
+        self.assertNotIn('query_app_dataset', table_names(analytics_connection()))
+        self.assertIn('query_app_dataset', table_names(connections['default']))
+
+    def test_uploads_land_in_the_analytics_database(self):
+        make_dataset(numbered_csv(3))
+
+        self.assertIn('sales', table_names(analytics_connection()))
+        self.assertNotIn('sales', table_names(connections['default']))
+
+
+class MoveTablesTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        with connections['default'].cursor() as cursor:
+            cursor.execute('CREATE TABLE "legacy" ("id" BIGINT, "name" TEXT)')
+            cursor.executemany('INSERT INTO "legacy" VALUES (%s, %s)', [(i, f'row {i}') for i in range(1, 6)])
+        Dataset.objects.create(
+            name='legacy.csv', table_name='legacy', file='datasets/legacy.csv',
+            columns=[{'name': 'id', 'type': 'INTEGER', 'nulls': 0}, {'name': 'name', 'type': 'TEXT', 'nulls': 0}],
+        )
+
+    def move(self, *args):
+        out = io.StringIO()
+        call_command('move_tables_to_analytics', '--batch-rows', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_tables_are_copied_with_their_types(self):
+        output = self.move()
+
+        self.assertIn('legacy: 5 rows copied', output)
+        self.assertEqual(read_table('legacy'), [(i, f'row {i}') for i in range(1, 6)])
+        with analytics_connection().cursor() as cursor:
+            description = analytics_connection().introspection.get_table_description(cursor, 'legacy')
+        self.assertEqual([field.type_code for field in description], ['INTEGER', 'TEXT'])
+        # Without --drop the original stays
+        self.assertIn('legacy', table_names(connections['default']))
+
+    def test_drop_removes_the_original_and_a_second_run_moves_nothing(self):
+        self.move('--drop')
+
+        self.assertNotIn('legacy', table_names(connections['default']))
+        self.assertIn('0 tables moved', self.move())
+
+    def test_tables_already_moved_are_skipped(self):
+        with analytics_connection().cursor() as cursor:
+            cursor.execute('CREATE TABLE "legacy" ("id" INTEGER)')
+
+        output = self.move()
+
+        self.assertIn('legacy: already in the analytics database, skipped', output)
+        self.assertEqual(read_table('legacy'), [])
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.test import AsyncRequestFactory, override_settings
+from ..llm import OfflineProvider
+from ..models import Conversation, Dataset
+from ..views import aanswer_query, aprocess_query
+from .base import DatasetTestCase, csv_file, make_dataset, numbered_csv, read_table
+
+
+class AsyncViewTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(numbered_csv(4))
+
+    def post(self, data):
+        request = AsyncRequestFactory().post('/process_query/', data)
+        request.user = AnonymousUser()
+        return request
+
+    async def test_question_is_answered_and_stored(self):
+        response = await aprocess_query(self.post({'query': 'count rows by city', 'dataset': self.dataset.id}))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, f'/query/?dataset={self.dataset.id}')
+        conversation = await Conversation.objects.aget()
+        self.assertIn('GROUP BY', conversation.sql_query)
+        self.assertIn('<table', conversation.response)
+
+    async def test_uploads_take_the_sync_path(self):
+        response = await aprocess_query(self.post({'file': csv_file(numbered_csv(2), name='more.csv')}))
+
+        dataset = await Dataset.objects.aget(table_name='more')
+        self.assertEqual(response.url, f'/query/?dataset={dataset.id}&new_upload=true')
+        self.assertEqual(len(await sync_to_async(read_table)('more')), 2)
+
+    async def test_failed_statement_is_stored_as_an_error_and_not_cached(self):
+        with mock.patch.object(OfflineProvider, 'answer', return_value='SELECT nope FROM sales'), \
+                self.assertLogs('query_app.views', 'ERROR'):
+            conversation = await aanswer_query('show everything', self.dataset)
+
+        self.assertTrue(conversation.response.startswith('<p>Error: '))
+        self.assertEqual(conversation.sql_query, '')
+        self.assertFalse(await self.dataset.cachedquery_set.aexists())
+
+    @override_settings(LLM_MAX_CONCURRENCY=0, LLM_RATE_PER_MINUTE=0)
+    async def test_model_calls_overlap_on_the_event_loop(self):
+        with mock.patch.object(OfflineProvider, 'delay_for', return_value=0.3):
+            start = time.perf_counter()
+            conversations = await asyncio.gather(
+                aanswer_query('count rows by city', self.dataset),
+                aanswer_query('show the total amount', self.dataset),
+            )
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(len({conversation.sql_query for conversation in conversations}), 2)
+        self.assertLess(elapsed, 0.55)
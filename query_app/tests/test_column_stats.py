@@ -0,0 +1,86 @@
+import statistics
+from unittest import mock
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory
+from ..column_stats import profile_table, summarize_profile
+from ..models import Dataset
+from ..views import execute_sql_statements, get_dataset_profile, process_file_upload, record_data_change, visualize_data
+from .base import DatasetTestCase, csv_file, make_dataset
+
+
+def sales_csv(start, stop):
+    return 'id,city,amount,day\n' + ''.join(
+        f'{i},{"abc"[i % 3]},{i * 1.5},2024-01-{i % 28 + 1:02d}\n' for i in range(start, stop)
+    )
+
+
+class ColumnStatsTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(sales_csv(0, 1000), chunk_rows=128)
+
+    def request(self, path='/'):
+        request = RequestFactory().get(path)
+        request.user = AnonymousUser()
+        return request
+
+    def test_stats_of_a_chunked_ingest_are_exact(self):
+        amounts = [i * 1.5 for i in range(1000)]
+
+        stats = summarize_profile(self.dataset.profile)
+
+        self.assertEqual(self.dataset.profile['row_count'], 1000)
+        self.assertEqual((stats['amount']['min'], stats['amount']['max']), (0.0, 1498.5))
+        self.assertAlmostEqual(stats['amount']['mean'], statistics.mean(amounts))
+        self.assertAlmostEqual(stats['amount']['stddev'], statistics.stdev(amounts))
+        self.assertEqual(stats['city']['top'], [['a', 334], ['b', 333], ['c', 333]])
+        self.assertEqual((stats['day']['min'], stats['day']['max']), ('2024-01-01', '2024-01-28'))
+        self.assertEqual(stats['city']['distinct'], 3)
+        # HyperLogLog: within a few percent
+        self.assertAlmostEqual(stats['id']['distinct'], 1000, delta=50)
+
+    def test_rebuilt_profile_matches_the_ingested_one(self):
+        column_types = {col['name']: col['type'] for col in self.dataset.columns}
+
+        rebuilt = summarize_profile(profile_table('sales', column_types, chunk_rows=300))
+
+        ingested = summarize_profile(self.dataset.profile)
+        # Every id is as frequent as any other, so which ones are "top" depends on the chunks
+        del rebuilt['id']['top'], ingested['id']['top']
+        self.assertEqual(rebuilt, ingested)
+
+    def test_appended_file_is_merged_into_the_profile(self):
+        process_file_upload(csv_file(sales_csv(1000, 1100)), self.request(), 'sales')
+
+        self.dataset.refresh_from_db()
+        stats = summarize_profile(self.dataset.profile)
+        self.assertEqual(self.dataset.profile['row_count'], 1100)
+        self.assertEqual(stats['amount']['max'], 1648.5)
+        self.assertAlmostEqual(stats['amount']['mean'], statistics.mean(i * 1.5 for i in range(1100)))
+
+    def test_write_drops_the_profile_and_it_is_rebuilt_once(self):
+        execute_sql_statements(['UPDATE sales SET amount = 0'])
+        record_data_change(self.dataset, ['UPDATE sales SET amount = 0'])
+        self.dataset.refresh_from_db()
+        self.assertIsNone(self.dataset.profile)
+
+        with self.assertLogs('query_app.views', 'INFO') as logs:
+            profile = get_dataset_profile(self.dataset)
+            get_dataset_profile(self.dataset)
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(summarize_profile(profile)['amount']['max'], 0.0)
+        self.assertEqual(Dataset.objects.get().profile, profile)
+
+    def test_visualize_reads_the_stored_profile(self):
+        with mock.patch('query_app.views.render', return_value=HttpResponse()) as render, \
+                mock.patch('query_app.views.profile_table') as rebuild:
+            visualize_data(self.request(f'/?dataset={self.dataset.id}'))
+
+        rebuild.assert_not_called()
+        context = render.call_args.args[2]
+        self.assertEqual(context['data_stats']['total_records'], 1000)
+        self.assertEqual(context['data_stats']['numeric_columns']['amount']['max'], 1498.5)
+        self.assertEqual(context['chart_data']['distribution_column'], 'city')
+        self.assertEqual(context['chart_data']['distribution_values'], [334, 333, 333])
@@ -0,0 +1,81 @@
+import threading
+from unittest import mock
+import duckdb
+from django.test import override_settings
+from .. import columnar
+from ..columnar import _duckdb_cursor, check_sources, run_select
+from ..guardrails import QueryRejected
+from ..snapshots import has_snapshot, invalidate_snapshots
+from ..views import execute_sql_statements
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+@override_settings(DATASET_SNAPSHOTS=True, QUERY_ENGINE='duckdb')
+class ColumnarEngineTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        # The DuckDB database is process-wide and only allows the snapshot directory it was made with
+        for name, value in [('_database', None), ('_local', threading.local())]:
+            patcher = mock.patch.object(columnar, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with self.captureOnCommitCallbacks(using='analytics', execute=True):
+            make_dataset(numbered_csv(6))
+            make_dataset('code\nsecret\n', 'keys.csv')
+        self.assertTrue(has_snapshot('sales'))
+
+    def test_selects_run_on_the_snapshot(self):
+        rows, columns = run_select('SELECT city, SUM(amount) FROM sales GROUP BY city ORDER BY city', ['sales'])
+
+        self.assertEqual(rows, [('a', 120), ('b', 90)])
+        # Named as SQLite would name them
+        self.assertEqual(columns, ['city', 'SUM(amount)'])
+
+    def test_like_stays_case_insensitive(self):
+        rows, _ = run_select("SELECT COUNT(*) FROM sales WHERE city LIKE 'A'", ['sales'])
+
+        self.assertEqual(rows, [(3,)])
+
+    def test_queries_reading_anything_but_the_datasets_tables_are_refused(self):
+        refused = [
+            "SELECT * FROM sales, read_text('/etc/passwd')",
+            "SELECT * FROM sales, '/etc/passwd'",
+            'SELECT * FROM sales JOIN keys ON 1 = 1',
+            'SELECT * FROM sales WHERE id IN (SELECT 1 FROM information_schema.tables)',
+            'SELECT * FROM sales UNION ALL SELECT * FROM duckdb_settings()',
+        ]
+        for sql in refused:
+            with self.subTest(sql=sql), self.assertLogs('query_app.columnar', 'WARNING'):
+                with self.assertRaises(QueryRejected):
+                    run_select(sql, ['sales'])
+
+    def test_ctes_may_be_read(self):
+        sql = 'WITH big AS (SELECT * FROM sales WHERE amount > 30) SELECT COUNT(*) FROM big'
+
+        self.assertTrue(check_sources(_duckdb_cursor(), sql, ['sales']))
+        self.assertEqual(run_select(sql, ['sales'])[0], [(3,)])
+
+    def test_refusal_reaches_the_caller(self):
+        with self.assertLogs('query_app.columnar', 'WARNING'), self.assertRaises(QueryRejected):
+            execute_sql_statements(["SELECT * FROM sales, read_csv('/etc/passwd')"], tables=['sales'])
+
+    def test_configuration_is_locked(self):
+        cursor = _duckdb_cursor()
+
+        with self.assertRaises(duckdb.Error):
+            cursor.execute('SET enable_external_access = true')
+        with self.assertRaises(duckdb.Error):
+            cursor.execute("SELECT * FROM read_text('/etc/passwd')").fetchall()
+
+    def test_statements_duckdb_cannot_run_fall_back_to_sqlite(self):
+        self.assertFalse(check_sources(_duckdb_cursor(), 'SELECT * FROM sales; SELECT 1', ['sales']))
+        # SQLite accepts a bare column next to an aggregate, DuckDB doesn't
+        self.assertIsNone(run_select('SELECT city, id, MAX(amount) FROM sales', ['sales']))
+
+    def test_tables_without_a_snapshot_run_on_sqlite_until_one_is_built(self):
+        invalidate_snapshots(['sales'])
+
+        with mock.patch('query_app.columnar.request_snapshot') as request_snapshot:
+            self.assertIsNone(run_select('SELECT COUNT(*) FROM sales', ['sales']))
+
+        request_snapshot.assert_called_once_with('sales')
@@ -0,0 +1,68 @@
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from ..models import Conversation
+from ..views import get_conversation_page
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+@override_settings(CONVERSATION_PAGE_SIZE=3, CONVERSATION_COLLAPSE_CHARS=100)
+class ConversationPagingTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(numbered_csv(2))
+        self.turns = [
+            Conversation.objects.create(
+                dataset=self.dataset, user_query=f'question {i}', sql_query='', response=f'<p>answer {i}</p>',
+            )
+            for i in range(7)
+        ]
+
+    def history(self, **params):
+        return self.client.get(reverse('conversation_history'), {'dataset': self.dataset.id, **params})
+
+    def test_pages_go_back_from_the_latest_turns(self):
+        latest, cursor = get_conversation_page(self.dataset)
+        older, older_cursor = get_conversation_page(self.dataset, cursor)
+        oldest, end = get_conversation_page(self.dataset, older_cursor)
+
+        self.assertEqual([turn.user_query for turn in latest], ['question 4', 'question 5', 'question 6'])
+        self.assertEqual(cursor, self.turns[4].id)
+        self.assertEqual([turn.user_query for turn in older], ['question 1', 'question 2', 'question 3'])
+        self.assertEqual([turn.user_query for turn in oldest], ['question 0'])
+        self.assertIsNone(end)
+
+    def test_history_view_renders_older_turns(self):
+        data = self.history(before=self.turns[4].id).json()
+
+        self.assertIn('question 3', data['html'])
+        self.assertNotIn('question 4', data['html'])
+        self.assertEqual(data['next_cursor'], self.turns[1].id)
+        self.assertEqual(self.history(dataset='x').status_code, 404)
+
+    def test_large_responses_are_collapsed_and_fetched_on_demand(self):
+        big = Conversation.objects.create(
+            dataset=self.dataset, user_query='everything', sql_query='', response='<p>' + 'x' * 500 + '</p>',
+        )
+
+        latest, _ = get_conversation_page(self.dataset)
+
+        self.assertTrue(latest[-1].collapsed)
+        self.assertEqual(len(latest[-1].response_preview), 100)
+        self.assertFalse(latest[0].collapsed)
+        url = reverse('conversation_response', args=[big.id])
+        self.assertIn(url, self.history().json()['html'])
+        self.assertEqual(self.client.get(url).json()['html'], big.response)
+
+    def test_other_users_turns_are_not_found(self):
+        self.client.force_login(User.objects.create_user('other'))
+
+        self.assertEqual(self.history().status_code, 404)
+        response = self.client.get(reverse('conversation_response', args=[self.turns[0].id]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_chat_page_shows_the_latest_page(self):
+        response = self.client.get(reverse('query_interface'), {'dataset': self.dataset.id})
+
+        self.assertContains(response, 'question 6')
+        self.assertNotContains(response, 'question 3')
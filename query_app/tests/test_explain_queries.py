@@ -0,0 +1,51 @@
+import io
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+from ..management.commands.explain_queries import is_full_scan
+from ..models import Conversation, QueryJob
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+class FullScanTests(SimpleTestCase):
+    def test_scans_and_temporary_sorts_are_flagged(self):
+        self.assertTrue(is_full_scan('SCAN query_app_conversation', 'SELECT ...'))
+        self.assertTrue(is_full_scan('USE TEMP B-TREE FOR ORDER BY', 'SELECT ...'))
+        self.assertFalse(is_full_scan('SEARCH query_app_dataset USING INDEX dataset_user_name_idx (user_id=?)', ''))
+        self.assertFalse(is_full_scan('SCAN CONSTANT ROW', 'SELECT 1'))
+
+    def test_index_walk_is_fine_only_with_a_limit(self):
+        line = 'SCAN query_app_cachedquery USING INDEX cachedquery_last_used_idx'
+
+        self.assertFalse(is_full_scan(line, 'SELECT ... LIMIT 1'))
+        self.assertTrue(is_full_scan(line, 'SELECT ...'))
+
+    def test_sorting_a_primary_key_lookup_is_fine(self):
+        sort = 'USE TEMP B-TREE FOR ORDER BY'
+        by_key = ['SEARCH query_app_conversation USING INTEGER PRIMARY KEY (rowid=?)', sort]
+        by_dataset = ['SEARCH query_app_conversation USING INDEX conversation_dataset_id_idx (dataset_id=?)', sort]
+
+        self.assertFalse(is_full_scan(sort, 'SELECT ...', by_key))
+        self.assertTrue(is_full_scan(sort, 'SELECT ...', by_dataset))
+
+
+class ExplainQueriesCommandTests(DatasetTestCase):
+    def explain(self, *args):
+        out = io.StringIO()
+        call_command('explain_queries', *args, stdout=out)
+        return out.getvalue()
+
+    def test_app_queries_use_indexes(self):
+        dataset = make_dataset(numbered_csv(2))
+        Conversation.objects.create(dataset=dataset, user_query='q', sql_query='', response='<p>a</p>')
+        QueryJob.objects.create(dataset=dataset, user_query='q')
+
+        output = self.explain('--dataset', str(dataset.id), '--fail-on-scan')
+
+        self.assertIn('OK   GET /query/?dataset=', output)
+        self.assertIn('OK   job status', output)
+        self.assertNotRegex(output, r'(?m)^SCAN ')
+        self.assertRegex(output, r'\d+ queries explained, 0 with full scans')
+
+    def test_no_dataset_is_an_error(self):
+        with self.assertRaisesMessage(CommandError, 'No dataset found'):
+            self.explain()
@@ -0,0 +1,92 @@
+import io
+import json
+from django.test import override_settings
+from django.urls import reverse
+from ..export import aiter_chunks, iter_csv
+from ..models import Conversation
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+@override_settings(QUERY_MAX_ROWS=1000000, EXPORT_BATCH_ROWS=50)
+class ExportTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(numbered_csv(120))
+        self.conversation = Conversation.objects.create(
+            dataset=self.dataset,
+            user_query='show everything',
+            sql_query='SELECT * FROM sales ORDER BY id',
+            response='',
+        )
+        self.url = reverse('export_results', args=[self.conversation.id])
+
+    def export(self, export_format):
+        response = self.client.get(self.url, {'format': export_format})
+        return response, b''.join(response.streaming_content)
+
+    async def aexport(self, export_format):
+        response = await self.async_client.get(self.url, {'format': export_format})
+        return response, b''.join([chunk async for chunk in response.streaming_content])
+
+    def test_csv_and_ndjson_exports_hold_every_row(self):
+        _, content = self.export('csv')
+        lines = content.decode().splitlines()
+        self.assertEqual(lines[0], 'id,city,amount')
+        self.assertEqual(lines[1:3], ['1,b,10', '2,a,20'])
+        self.assertEqual(len(lines), 121)
+
+        _, content = self.export('ndjson')
+        records = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(len(records), 120)
+        self.assertEqual(records[-1], {'id': 120, 'city': 'a', 'amount': 1200})
+
+    def test_parquet_export(self):
+        import pyarrow.parquet as pq
+
+        response, content = self.export('parquet')
+
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.parquet')
+        table = pq.read_table(io.BytesIO(content))
+        self.assertEqual(table.column_names, ['id', 'city', 'amount'])
+        self.assertEqual(table.num_rows, 120)
+
+    @override_settings(QUERY_MAX_ROWS=30)
+    def test_export_stops_at_the_row_limit(self):
+        _, content = self.export('csv')
+
+        self.assertEqual(len(content.decode().splitlines()), 31)
+
+    def test_unknown_format_and_writes_are_refused(self):
+        response = self.client.get(self.url, {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+        self.conversation.sql_query = 'UPDATE sales SET amount = 0'
+        self.conversation.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(ASYNC_QUERY_VIEWS=True)
+    async def test_export_is_an_async_stream_under_asgi(self):
+        response, content = await self.aexport('csv')
+
+        self.assertTrue(response.is_async)
+        lines = content.decode().splitlines()
+        self.assertEqual(lines[0], 'id,city,amount')
+        self.assertEqual(len(lines), 121)
+
+        response, content = await self.aexport('ndjson')
+        self.assertEqual(json.loads(content.decode().splitlines()[-1]), {'id': 120, 'city': 'a', 'amount': 1200})
+
+    async def test_abandoned_async_export_closes_its_rows(self):
+        rows = iter_csv('SELECT * FROM sales', batch_rows=10)
+        chunks = aiter_chunks(rows)
+
+        self.assertTrue((await anext(chunks)).startswith('id,city,amount'))
+        await chunks.aclose()
+
+        self.assertIsNone(rows.gi_frame)
+
+    def test_export_is_a_sync_stream_otherwise(self):
+        response, _ = self.export('csv')
+
+        self.assertFalse(response.is_async)
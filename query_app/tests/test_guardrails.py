@@ -0,0 +1,94 @@
+from django.test import override_settings
+from django.urls import reverse
+from ..db import analytics_connection
+from ..guardrails import QueryCancelled, QueryRejected, QueryTimeout, add_limit, check_cost, is_select, request_cancel
+from ..models import Conversation
+from ..views import execute_sql_statements
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+# Never finishes: counts an endless recursive CTE
+ENDLESS_SQL = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c'
+
+
+class GuardrailTests(DatasetTestCase):
+    def test_add_limit(self):
+        self.assertEqual(add_limit('SELECT * FROM t', 5), 'SELECT * FROM t\nLIMIT 5')
+        self.assertEqual(add_limit('SELECT * FROM t -- all', 5), 'SELECT * FROM t -- all\nLIMIT 5')
+        self.assertEqual(add_limit('SELECT * FROM t LIMIT 2', 5), 'SELECT * FROM t LIMIT 2')
+        self.assertEqual(add_limit('SELECT * FROM t', 0), 'SELECT * FROM t')
+        self.assertEqual(add_limit('DELETE FROM t', 5), 'DELETE FROM t')
+        # A LIMIT inside a CTE or subquery doesn't bound the outer SELECT
+        self.assertEqual(
+            add_limit('WITH a AS (SELECT * FROM t LIMIT 2) SELECT * FROM a', 5),
+            'WITH a AS (SELECT * FROM t LIMIT 2) SELECT * FROM a\nLIMIT 5',
+        )
+        self.assertEqual(
+            add_limit('WITH a AS (SELECT 1) INSERT INTO t SELECT * FROM a', 5),
+            'WITH a AS (SELECT 1) INSERT INTO t SELECT * FROM a',
+        )
+
+    def test_is_select(self):
+        self.assertTrue(is_select('-- note\nwith a as (select 1) select * from a'))
+        self.assertFalse(is_select('UPDATE t SET a = 1'))
+        self.assertFalse(is_select(''))
+
+    def test_check_cost_refuses_only_expensive_statements(self):
+        make_dataset(numbered_csv(200))
+        connection = analytics_connection()
+
+        check_cost(connection, ['SELECT city, COUNT(*) FROM sales GROUP BY city'], 1000)
+        with self.assertRaises(QueryRejected), self.assertLogs('query_app.guardrails', 'WARNING'):
+            check_cost(connection, ['SELECT COUNT(*) FROM sales a, sales b'], 1000)
+        check_cost(connection, ['SELECT COUNT(*) FROM sales a, sales b'], 0)
+
+    def test_row_limit_applies_to_cte_queries(self):
+        make_dataset(numbered_csv(20))
+        limits = {'timeout': 0, 'max_rows': 5, 'max_cost': 0}
+
+        is_read, rows, columns, _ = execute_sql_statements(
+            ['WITH a AS (SELECT id FROM sales) SELECT * FROM a'], limits=limits,
+        )
+
+        self.assertTrue(is_read)
+        self.assertEqual(columns, ['id'])
+        self.assertEqual(len(rows), 5)
+
+    def test_long_statements_are_stopped_at_the_time_limit(self):
+        limits = {'timeout': 0.1, 'max_rows': 0, 'max_cost': 0}
+
+        with self.assertRaises(QueryTimeout), self.assertLogs('query_app.views', 'ERROR'):
+            execute_sql_statements([ENDLESS_SQL], limits=limits)
+
+    @override_settings(QUERY_CANCEL_CHECK_INTERVAL=0)
+    def test_cancelled_job_stops_its_statements(self):
+        request_cancel('job-1')
+        limits = {'timeout': 0, 'max_rows': 0, 'max_cost': 0}
+
+        with self.assertRaises(QueryCancelled), self.assertLogs('query_app.views', 'ERROR'):
+            execute_sql_statements([ENDLESS_SQL], limits=limits, job_id='job-1')
+
+
+@override_settings(QUERY_MAX_ROWS=1000000, QUERY_MAX_COST=1000)
+class ExportGuardrailTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(numbered_csv(200))
+
+    def export(self, sql):
+        conversation = Conversation.objects.create(dataset=self.dataset, user_query='q', sql_query=sql, response='')
+        return self.client.get(reverse('export_results', args=[conversation.id]))
+
+    def test_expensive_exports_are_refused_before_they_start(self):
+        with self.assertLogs('query_app.guardrails', 'WARNING'):
+            response = self.export('SELECT * FROM sales a, sales b')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'more than the 1,000 allowed', response.content)
+
+    @override_settings(QUERY_TIMEOUT=0.1, QUERY_MAX_COST=0)
+    def test_exports_stop_at_the_time_limit(self):
+        response = self.export(ENDLESS_SQL)
+
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(QueryTimeout):
+            b''.join(response.streaming_content)
@@ -0,0 +1,166 @@
+import io
+from datetime import date, datetime
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.base import ContentFile
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+from ..ingest import ingest_file, iter_file_chunks
+from ..models import Dataset
+from ..views import process_file_upload
+from .base import DatasetTestCase, csv_file, make_dataset, numbered_csv, read_table
+
+
+class ChunkedIngestTests(DatasetTestCase):
+    def test_every_chunk_is_written(self):
+        columns, rows, _ = ingest_file(csv_file(numbered_csv(7)), 'sales', chunk_rows=3)
+
+        self.assertEqual(rows, 7)
+        self.assertEqual([col['name'] for col in columns], ['id', 'city', 'amount'])
+        self.assertEqual([row[0] for row in read_table('sales')], list(range(1, 8)))
+
+    def test_replace_drops_the_previous_rows(self):
+        ingest_file(csv_file(numbered_csv(5)), 'sales')
+        ingest_file(csv_file(numbered_csv(2)), 'sales', chunk_rows=1)
+
+        self.assertEqual(len(read_table('sales')), 2)
+
+    def test_append_adds_rows(self):
+        ingest_file(csv_file(numbered_csv(2)), 'sales')
+        ingest_file(csv_file('id,city,amount\n3,c,30\n'), 'sales', mode='append')
+
+        self.assertEqual([row[0] for row in read_table('sales')], [1, 2, 3])
+
+    def test_excel_sheets_are_read_in_chunks(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['id', 'name'])
+        for i in range(1, 6):
+            sheet.append([i, f'row {i}'])
+        sheet.append([None, None])
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+
+        _, rows, _ = ingest_file(ContentFile(buffer.getvalue(), name='sheet.xlsx'), 'sheet', chunk_rows=2)
+
+        self.assertEqual(rows, 5)
+        self.assertEqual(read_table('sheet')[-1], (5, 'row 5'))
+
+    def test_column_names_with_quotes_and_percent_signs(self):
+        ingest_file(csv_file('"a ""b""",100%\n1,2\n'), 'odd')
+
+        with self.assertNoLogs('query_app', 'ERROR'):
+            self.assertEqual(read_table('odd'), [(1, 2)])
+
+    def test_unsupported_and_empty_files_are_refused(self):
+        with self.assertRaises(ValueError):
+            iter_file_chunks(csv_file('a\n1\n', name='data.json'), 10)
+        with self.assertRaises(ValueError):
+            ingest_file(csv_file(''), 'sales')
+
+    def test_upload_view_creates_the_dataset(self):
+        response = self.client.post(reverse('process_query'), {'file': csv_file(numbered_csv(3))})
+
+        dataset = Dataset.objects.get()
+        self.assertRedirects(response, f'/query/?dataset={dataset.id}&new_upload=true', fetch_redirect_response=False)
+        self.assertEqual(dataset.table_name, 'sales')
+        self.assertEqual(len(read_table('sales')), 3)
+
+
+class TypeInferenceTests(DatasetTestCase):
+    def append(self, text):
+        request = RequestFactory().post('/')
+        request.user = AnonymousUser()
+        dataset, error = process_file_upload(csv_file(text), request, 'sales')
+        self.assertIsNone(error)
+        return dataset
+
+    def test_types_are_inferred(self):
+        dataset = make_dataset(
+            'id,price,active,day,seen,note\n'
+            '1,2.5,yes,2024-01-31,2024-01-31 10:00:00,a\n'
+            '2,3,no,2024-02-01,2024-02-01 11:30:00,b\n'
+            '3,4.25,yes,2024-02-02,2024-02-02 12:00:00,\n',
+            chunk_rows=2,
+        )
+
+        types = {col['name']: col['type'] for col in dataset.columns}
+        self.assertEqual(types, {
+            'id': 'INTEGER', 'price': 'REAL', 'active': 'BOOLEAN', 'day': 'DATE', 'seen': 'DATETIME', 'note': 'TEXT',
+        })
+        self.assertEqual(read_table('sales')[0], (1, 2.5, 1, date(2024, 1, 31), datetime(2024, 1, 31, 10), 'a'))
+        self.assertEqual(read_table('sales')[2][5], None)
+
+    def test_leading_zeros_and_other_date_formats(self):
+        dataset = make_dataset('zip,day\n02134,31.01.2024\n10001,01.02.2024\n')
+
+        self.assertEqual([col['type'] for col in dataset.columns], ['TEXT', 'DATE'])
+        self.assertEqual(read_table('sales'), [('02134', date(2024, 1, 31)), ('10001', date(2024, 2, 1))])
+
+    def test_numbers_later_chunks_cannot_convert_are_kept_as_text(self):
+        make_dataset('id,code\n1,10\n2,20\n3,unknown\n', chunk_rows=2)
+
+        self.assertEqual(read_table('sales'), [(1, 10), (2, 20), (3, 'unknown')])
+
+    @override_settings(INGEST_SAMPLE_ROWS=2)
+    def test_value_the_sample_missed_makes_a_date_column_text(self):
+        dataset = make_dataset('id,day\n1,01/31/2024\n2,TBD\n3,02/02/2024\n4,02/03/2024\n')
+
+        self.assertEqual(dataset.columns[1], {'name': 'day', 'type': 'TEXT', 'nulls': 0})
+        self.assertEqual([row[1] for row in read_table('sales')], ['2024-01-31', 'TBD', '2024-02-02', '2024-02-03'])
+
+    def test_value_in_a_later_chunk_widens_the_column_to_text(self):
+        dataset = make_dataset('id,day\n1,2024-01-31\n2,2024-02-01\n3,soon\n', chunk_rows=2)
+
+        self.assertEqual(dataset.columns[1], {'name': 'day', 'type': 'TEXT', 'nulls': 0})
+        self.assertEqual(read_table('sales'), [(1, '2024-01-31'), (2, '2024-02-01'), (3, 'soon')])
+        self.assertIsNone(dataset.profile['columns']['day']['min'])
+
+    def test_outcome_does_not_depend_on_chunk_size(self):
+        text = 'id,day\n1,01/31/2024\n2,2024-02-01\n3,later\n4,02/02/2024\n'
+        outcomes = []
+        for chunk_rows in (1, 2, 3, 10):
+            columns, _, _ = ingest_file(csv_file(text), 'sales', chunk_rows=chunk_rows)
+            outcomes.append((columns, read_table('sales')))
+
+        self.assertEqual(outcomes[0][1], [(1, '2024-01-31'), (2, '2024-02-01'), (3, 'later'), (4, '2024-02-02')])
+        for outcome in outcomes[1:]:
+            self.assertEqual(outcome, outcomes[0])
+
+    def test_appended_dates_in_any_known_format_are_read(self):
+        dataset = make_dataset('id,day\n1,2024-01-31\n')
+
+        self.append('id,day\n2,02/15/2024\n3,02/16/2024\n')
+        self.append('id,day\n4,31.01.2024\n5,2024-03-01T00:00:00\n')
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.columns[1], {'name': 'day', 'type': 'DATE', 'nulls': 0})
+        self.assertEqual([row[1] for row in read_table('sales')], [
+            date(2024, 1, 31), date(2024, 2, 15), date(2024, 2, 16), date(2024, 1, 31), date(2024, 3, 1),
+        ])
+
+    def test_appended_iso_times_are_stored_in_utc(self):
+        make_dataset('id,seen\n1,2024-01-31 10:00:00\n')
+
+        self.append('id,seen\n2,2024-03-01T10:00:00+02:00\n')
+
+        self.assertEqual(read_table('sales')[1], (2, datetime(2024, 3, 1, 8)))
+
+    def test_appended_value_that_is_no_date_widens_the_column_and_keeps_every_value(self):
+        dataset = make_dataset('id,day\n1,2024-01-31\n')
+
+        self.append('id,day\n2,2024-03-01\n3,TBD\n')
+        self.append('id,day\n4,2024-03-02 10:30\n')
+
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.columns[1], {'name': 'day', 'type': 'TEXT', 'nulls': 0})
+        self.assertEqual(read_table('sales'), [
+            (1, '2024-01-31'), (2, '2024-03-01'), (3, 'TBD'), (4, '2024-03-02 10:30'),
+        ])
+
+    def test_blank_cells_stay_null(self):
+        dataset = make_dataset('id,day\n1,2024-01-31\n2,\n')
+
+        self.assertEqual(dataset.columns[1], {'name': 'day', 'type': 'DATE', 'nulls': 1})
+        self.assertEqual(read_table('sales')[1], (2, None))
@@ -0,0 +1,152 @@
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from ..guardrails import QueryCancelled
+from ..jobs import cancel_query_job, run_query_job
+from ..models import Conversation, QueryJob
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+class InlineExecutor:
+    """Stands in for the worker pool: runs each job at once, or holds it when ``hold`` is set."""
+
+    def __init__(self, hold=False):
+        self.hold = hold
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+        if not self.hold:
+            fn(*args)
+
+
+class QueryJobTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(numbered_csv(4))
+
+    def submit(self, query='count rows by city', hold=False):
+        executor = InlineExecutor(hold)
+        with mock.patch('query_app.jobs.get_executor', return_value=executor):
+            response = self.client.post(reverse('process_query_async'), {'query': query, 'dataset': self.dataset.id})
+        return response, executor
+
+    def status(self, job_id):
+        return self.client.get(reverse('query_job_status', args=[job_id]))
+
+    def test_job_runs_and_reports_its_answer(self):
+        response, _ = self.submit()
+
+        self.assertEqual(response.status_code, 202)
+        submitted = response.json()
+        self.assertEqual(submitted['status'], 'queued')
+        self.assertEqual(submitted['cancel_url'], reverse('cancel_query_job', args=[submitted['job_id']]))
+        self.assertEqual(submitted['redirect'], f'/query/?dataset={self.dataset.id}')
+
+        status = self.client.get(submitted['status_url']).json()
+        self.assertEqual((status['status'], status['stage'], status['finished']), ('done', 'done', True))
+        self.assertIn('GROUP BY', status['conversation']['sql_query'])
+        self.assertEqual(QueryJob.objects.get().conversation.dataset, self.dataset)
+
+    def test_question_that_needs_no_model_needs_no_job(self):
+        response = self.client.post(
+            reverse('process_query_async'), {'query': 'current table', 'dataset': self.dataset.id}
+        )
+
+        self.assertEqual(response.json(), {'status': 'done', 'redirect': f'/query/?dataset={self.dataset.id}'})
+        self.assertFalse(QueryJob.objects.exists())
+        self.assertIn('sales', Conversation.objects.get().response)
+
+    def test_cancelled_queued_job_never_runs(self):
+        response, executor = self.submit(hold=True)
+        job_id = response.json()['job_id']
+
+        cancelled = self.client.post(reverse('cancel_query_job', args=[job_id])).json()
+        run_query_job(*executor.submitted[0])
+
+        self.assertEqual((cancelled['status'], cancelled['finished']), ('cancelled', True))
+        job = QueryJob.objects.get()
+        self.assertEqual(job.status, 'cancelled')
+        self.assertIsNone(job.conversation)
+
+    def test_running_job_stops_at_its_next_stage(self):
+        response, executor = self.submit(hold=True)
+        job = QueryJob.objects.get(id=response.json()['job_id'])
+        stages = []
+
+        def answer_query(query, dataset, on_progress, **kwargs):
+            on_progress('planning')
+            stages.append('planning')
+            cancel_query_job(job)
+            on_progress('executing')
+            stages.append('executing')
+
+        with mock.patch('query_app.views.answer_query', answer_query):
+            run_query_job(*executor.submitted[0])
+
+        self.assertEqual(stages, ['planning'])
+        self.assertEqual(self.status(job.id).json()['status'], 'cancelled')
+
+    def test_failed_job_reports_the_error(self):
+        response, executor = self.submit(hold=True)
+
+        with mock.patch('query_app.views.answer_query', side_effect=ValueError('model down')), \
+                self.assertLogs('query_app.jobs', 'ERROR'):
+            run_query_job(*executor.submitted[0])
+
+        status = self.status(response.json()['job_id']).json()
+        self.assertEqual((status['status'], status['error']), ('failed', 'model down'))
+
+    def test_cancel_is_refused_once_the_job_finished(self):
+        response, _ = self.submit()
+
+        response = self.client.post(reverse('cancel_query_job', args=[response.json()['job_id']]))
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['status'], 'done')
+
+    @override_settings(QUERY_JOB_TIMEOUT=60)
+    def test_job_that_stopped_reporting_is_failed(self):
+        response, _ = self.submit(hold=True)
+        QueryJob.objects.update(updated_at=timezone.now() - timedelta(seconds=61))
+
+        status = self.status(response.json()['job_id']).json()
+
+        self.assertEqual(status['status'], 'failed')
+        self.assertTrue(status['finished'])
+
+    def test_events_end_with_the_result(self):
+        response, _ = self.submit()
+
+        events = self.client.get(response.json()['events_url'])
+
+        self.assertEqual(events['Content-Type'], 'text/event-stream')
+        content = b''.join(events.streaming_content).decode()
+        self.assertTrue(content.startswith('event: progress\ndata: {"stage": "done"}\n\n'))
+        self.assertIn('event: result\ndata: {"id": ', content)
+
+    def test_other_users_jobs_are_not_found(self):
+        response, _ = self.submit(hold=True)
+        job_id = response.json()['job_id']
+        self.client.force_login(User.objects.create_user('other'))
+
+        self.assertEqual(self.status(job_id).status_code, 404)
+        self.assertEqual(self.client.post(reverse('cancel_query_job', args=[job_id])).status_code, 404)
+        self.assertEqual(QueryJob.objects.get().status, 'queued')
+
+    def test_statement_interrupted_by_a_cancel_stores_no_turn(self):
+        response, executor = self.submit(hold=True)
+        job = QueryJob.objects.get(id=response.json()['job_id'])
+
+        def execute(*args, **kwargs):
+            cancel_query_job(job)
+            raise QueryCancelled("The query was cancelled.")
+
+        with mock.patch('query_app.views.execute_question_statements', execute):
+            run_query_job(*executor.submitted[0])
+
+        self.assertEqual(QueryJob.objects.get().status, 'cancelled')
+        self.assertFalse(Conversation.objects.exists())
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+from django.test import SimpleTestCase, override_settings
+from ..llm_scheduler import LLMQueueTimeout, LLMScheduler, llm_user
+
+
+@override_settings(
+    LLM_COALESCE=True, LLM_MAX_CONCURRENCY=0, LLM_RATE_PER_MINUTE=0, LLM_RATE_BURST=1, LLM_QUEUE_TIMEOUT=5,
+)
+class SchedulerTests(SimpleTestCase):
+    key = ('offline', None)
+
+    def setUp(self):
+        self.scheduler = LLMScheduler()
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+
+    def queued(self):
+        return self.scheduler.stats().get(self.key, {}).get('queued', 0)
+
+    def test_identical_calls_share_one_reply(self):
+        calls, results = [], []
+        started, joined, release = threading.Event(), threading.Event(), threading.Event()
+        join = self.scheduler._join
+
+        def joining(key):
+            future, leader = join(key)
+            if not leader:
+                joined.set()
+            return future, leader
+
+        self.scheduler._join = joining
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'reply'
+
+        def ask():
+            results.append(self.scheduler.coalesce(('offline', 'prompt'), call))
+
+        threads = [threading.Thread(target=ask) for _ in range(2)]
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+        joined.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['reply', 'reply'])
+        # Once the reply is in, the next identical call is made again
+        self.assertEqual(self.scheduler.coalesce(('offline', 'prompt'), lambda: 'new'), 'new')
+
+    def test_failed_call_is_not_kept(self):
+        def fail():
+            raise ValueError('no')
+
+        with self.assertRaises(ValueError):
+            self.scheduler.coalesce(('offline', 'prompt'), fail)
+        self.assertEqual(self.scheduler.coalesce(('offline', 'prompt'), lambda: 'reply'), 'reply')
+
+    @override_settings(LLM_MAX_CONCURRENCY=2)
+    def test_concurrency_limit(self):
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def attempt():
+            with self.scheduler.turn(self.key):
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=attempt) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(self.scheduler.stats(), {})
+
+    @override_settings(LLM_MAX_CONCURRENCY=1)
+    def test_free_turns_go_to_users_in_turn(self):
+        order = []
+
+        def attempt(user):
+            with llm_user(user), self.scheduler.turn(self.key):
+                order.append(user)
+
+        with self.scheduler.turn(self.key):
+            threads = []
+            for user in ['a', 'a', 'a', 'b']:
+                threads.append(threading.Thread(target=attempt, args=(user,)))
+                threads[-1].start()
+                self.wait_for(lambda: self.queued() == len(threads))
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(order, ['a', 'b', 'a', 'a'])
+
+    @override_settings(LLM_MAX_CONCURRENCY=1, LLM_QUEUE_TIMEOUT=0.05)
+    def test_queue_timeout(self):
+        with self.scheduler.turn(self.key):
+            with self.assertRaises(LLMQueueTimeout):
+                with self.scheduler.turn(self.key):
+                    pass
+            self.assertEqual(self.queued(), 0)
+
+        self.assertEqual(self.scheduler.stats(), {})
+
+    @override_settings(LLM_RATE_PER_MINUTE=1200, LLM_RATE_BURST=1)
+    def test_rate_limit_survives_idle_keys(self):
+        start = time.perf_counter()
+        for _ in range(3):
+            with self.scheduler.turn(self.key):
+                pass
+
+        # One call from the burst, then one every 50ms
+        self.assertGreaterEqual(time.perf_counter() - start, 0.09)
+
+    async def test_identical_async_calls_share_one_reply(self):
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return 'reply'
+
+        results = await asyncio.gather(*[self.scheduler.acoalesce(('offline', 'prompt'), call) for _ in range(3)])
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['reply'] * 3)
+
+    @override_settings(LLM_MAX_CONCURRENCY=1, LLM_QUEUE_TIMEOUT=0.05)
+    async def test_async_queue_timeout(self):
+        async with self.scheduler.aturn(self.key):
+            with self.assertRaises(LLMQueueTimeout):
+                async with self.scheduler.aturn(self.key):
+                    pass
+
+        self.assertEqual(self.scheduler.stats(), {})
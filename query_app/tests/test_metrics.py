@@ -0,0 +1,72 @@
+import re
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from ..metrics import STAGE_SECONDS, format_server_timing, timed
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+def sample(text, line_prefix):
+    """The value of the first sample line starting with ``line_prefix``."""
+    match = re.search(rf'^{re.escape(line_prefix)} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+class TimingTests(SimpleTestCase):
+    def test_server_timing_sums_each_stage_in_first_seen_order(self):
+        header = format_server_timing([('schema', 0.002), ('execute', 0.01), ('schema', 0.001)], 0.02)
+
+        self.assertEqual(header, 'schema;dur=3.0, execute;dur=10.0, total;dur=20.0')
+
+    def test_spans_land_in_the_stage_histogram(self):
+        count = 'nlq_stage_duration_seconds_count{stage="test_stage"}'
+        before = sample('\n'.join(STAGE_SECONDS.samples()), count)
+
+        with timed('test_stage'):
+            pass
+
+        text = '\n'.join(STAGE_SECONDS.samples())
+        self.assertEqual(sample(text, count), before + 1)
+        self.assertEqual(sample(text, 'nlq_stage_duration_seconds_bucket{stage="test_stage",le="+Inf"}'), before + 1)
+
+
+class MetricsViewTests(DatasetTestCase):
+    def get_metrics(self, token=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        return self.client.get(reverse('metrics'), headers=headers)
+
+    def test_anonymous_scrapes_are_refused(self):
+        self.assertEqual(self.get_metrics().status_code, 401)
+        # No token configured: no token is accepted
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer '})
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_bearer_token_is_required_when_set(self):
+        self.assertEqual(self.get_metrics('wrong').status_code, 401)
+
+        response = self.get_metrics('s3cret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(b'# TYPE nlq_stage_duration_seconds histogram', response.content)
+        self.assertIn(b'nlq_cache_lookups_total{cache="sql",result="hit"}', response.content)
+
+    def test_staff_can_always_read_them(self):
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+
+        self.assertEqual(self.get_metrics().status_code, 200)
+
+    def test_questions_report_their_stages_in_server_timing(self):
+        dataset = make_dataset(numbered_csv(4))
+
+        response = self.client.post(reverse('process_query'), {'query': 'count rows by city', 'dataset': dataset.id})
+
+        stages = [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+        for stage in ('schema', 'generate_sql', 'execute', 'render', 'save'):
+            self.assertIn(stage, stages)
+        self.assertEqual(stages[-1], 'total')
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_can_be_turned_off(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('home')))
@@ -0,0 +1,41 @@
+from django.test import SimpleTestCase
+from ..views import parse_plan_response, stream_plan_response
+
+
+class PlanParsingTests(SimpleTestCase):
+    def test_sql_plan(self):
+        classification, sql = parse_plan_response('```json\n{"type": "SQL", "sql": "select * from t"}\n```')
+
+        self.assertEqual(classification, 'SQL')
+        self.assertEqual(sql, 'SELECT *\nFROM t')
+
+    def test_chat_plan(self):
+        self.assertEqual(parse_plan_response('{"type": "CHAT", "message": "Hi there"}'), ('CHAT', '<p>Hi there</p>'))
+
+    def test_bare_statements_are_sql(self):
+        self.assertEqual(parse_plan_response('SELECT 1')[0], 'SQL')
+        classification, sql = parse_plan_response('WITH a AS (SELECT 1) SELECT * FROM a')
+        self.assertEqual(classification, 'SQL')
+        self.assertTrue(sql.startswith('WITH a AS'))
+
+    def test_anything_else_is_chat(self):
+        self.assertEqual(parse_plan_response('Sorry, which table?'), ('CHAT', '<p>Sorry, which table?</p>'))
+        self.assertEqual(parse_plan_response('{"type": "SQL"'), ('CHAT', '<p>{"type": "SQL"</p>'))
+
+    def test_streamed_message_is_passed_on_as_it_arrives(self):
+        reply = '{"type": "CHAT", "message": "Caf\\u00e9 \\"menu\\" ready"}'
+        pieces = [reply[i:i + 5] for i in range(0, len(reply), 5)]
+        received = []
+
+        raw_response = stream_plan_response(pieces, received.append)
+
+        self.assertEqual(raw_response, reply)
+        self.assertEqual(''.join(received), 'Café "menu" ready')
+        self.assertGreater(len(received), 1)
+
+    def test_streamed_sql_is_only_collected(self):
+        received = []
+
+        stream_plan_response(['{"type": "SQL", ', '"sql": "SELECT 1"}'], received.append)
+
+        self.assertEqual(received, [])
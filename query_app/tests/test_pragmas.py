@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+from django.db import connections
+from django.test import SimpleTestCase, override_settings
+
+
+class SqlitePragmaTests(SimpleTestCase):
+    def setUp(self):
+        scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch_dir, ignore_errors=True)
+        self.path = os.path.join(scratch_dir, 'pragmas.sqlite3')
+
+    def connect(self):
+        """A new connection to a scratch database file, set up like the app's own."""
+        settings_dict = dict(connections['default'].settings_dict, NAME=self.path)
+        connection = connections['default'].__class__(settings_dict, alias='pragmas')
+        connection.ensure_connection()
+        self.addCleanup(connection.close)
+        return connection
+
+    def pragma(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_new_connections_are_tuned(self):
+        connection = self.connect()
+
+        self.assertEqual(self.pragma(connection, 'journal_mode'), 'wal')
+        # synchronous=NORMAL, temp_store=MEMORY
+        self.assertEqual(self.pragma(connection, 'synchronous'), 1)
+        self.assertEqual(self.pragma(connection, 'temp_store'), 2)
+        self.assertEqual(self.pragma(connection, 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma(connection, 'cache_size'), -64 * 1024)
+
+    @override_settings(SQLITE_PRAGMAS={'journal_mode': 'wal', 'busy_timeout': 250})
+    def test_pragmas_come_from_settings(self):
+        connection = self.connect()
+
+        self.assertEqual(self.pragma(connection, 'busy_timeout'), 250)
+        self.assertEqual(self.pragma(connection, 'synchronous'), 2)
+
+    @override_settings(SQLITE_PRAGMAS={})
+    def test_tuning_can_be_turned_off(self):
+        connection = self.connect()
+
+        self.assertEqual(self.pragma(connection, 'journal_mode'), 'delete')
+
+    def test_in_memory_databases_keep_their_journal_quietly(self):
+        self.path = ':memory:'
+
+        with self.assertNoLogs('query_app.db', 'WARNING'):
+            connection = self.connect()
+
+        self.assertEqual(self.pragma(connection, 'journal_mode'), 'memory')
@@ -0,0 +1,103 @@
+import os
+import tempfile
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from ..profiling import QueryRecorder, list_profiles
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+class QueryRecorderTests(SimpleTestCase):
+    def test_repeated_statements_are_listed(self):
+        recorder = QueryRecorder()
+        execute = lambda sql, params, many, context: None  # noqa: E731
+        for alias, sql in [('default', 'SELECT a'), ('analytics', 'SELECT b'), ('default', 'SELECT a')]:
+            recorder(execute, sql, None, False, {'connection': type('C', (), {'alias': alias})})
+
+        summary = recorder.summary()
+
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['by_database'], {'default': 2, 'analytics': 1})
+        self.assertEqual(summary['repeated'], [{'sql': 'SELECT a', 'count': 2}])
+
+
+class ProfilingMiddlewareTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        profile_dir = override_settings(PROFILING_DIR=tempfile.mkdtemp(dir=self.scratch_dir))
+        profile_dir.enable()
+        self.addCleanup(profile_dir.disable)
+        self.dataset = make_dataset(numbered_csv(4))
+        self.staff = User.objects.create_user('admin', is_staff=True)
+
+    def chat(self, headers=None, **params):
+        return self.client.get(reverse('query_interface'), {'dataset': self.dataset.id, **params}, headers=headers)
+
+    def test_staff_requests_are_profiled_on_demand(self):
+        self.client.force_login(self.staff)
+
+        with self.assertLogs('query_app.profiling', 'INFO'):
+            response = self.chat(profile=1)
+
+        profile_id = response['X-Profile-Id']
+        [summary] = list_profiles()
+        self.assertEqual(summary['id'], profile_id)
+        self.assertEqual((summary['view'], summary['status'], summary['trigger']), ('query_interface', 200, 'requested'))
+        self.assertEqual(summary['data_file'], f'{profile_id}.folded')
+        self.assertGreater(summary['sql']['by_database']['default'], 0)
+        self.assertNotIn('X-Profile-Id', self.chat())
+
+    def test_other_users_cannot_ask_for_a_profile(self):
+        self.client.force_login(User.objects.create_user('someone'))
+
+        response = self.chat(profile=1)
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list_profiles(), [])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_requests_are_profiled_quietly(self):
+        with self.assertLogs('query_app.profiling', 'INFO'):
+            response = self.chat()
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list_profiles()[0]['trigger'], 'sampled')
+
+    @override_settings(PROFILING_MODE='cprofile')
+    def test_cprofile_mode_writes_a_prof_file(self):
+        self.client.force_login(self.staff)
+
+        with self.assertLogs('query_app.profiling', 'INFO'):
+            response = self.chat(headers={'X-Profile': '1'})
+
+        summary = list_profiles()[0]
+        self.assertEqual(summary['data_file'], f"{response['X-Profile-Id']}.prof")
+        self.assertGreater(summary['profile']['calls'], 0)
+
+    @override_settings(PROFILING_MAX_FILES=2)
+    def test_only_the_latest_profiles_are_kept(self):
+        self.client.force_login(self.staff)
+
+        with self.assertLogs('query_app.profiling', 'INFO'):
+            ids = [self.chat(profile=1)['X-Profile-Id'] for _ in range(3)]
+
+        self.assertEqual([summary['id'] for summary in list_profiles()], ids[:0:-1])
+        # A summary and a data file each
+        self.assertEqual(len(os.listdir(settings.PROFILING_DIR)), 4)
+
+    # The admin page's static files have no collectstatic manifest here
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_profiles_are_listed_and_downloaded_by_staff_only(self):
+        self.client.force_login(self.staff)
+        with self.assertLogs('query_app.profiling', 'INFO'):
+            profile_id = self.chat(profile=1)['X-Profile-Id']
+
+        self.assertContains(self.client.get(reverse('request_profiles')), profile_id)
+        response = self.client.get(reverse('download_profile', args=[profile_id]))
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{profile_id}.folded"')
+        self.assertEqual(self.client.get(reverse('download_profile', args=['..settings'])).status_code, 404)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('download_profile', args=[profile_id])).status_code, 302)
+        self.assertEqual(self.client.get(reverse('request_profiles')).status_code, 302)
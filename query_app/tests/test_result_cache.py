@@ -0,0 +1,65 @@
+from django.test import override_settings
+from ..db import analytics_connection
+from ..result_cache import bump_table_versions, cached_select, normalize_sql, result_key
+from ..views import execute_sql_statements
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+class ResultCacheTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(numbered_csv(4))
+        self.runs = 0
+
+    def select(self, sql, max_rows=10):
+        connection = analytics_connection()
+
+        def run():
+            self.runs += 1
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+                return cursor.fetchall(), [col[0] for col in cursor.description]
+
+        return cached_select([sql], max_rows, run, connection)
+
+    def test_results_are_reused_until_a_table_they_read_changes(self):
+        sql = 'SELECT SUM(amount) FROM sales'
+        self.assertEqual(self.select(sql), ([(100,)], ['SUM(amount)']))
+        self.assertEqual(self.select(sql)[0], [(100,)])
+        self.assertEqual(self.runs, 1)
+
+        execute_sql_statements(['UPDATE sales SET amount = 0 WHERE id = 1'])
+
+        self.assertEqual(self.select(sql)[0], [(90,)])
+        self.assertEqual(self.runs, 2)
+
+    def test_uploads_to_a_table_drop_its_results(self):
+        self.select('SELECT COUNT(*) FROM sales')
+
+        bump_table_versions(['sales'])
+        self.select('SELECT COUNT(*) FROM sales')
+
+        self.assertEqual(self.runs, 2)
+
+    def test_spelling_does_not_matter_but_the_row_limit_does(self):
+        self.select('SELECT SUM(amount) FROM sales')
+        self.select('select  SUM(amount)\nfrom sales -- total')
+        self.assertEqual(self.runs, 1)
+
+        self.select('SELECT SUM(amount) FROM sales', max_rows=5)
+        self.assertEqual(self.runs, 2)
+
+    @override_settings(RESULT_CACHING=False)
+    def test_caching_can_be_turned_off(self):
+        self.select('SELECT COUNT(*) FROM sales')
+        self.select('SELECT COUNT(*) FROM sales')
+
+        self.assertEqual(self.runs, 2)
+
+    def test_writes_and_volatile_queries_are_not_cached(self):
+        self.assertIsNone(result_key(['DELETE FROM sales'], 10))
+        self.assertIsNone(result_key(['SELECT random()'], 10))
+        self.assertIsNone(result_key(['WITH a AS (SELECT 1) INSERT INTO sales (id) SELECT * FROM a'], 10))
+        self.assertIsNone(normalize_sql("SELECT * FROM sales WHERE day < date('now')"))
+        self.assertIsNone(normalize_sql('SELECT name FROM sqlite_master'))
+        self.assertIsNotNone(result_key(['WITH a AS (SELECT 1) SELECT * FROM a'], 10))
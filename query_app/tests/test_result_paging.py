@@ -0,0 +1,69 @@
+from unittest import mock
+from django.test import override_settings
+from django.urls import reverse
+from ..llm import OfflineProvider
+from ..models import Conversation
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+@override_settings(RESULT_PAGE_SIZE=50, RESULT_MAX_ROWS=10000, QUERY_MAX_ROWS=1000000)
+class ResultPagingTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(numbered_csv(120))
+        self.conversation = Conversation.objects.create(
+            dataset=self.dataset,
+            user_query='show everything',
+            sql_query='SELECT * FROM sales ORDER BY id',
+            response='',
+            result_sql='SELECT * FROM sales ORDER BY id',
+            result_columns=['id', 'city', 'amount'],
+            result_has_more=True,
+        )
+
+    def page(self, number):
+        url = reverse('query_results_page', args=[self.conversation.id])
+        return self.client.get(url, {'page': number})
+
+    def test_pages(self):
+        first, last = self.page(1).json(), self.page(3).json()
+
+        self.assertEqual(first['columns'], ['id', 'city', 'amount'])
+        self.assertEqual([row[0] for row in first['rows']], list(range(1, 51)))
+        self.assertTrue(first['has_more'])
+        self.assertEqual([row[0] for row in last['rows']], list(range(101, 121)))
+        self.assertFalse(last['has_more'])
+        self.assertFalse(last['truncated'])
+
+    @override_settings(RESULT_MAX_ROWS=60)
+    def test_pages_stop_at_the_row_cap(self):
+        second = self.page(2).json()
+
+        self.assertEqual(len(second['rows']), 10)
+        self.assertFalse(second['has_more'])
+        self.assertTrue(second['truncated'])
+        self.assertEqual(self.page(3).json()['rows'], [])
+
+    def test_first_page_is_rendered_into_the_answer(self):
+        with mock.patch.object(OfflineProvider, 'answer', return_value='SELECT * FROM sales ORDER BY id'):
+            self.client.post(reverse('process_query'), {'query': 'show all rows', 'dataset': self.dataset.id})
+
+        conversation = Conversation.objects.latest('id')
+        self.assertIn('first 50 rows', conversation.response)
+        self.assertEqual(conversation.response.count('<tr>'), 50)
+        self.assertTrue(conversation.result_has_more)
+        self.assertEqual(conversation.result_columns, ['id', 'city', 'amount'])
+
+    def test_bad_pages_and_missing_results(self):
+        self.assertEqual(self.page('x').status_code, 400)
+
+        self.conversation.result_sql = None
+        self.conversation.save()
+        self.assertEqual(self.page(1).status_code, 404)
+
+    def test_changed_table_is_reported(self):
+        self.conversation.result_sql = 'SELECT missing FROM sales'
+        self.conversation.save()
+
+        with self.assertLogs('query_app.views', 'ERROR'):
+            self.assertEqual(self.page(1).status_code, 409)
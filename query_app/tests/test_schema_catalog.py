@@ -0,0 +1,61 @@
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from ..schema_catalog import clear_local_catalogs, get_schema_catalog
+from ..views import execute_sql_statements, get_dataset_profile, process_file_upload, record_data_change
+from .base import DatasetTestCase, csv_file, make_dataset
+
+
+def indexed_values(catalog, column):
+    """Tokens of the frequent values the catalog's index holds for ``column`` of its first table."""
+    columns = catalog['index']['tables'][0]['columns']
+    return next(value_tokens for name, _, value_tokens in columns if name == column)
+
+
+class SchemaCatalogTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset('id,city\n1,paris\n2,lyon\n3,paris\n')
+
+    def test_warm_lookups_make_no_queries(self):
+        catalog = get_schema_catalog(self.dataset)
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_schema_catalog(self.dataset), catalog)
+        # Another worker process finds it in the shared cache
+        clear_local_catalogs()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_schema_catalog(self.dataset), catalog)
+        self.assertEqual(catalog['context']['tables'], [{'name': 'sales', 'columns': ['id', 'city']}])
+        self.assertEqual(indexed_values(catalog, 'city'), {'pari', 'lyon'})
+
+    def test_upload_to_the_same_database_changes_the_catalog(self):
+        get_schema_catalog(self.dataset)
+        request = RequestFactory().post('/')
+        request.user = AnonymousUser()
+
+        process_file_upload(csv_file('id,total\n1,5\n', name='sales_2.csv'), request)
+
+        self.dataset.refresh_from_db()
+        tables = get_schema_catalog(self.dataset)['context']['tables']
+        self.assertEqual([table['name'] for table in tables], ['sales', 'sales_2'])
+
+    def test_dropped_and_rebuilt_profiles_change_the_catalog(self):
+        get_schema_catalog(self.dataset)
+        statements = ["UPDATE sales SET city = 'nice'"]
+        execute_sql_statements(statements)
+
+        record_data_change(self.dataset, statements)
+
+        self.assertEqual(indexed_values(get_schema_catalog(self.dataset), 'city'), set())
+        self.dataset.refresh_from_db()
+        get_dataset_profile(self.dataset)
+        self.assertEqual(indexed_values(get_schema_catalog(self.dataset), 'city'), {'nice'})
+
+    def test_stale_dataset_rows_still_get_the_new_catalog(self):
+        stale = type(self.dataset).objects.get()
+        get_schema_catalog(stale)
+
+        record_data_change(self.dataset, ["DELETE FROM sales"])
+
+        stale.refresh_from_db()
+        self.assertEqual(indexed_values(get_schema_catalog(stale), 'city'), set())
@@ -0,0 +1,55 @@
+from django.test import SimpleTestCase, override_settings
+from ..models import Dataset
+from ..schema_catalog import get_schema_catalog, get_prompt_schema
+from ..schema_pruning import tokenize
+from .base import DatasetTestCase, make_dataset
+
+
+class TokenizeTests(SimpleTestCase):
+    def test_names_are_split_and_stemmed(self):
+        self.assertEqual(tokenize('shipCity'), ['ship', 'city'])
+        self.assertEqual(tokenize('order_totals'), ['order', 'total'])
+        self.assertEqual(tokenize('Show the categories of 2024'), ['category', '2024'])
+
+
+@override_settings(SCHEMA_PRUNING=True, SCHEMA_PRUNE_MIN_COLUMNS=6, SCHEMA_PRUNE_MAX_TABLES=5, SCHEMA_PRUNE_MAX_COLUMNS=3)
+class SchemaPruningTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        make_dataset('order_id,customer_id,order_total,ship_city,ship_date\n1,1,9.5,Paris,2024-01-02\n', 'orders.csv')
+        make_dataset('customer_id,customer_name,email\n1,Ann,ann@example.com\n', 'customers.csv')
+        make_dataset('sku,warehouse,stock_level\nA1,north,4\n', 'inventory.csv')
+        Dataset.objects.update(database_group='shop')
+        self.orders = Dataset.objects.get(table_name='orders')
+
+    def test_only_relevant_tables_and_columns_are_kept(self):
+        prompt = get_prompt_schema(self.orders, 'total of orders by customer name')
+
+        self.assertIn("Table 'orders': order_id, customer_id, order_total", prompt)
+        self.assertIn("(2 less relevant columns not shown)", prompt)
+        self.assertIn("Table 'customers': customer_id, customer_name", prompt)
+        self.assertNotIn('inventory', prompt)
+        self.assertIn('(1 less relevant tables not shown)', prompt)
+
+    def test_frequent_values_find_their_column(self):
+        prompt = get_prompt_schema(self.orders, 'how many were sent to Paris')
+
+        self.assertIn('ship_city', prompt)
+        self.assertNotIn('stock_level', prompt)
+
+    def test_the_full_schema_is_used_when_pruning_would_not_help(self):
+        full = get_schema_catalog(self.orders)['prompt']
+
+        self.assertEqual(get_prompt_schema(self.orders, 'what about zebras'), full)
+        self.assertEqual(get_prompt_schema(self.orders), full)
+        with override_settings(SCHEMA_PRUNE_MIN_COLUMNS=100):
+            self.assertEqual(get_prompt_schema(self.orders, 'total of orders'), full)
+        with override_settings(SCHEMA_PRUNING=False):
+            self.assertEqual(get_prompt_schema(self.orders, 'total of orders'), full)
+
+    def test_the_question_table_is_always_kept_with_its_keys(self):
+        prompt = get_prompt_schema(self.orders, 'stock level per warehouse')
+
+        self.assertIn("Table 'orders': order_id, customer_id\n", prompt)
+        self.assertIn("Table 'inventory': warehouse, stock_level\n", prompt)
+        self.assertNotIn('customers', prompt)
@@ -0,0 +1,133 @@
+import gc
+import io
+import os
+import tempfile
+from django.conf import settings
+from django.core.management import call_command
+from django.db import transaction
+from django.test import override_settings
+from ..db import analytics_connection
+from ..export import iter_row_batches
+from ..ingest import ingest_file
+from ..snapshots import has_snapshot, invalidate_snapshots, snapshot_batches
+from ..views import execute_sql_statements, record_data_change
+from .base import DatasetTestCase, csv_file, make_dataset, numbered_csv, read_table
+
+
+def exported(sql):
+    return [row for _, rows in iter_row_batches(sql) for row in rows]
+
+
+def snapshot_rows(table_name):
+    batches = snapshot_batches(table_name, 100)
+    next(batches)
+    return [row for rows in batches for row in rows]
+
+
+@override_settings(DATASET_SNAPSHOTS=True)
+class SnapshotTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        # Snapshot files outlive the test transaction; give every test its own
+        snapshot_dir = override_settings(COLUMNAR_SNAPSHOT_DIR=tempfile.mkdtemp(dir=self.scratch_dir))
+        snapshot_dir.enable()
+        self.addCleanup(snapshot_dir.disable)
+
+    def ingest(self, text, mode='replace'):
+        with self.captureOnCommitCallbacks(using='analytics', execute=True):
+            return ingest_file(csv_file(text), 'sales', mode=mode)
+
+    def test_snapshot_is_published_when_the_rows_are_committed(self):
+        with self.captureOnCommitCallbacks(using='analytics') as callbacks:
+            ingest_file(csv_file(numbered_csv(3)), 'sales')
+            self.assertFalse(has_snapshot('sales'))
+
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(snapshot_rows('sales'), read_table('sales'))
+
+    def test_nothing_is_published_when_an_outer_transaction_rolls_back(self):
+        with self.captureOnCommitCallbacks(using='analytics', execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic(using=settings.ANALYTICS_DATABASE):
+                ingest_file(csv_file(numbered_csv(3)), 'sales')
+                raise RuntimeError
+
+        self.assertEqual(callbacks, [])
+        self.assertFalse(has_snapshot('sales'))
+        # The part written for the rolled-back rows goes with its writer
+        gc.collect()
+        self.assertEqual([name for name in os.listdir(settings.COLUMNAR_SNAPSHOT_DIR) if name.endswith('.tmp')], [])
+
+    def test_appended_files_add_a_part(self):
+        self.ingest(numbered_csv(3))
+        self.ingest('id,city,amount\n4,c,40\n', mode='append')
+
+        self.assertEqual(len(os.listdir(os.path.join(settings.COLUMNAR_SNAPSHOT_DIR, 'sales'))), 2)
+        self.assertEqual(snapshot_rows('sales'), read_table('sales'))
+
+    def test_readers_fall_back_to_the_table_after_a_write(self):
+        with self.captureOnCommitCallbacks(using='analytics', execute=True):
+            dataset = make_dataset(numbered_csv(3))
+        statements = ['UPDATE sales SET amount = 0']
+
+        execute_sql_statements(statements)
+        record_data_change(dataset, statements)
+
+        self.assertFalse(has_snapshot('sales'))
+        self.assertEqual(exported('SELECT amount FROM sales'), [(0,), (0,), (0,)])
+
+    def test_widening_a_column_drops_the_snapshot(self):
+        with self.captureOnCommitCallbacks(using='analytics', execute=True):
+            ingest_file(csv_file('id,day\n1,2024-01-02\n'), 'sales')
+        self.assertTrue(has_snapshot('sales'))
+
+        with self.assertLogs('query_app.snapshots', 'WARNING'):
+            self.ingest('id,day\n2,someday\n', mode='append')
+
+        self.assertFalse(has_snapshot('sales'))
+        self.assertEqual(exported('SELECT day FROM sales'), [('2024-01-02',), ('someday',)])
+
+
+@override_settings(DATASET_SNAPSHOTS=True)
+class ReingestDatasetsTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        snapshot_dir = override_settings(COLUMNAR_SNAPSHOT_DIR=tempfile.mkdtemp(dir=self.scratch_dir))
+        snapshot_dir.enable()
+        self.addCleanup(snapshot_dir.disable)
+        with self.captureOnCommitCallbacks(using='analytics', execute=True):
+            self.dataset = make_dataset(numbered_csv(6))
+        self.rows = read_table('sales')
+
+    def reingest(self, *args):
+        out = io.StringIO()
+        call_command('reingest_datasets', '--batch-rows', '4', *args, stdout=out)
+        return out.getvalue()
+
+    def execute(self, sql):
+        with analytics_connection().cursor() as cursor:
+            cursor.execute(sql)
+
+    def test_missing_tables_are_rebuilt_from_their_snapshot(self):
+        schema_version = self.dataset.schema_version
+        self.execute('DROP TABLE sales')
+
+        output = self.reingest()
+
+        self.assertIn('sales: 6 rows re-ingested', output)
+        self.assertEqual(read_table('sales'), self.rows)
+        self.dataset.refresh_from_db()
+        self.assertNotEqual(self.dataset.schema_version, schema_version)
+
+    def test_existing_tables_are_only_rebuilt_with_replace(self):
+        self.execute('UPDATE sales SET amount = 0')
+
+        self.assertIn('0 tables re-ingested', self.reingest())
+        self.assertIn('sales: 6 rows re-ingested', self.reingest('--replace'))
+        self.assertEqual(read_table('sales'), self.rows)
+
+    def test_tables_without_a_snapshot_are_skipped(self):
+        invalidate_snapshots(['sales'])
+        self.execute('DROP TABLE sales')
+
+        self.assertIn('sales: no snapshot, skipped', self.reingest())
@@ -0,0 +1,39 @@
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, override_settings
+from ..models import CachedQuery
+from ..sql_cache import cache_sql, get_cached_sql, invalidate_datasets
+from ..views import answer_query, process_file_upload
+from .base import DatasetTestCase, csv_file, make_dataset, numbered_csv
+
+
+class SqlCacheTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(numbered_csv(4))
+
+    def test_rephrased_question_hits_and_other_schema_misses(self):
+        cache_sql('Count rows by city', self.dataset, 'context', 'SELECT 1')
+
+        self.assertEqual(get_cached_sql('please count rows by city?', self.dataset, 'context'), 'SELECT 1')
+        self.assertIsNone(get_cached_sql('count rows by city', self.dataset, 'other context'))
+
+    def test_invalidated_and_expired_entries_miss(self):
+        cache_sql('count rows', self.dataset, 'context', 'SELECT 1')
+        invalidate_datasets([self.dataset])
+        self.assertIsNone(get_cached_sql('count rows', self.dataset, 'context'))
+
+        cache_sql('count rows', self.dataset, 'context', 'SELECT 1')
+        with override_settings(SQL_CACHE_TTL=-1):
+            self.assertIsNone(get_cached_sql('count rows', self.dataset, 'context'))
+        self.assertFalse(CachedQuery.objects.exists())
+
+    def test_repeated_question_skips_the_model_until_a_file_is_appended(self):
+        answer_query('count rows by city', self.dataset)
+        answer_query('Count rows by city.', self.dataset)
+        self.assertEqual(CachedQuery.objects.get().hit_count, 1)
+
+        request = RequestFactory().post('/upload/')
+        request.user = AnonymousUser()
+        process_file_upload(csv_file('id,city,amount\n5,c,50\n'), request, 'sales')
+
+        self.assertFalse(CachedQuery.objects.exists())
@@ -0,0 +1,109 @@
+import json
+import types
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.test import AsyncRequestFactory, override_settings
+from django.urls import reverse
+from ..models import Conversation
+from ..views import aprocess_query_stream
+from .base import DatasetTestCase, make_dataset, numbered_csv
+
+
+class HeldThread:
+    """Stands in for the answer thread: its target is run by the test, on the thread holding the test transaction."""
+    started = []
+
+    def __init__(self, target, **kwargs):
+        self.target = target
+
+    def start(self):
+        self.started.append(self.target)
+
+
+def parse_events(content):
+    """[(event, data)] of a server-sent event stream; keep-alive comments as ('keep-alive', None)."""
+    events = []
+    for block in content.strip().split('\n\n'):
+        if block.startswith(':'):
+            events.append(('keep-alive', None))
+            continue
+        event, data = block.split('\n')
+        events.append((event.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+    return events
+
+
+class AnswerStreamTests(DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = make_dataset(numbered_csv(4))
+        HeldThread.started = []
+        patcher = mock.patch('query_app.views.threading', types.SimpleNamespace(Thread=HeldThread))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stream(self, query):
+        response = self.client.post(reverse('process_query_stream'), {'query': query, 'dataset': self.dataset.id})
+        for run in HeldThread.started:
+            run()
+        return response, parse_events(b''.join(response.streaming_content).decode())
+
+    def test_sql_answers_report_progress_sql_and_the_stored_turn(self):
+        response, events = self.stream('count rows by city')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        names = [event for event, _ in events]
+        self.assertIn('progress', names)
+        self.assertLess(names.index('sql'), names.index('done'))
+        self.assertEqual(names[-1], 'done')
+        conversation = Conversation.objects.get()
+        self.assertIn('GROUP BY', dict(events)['sql']['sql'])
+        self.assertEqual(events[-1][1]['conversation_id'], conversation.id)
+        self.assertIn('count rows by city', events[-1][1]['html'])
+
+    def test_chat_replies_arrive_token_by_token(self):
+        _, events = self.stream('hello, what can you do?')
+
+        tokens = [data['text'] for event, data in events if event == 'token']
+        self.assertGreater(len(tokens), 1)
+        # The stored turn is the same reply, as HTML
+        self.assertEqual(f"<p>{''.join(tokens)}</p>", Conversation.objects.get().response)
+        self.assertNotIn('sql', [event for event, _ in events])
+
+    def test_questions_that_need_no_model_get_a_redirect(self):
+        _, events = self.stream('current table')
+
+        self.assertEqual(events, [('done', {'redirect': f'/query/?dataset={self.dataset.id}'})])
+        self.assertEqual(HeldThread.started, [])
+
+    def test_failures_end_the_stream_with_an_error(self):
+        with mock.patch('query_app.views.answer_query', side_effect=RuntimeError('boom')), \
+                self.assertLogs('query_app.views', 'ERROR'):
+            _, events = self.stream('count rows by city')
+
+        self.assertEqual(events, [('error', {'error': 'boom'})])
+
+    @override_settings(QUERY_STREAM_KEEPALIVE=0.01)
+    def test_quiet_streams_are_kept_alive(self):
+        response = self.client.post(
+            reverse('process_query_stream'), {'query': 'count rows by city', 'dataset': self.dataset.id}
+        )
+
+        self.assertEqual(next(iter(response.streaming_content)), b': keep-alive\n\n')
+
+    async def test_async_stream(self):
+        request = AsyncRequestFactory().post(
+            '/process_query/stream/', {'query': 'count rows by city', 'dataset': self.dataset.id}
+        )
+        request.user = AnonymousUser()
+
+        response = await aprocess_query_stream(request)
+        for run in HeldThread.started:
+            await sync_to_async(run)()
+        content = b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertTrue(response.is_async)
+        events = parse_events(content.decode())
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(events[-1][1]['conversation_id'], (await Conversation.objects.aget()).id)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -7,9 +8,31 @@ urlpatterns = [
     path('features/', views.features, name='features'),
     path('contact/', views.contact, name='contact'),
     path('upload/', views.upload_dataset, name='upload_dataset'),
-    path('process_query/', views.process_query, name='process_query'),
+    path(
+        'process_query/',
+        views.aprocess_query if settings.ASYNC_QUERY_VIEWS else views.process_query,
+        name='process_query',
+    ),
+    path('process_query/async/', views.process_query_async, name='process_query_async'),
+    path(
+        'process_query/stream/',
+        views.aprocess_query_stream if settings.ASYNC_QUERY_VIEWS else views.process_query_stream,
+        name='process_query_stream',
+    ),
+    path('conversations/', views.conversation_history, name='conversation_history'),
+    path('conversations/<int:conversation_id>/', views.conversation_response, name='conversation_response'),
+    path('conversations/<int:conversation_id>/results/', views.query_results_page, name='query_results_page'),
+    path('conversations/<int:conversation_id>/export/', views.export_results, name='export_results'),
+    path('jobs/<uuid:job_id>/', views.query_job_status, name='query_job_status'),
+    path(
+        'jobs/<uuid:job_id>/events/',
+        views.aquery_job_events if settings.ASYNC_QUERY_VIEWS else views.query_job_events,
+        name='query_job_events',
+    ),
+    path('jobs/<uuid:job_id>/cancel/', views.cancel_query_job, name='cancel_query_job'),
     path('query/', views.query_interface, name='query_interface'),
     path('clear_conversation/', views.clear_conversation, name='clear_conversation'),
     path('delete_dataset/', views.delete_dataset, name='delete_dataset'),
     path('results/', views.query_results, name='query_results'),
+    path('metrics', views.metrics, name='metrics'),
 ]
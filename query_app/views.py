@@ -1,27 +1,51 @@
-import os
 import re
+import os
+import hmac
+import json
+import asyncio
+import queue
+import threading
 import pandas as pd
 import sqlparse
 import logging
-import google.generativeai as genai
-from django.db import connection, transaction
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models.functions import Length, Substr
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.http import FileResponse, HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
 from dotenv import load_dotenv
-from .models import Dataset, Conversation
+from .models import Dataset, Conversation, QueryJob
+from .schema_catalog import get_prompt_schema, get_schema_catalog, group_datasets, invalidate_schema_catalog
 from .forms import NaturalLanguageQueryForm, DatasetUploadWithTargetForm
+from .db import analytics_connection
+from .columnar import engine_enabled, run_select
+from .snapshots import has_snapshot, invalidate_snapshots, rename_snapshot
+from .column_stats import merge_profiles, profile_table, summarize_profile
+from .export import EXPORT_FORMATS, aiter_chunks, iter_export
+from .guardrails import (
+    QueryCancelled, QueryGuard, QueryRejected, QueryTimeout, add_limit, check_cost, get_query_limits,
+    is_read_statement, is_select,
+)
+from .ingest import ingest_file
+from .jobs import cancel_query_job as cancel_job, expire_stale_job, job_payload, submit_query_job
+from .llm import get_llm
+from .llm_scheduler import llm_user
+from .metrics import QUESTION_SECONDS, RENDERED_BYTES, ROWS_RETURNED, render_metrics, timed
+from .profiling import list_profiles, profile_data_path
+from .result_cache import bump_table_versions, bump_written_tables, cached_select, tracking_tables
+from .sql_cache import cache_sql, evict_question, get_cached_sql, invalidate_datasets
 
 
 load_dotenv()
 
-def configure_genai(api_key=None):
-    """Configure Gemini API with provided key or from environment."""
-    key = api_key if api_key else os.getenv('GEMINI_API_KEY')
-    if not key:
-        raise ValueError("No API key provided. Please provide your Gemini API key through the popup modal.")
-    genai.configure(api_key=key)
-
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -33,20 +57,13 @@ def get_user_filter(request):
 
 def group_datasets_by_name(datasets):
     """
-    Group datasets by their base name (without file extension).
+    Group datasets by the database they belong to.
     Returns a dictionary where keys are database names and values are lists of datasets.
     Example: {'Student': [dataset1, dataset2], 'College': [dataset3]}
     """
     grouped = {}
     for dataset in datasets:
-        # Extract base name (remove file extension and numbers)
-        base_name = dataset.name.split('.')[0]  # Remove .csv, .xls, .xlsx
-        # Remove trailing numbers and underscores from duplicates
-        base_name = base_name.rstrip('_0123456789')
-        
-        if base_name not in grouped:
-            grouped[base_name] = []
-        grouped[base_name].append(dataset)
+        grouped.setdefault(dataset.database_group, []).append(dataset)
     
     return grouped
 
@@ -66,7 +83,9 @@ def clean_sql_response(raw_sql):
         raw_sql = raw_sql.replace("```sql", "").replace("```", "").strip()
     
     sql_keywords = ["SELECT", "INSERT", "UPDATE", "DELETE", "ALTER", "DROP", "CREATE"]
-    pattern = r'\b(' + '|'.join(sql_keywords) + r')\b'
+    # A WITH only counts when a CTE follows, so prose like "with" isn't taken for SQL
+    cte = r'WITH\s+(?:RECURSIVE\s+)?"?\w+"?\s*(?:\([^)]*\)\s*)?AS\s*\('
+    pattern = r'\b(' + cte + r'|(?:' + '|'.join(sql_keywords) + r')\b)'
     match = re.search(pattern, raw_sql, re.IGNORECASE)
     if match:
         raw_sql = raw_sql[match.start():]
@@ -74,8 +93,38 @@ def clean_sql_response(raw_sql):
     return sqlparse.format(raw_sql, reindent=True, keyword_case='upper')
 
 
-def execute_sql_statements(sql_statements):
-    """Execute multiple SQL statements and return results."""
+def execute_sql_statements(sql_statements, max_rows=None, tables=None, limits=None, job_id=None):
+    """
+    Execute multiple SQL statements and return results.
+    
+    With ``max_rows``, a read returns at most that many rows; the rest are
+    never fetched from the database. With ``tables`` (see get_engine_tables),
+    statements that are all SELECTs are tried on the columnar engine first.
+    
+    The guardrails ``limits`` (see get_query_limits; the defaults when None)
+    apply: statements estimated to examine too many rows raise QueryRejected
+    before any runs, SELECTs without a LIMIT get one, and the statements are
+    interrupted with QueryTimeout after the time limit, or with
+    QueryCancelled when job ``job_id`` is cancelled.
+    
+    Tables the statements write get a new version, so cached results that
+    read them are no longer served (see result_cache).
+    """
+    limits = limits or get_query_limits()
+    connection = analytics_connection()
+    statements = [stmt.strip() for stmt in sql_statements if stmt.strip()]
+    check_cost(connection, statements, limits['max_cost'])
+    row_limit = min(filter(None, [max_rows, limits['max_rows']]), default=None)
+    statements = [add_limit(stmt, row_limit) for stmt in statements]
+    guard = QueryGuard(limits['timeout'], job_id)
+    
+    if tables and statements and all(is_select(stmt) for stmt in statements):
+        # Only the last SELECT's rows are returned, so it's the only one to run
+        result = run_select(statements[-1], tables, max_rows, guard=guard)
+        if result is not None:
+            results, columns = result
+            return True, results, columns, 0
+    
     cursor = connection.cursor()
     results = []
     columns = []
@@ -83,17 +132,13 @@ def execute_sql_statements(sql_statements):
     is_read_op = False
     
     try:
-        with transaction.atomic():
-            for stmt in sql_statements:
-                stmt = stmt.strip()
-                if not stmt:
-                    continue
-                
-                stmt_upper = stmt.upper()
-                if stmt_upper.startswith(("SELECT", "PRAGMA")):
+        with tracking_tables(connection) as access, guard.running(connection), \
+                transaction.atomic(using=settings.ANALYTICS_DATABASE):
+            for stmt in statements:
+                if is_read_statement(stmt):
                     is_read_op = True
                     cursor.execute(stmt)
-                    results = cursor.fetchall()
+                    results = cursor.fetchmany(max_rows) if max_rows else cursor.fetchall()
                     columns = [col[0] for col in cursor.description] if cursor.description else []
                 else:
                     cursor.execute(stmt)
@@ -102,6 +147,7 @@ def execute_sql_statements(sql_statements):
         logger.error(f"SQL Execution Error: {str(e)}")
         raise e
     
+    bump_written_tables(access, statements)
     return is_read_op, results, columns, total_affected
 
 
@@ -143,16 +189,8 @@ def process_file_upload(file, request, target_table=None):
         request: Django request object
         target_table: Optional existing table name to append to. If provided, data is added to existing table.
     """
-    try:
-        if file.name.endswith('.csv'):
-            df = pd.read_csv(file)
-        elif file.name.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(file)
-        else:
-            return None, "Unsupported file format. Please upload CSV or Excel files."
-    except Exception as e:
-        logger.error(f"File reading error: {str(e)}")
-        return None, f"Error reading file: {str(e)}"
+    if not file.name.lower().endswith(('.csv', '.xls', '.xlsx')):
+        return None, "Unsupported file format. Please upload CSV or Excel files."
     
     # If target_table provided, append to existing table; otherwise create new
     if target_table:
@@ -162,16 +200,24 @@ def process_file_upload(file, request, target_table=None):
         table_name = sanitize_table_name(file.name)
         mode = 'replace'
     
-    columns = [{"name": col, "type": "TEXT"} for col in df.columns]
+    # Cached SQL for this database was generated against its previous contents
+    if target_table:
+        user_filter = get_user_filter(request)
+        target_dataset = Dataset.objects.filter(table_name=target_table, **user_filter).first()
+        if target_dataset:
+            invalidate_datasets(get_related_datasets(target_dataset))
     
+    # Stream the file into the table chunk by chunk instead of loading it whole
     try:
-        with connection.cursor() as cursor:
-            raw_conn = connection.connection
-            df.to_sql(table_name, raw_conn, if_exists=mode, index=False)
-            logger.info(f"Data {'appended to' if mode == 'append' else 'saved to'} table {table_name}")
-    except Exception as e:
+        columns, row_count, profile = ingest_file(file, table_name, mode=mode)
+        bump_table_versions([table_name])
+        logger.info(f"Data {'appended to' if mode == 'append' else 'saved to'} table {table_name} ({row_count} rows)")
+    except DatabaseError as e:
         logger.error(f"Database save error: {str(e)}")
         return None, f"Error saving to database: {str(e)}"
+    except Exception as e:
+        logger.error(f"File reading error: {str(e)}")
+        return None, f"Error reading file: {str(e)}"
     
     try:
         if target_table:
@@ -179,38 +225,42 @@ def process_file_upload(file, request, target_table=None):
             user_filter = get_user_filter(request)
             dataset = Dataset.objects.filter(table_name=target_table, **user_filter).first()
             if dataset:
-                # Update columns to reflect new data if needed
+                # Null counts accumulate across every file appended to the table
+                previous_nulls = {c['name']: c.get('nulls', 0) for c in dataset.columns}
+                for col in columns:
+                    col['nulls'] += previous_nulls.get(col['name'], 0)
                 dataset.columns = columns
+                # Without a stored profile the old rows are unknown; visualize_data rebuilds it
+                dataset.profile = merge_profiles(dataset.profile, profile) if dataset.profile else None
                 dataset.save()
+                invalidate_schema_catalog(dataset)
                 logger.info(f"Updated existing dataset {dataset.id} with new data")
                 return dataset, None
             else:
                 return None, f"Could not find target database"
         else:
-            # Create new dataset
+            # Create new dataset; the snapshot can stand in for the uploaded file
+            keep_file = settings.KEEP_UPLOADED_FILES or not has_snapshot(table_name)
             dataset = Dataset.objects.create(
                 user=request.user if request.user.is_authenticated else None,
                 name=file.name,
                 table_name=table_name,
                 columns=columns,
-                file=file
+                profile=profile,
+                file=file if keep_file else f'datasets/{file.name}'
             )
+            # A new table changes the schema of every table in the same database
+            invalidate_datasets(get_related_datasets(dataset))
+            invalidate_schema_catalog(dataset)
             return dataset, None
     except Exception as e:
         logger.error(f"Dataset creation error: {str(e)}")
         return None, f"Error creating dataset: {str(e)}"
 
 
-def generate_sql_from_query(query, dataset, api_key=None):
-    """Generate SQL query from natural language using Gemini AI."""
-    try:
-        configure_genai(api_key=api_key)  # Use provided API key or default
-        
-        # Get database context using helper function
-        db_context = get_database_context(dataset)
-        formatted_context = format_database_context(db_context)
-        
-        sql_prompt = f"""
+def build_sql_prompt(query, dataset, formatted_context):
+    """Prompt asking the model to translate ``query`` into SQLite."""
+    return f"""
         You are a SQL expert. Convert the user's natural language request into a VALID SQLite query.
         
         AVAILABLE DATABASE STRUCTURE:
@@ -230,9 +280,19 @@ def generate_sql_from_query(query, dataset, api_key=None):
         7. Return ONLY the SQL query - no explanations or markdown.
         8. Ensure the SQL is valid for SQLite.
         """
+
+
+def generate_sql_from_query(query, dataset, api_key=None):
+    """Generate SQL query from natural language using the configured LLM."""
+    try:
+        llm = get_llm(api_key=api_key)  # Use provided API key or default
+        
+        # Get database context using helper function
+        with timed('schema'):
+            formatted_context = get_prompt_context(dataset, query)
         
-        sql_model = genai.GenerativeModel('gemini-2.0-flash')
-        raw_sql = sql_model.generate_content([{"role": "user", "parts": [sql_prompt]}]).text.strip()
+        with timed('generate_sql'):
+            raw_sql = llm.generate(build_sql_prompt(query, dataset, formatted_context))
         
         return clean_sql_response(raw_sql)
     except Exception as e:
@@ -240,60 +300,46 @@ def generate_sql_from_query(query, dataset, api_key=None):
         raise e
 
 
+async def agenerate_sql_from_query(query, dataset, api_key=None):
+    """Async version of generate_sql_from_query."""
+    try:
+        llm = get_llm(api_key=api_key)
+        with timed('schema'):
+            formatted_context = await sync_to_async(get_prompt_context)(dataset, query)
+        
+        with timed('generate_sql'):
+            raw_sql = await llm.agenerate(build_sql_prompt(query, dataset, formatted_context))
+        
+        return clean_sql_response(raw_sql)
+    except Exception as e:
+        logger.error(f"SQL generation error: {str(e)}")
+        raise e
+
+
+def get_related_datasets(dataset):
+    """Return the datasets (tables) that belong to the same database as ``dataset``."""
+    return group_datasets(dataset)
+
+
 def get_database_context(dataset):
-    """Build database context information from dataset."""
-    user_filter = {'user': dataset.user} if dataset.user else {'user__isnull': True}
-    base_name = dataset.name.split('.')[0].rstrip('_0123456789')
-    related_datasets = Dataset.objects.filter(
-        name__startswith=base_name,
-        **user_filter
-    ).order_by('name')
-    
-    context = {
-        'database_name': base_name,
-        'table_count': related_datasets.count(),
-        'tables': []
-    }
-    
-    for ds in related_datasets:
-        table_info = {
-            'name': ds.table_name,
-            'columns': [c['name'] for c in ds.columns]
-        }
-        context['tables'].append(table_info)
-    
-    return context
+    """Database context (tables and columns) for ``dataset``, from the schema catalog."""
+    return get_schema_catalog(dataset)['context']
 
 
-def format_database_context(context):
-    """Format database context for display in prompts."""
-    formatted = f"Available Database: {context['database_name']}\n"
-    formatted += f"Total Tables: {context['table_count']}\n\n"
-    formatted += "Tables and their columns:\n"
-    
-    for idx, table in enumerate(context['tables'], 1):
-        formatted += f"{idx}. Table '{table['name']}': "
-        formatted += f"{', '.join(table['columns'])}\n"
-    
-    return formatted
+def get_prompt_context(dataset, query=None):
+    """The database context formatted for prompts, pruned to what ``query`` needs on wide schemas."""
+    return get_prompt_schema(dataset, query)
 
 
-def generate_chat_response(query, dataset, api_key=None):
-    """Generate a friendly chat response using Gemini AI with database context."""
-    try:
-        configure_genai(api_key=api_key)
-        
-        # Get database context
-        db_context = get_database_context(dataset)
-        formatted_context = format_database_context(db_context)
-        
-        # Check if user is asking about database structure
-        structure_keywords = ['table', 'column', 'structure', 'schema', 'database', 'how many']
-        is_structure_question = any(keyword.lower() in query.lower() for keyword in structure_keywords)
-        
-        if is_structure_question:
-            # For structure questions, include detailed database info
-            conversation_prompt = f"""
+def build_chat_prompt(query, formatted_context):
+    """Prompt for a conversational reply, with schema details only for structure questions."""
+    # Check if user is asking about database structure
+    structure_keywords = ['table', 'column', 'structure', 'schema', 'database', 'how many']
+    is_structure_question = any(keyword.lower() in query.lower() for keyword in structure_keywords)
+    
+    if is_structure_question:
+        # For structure questions, include detailed database info
+        return f"""
             You are a helpful database assistant. The user is asking about the database structure.
             
             DATABASE INFORMATION:
@@ -304,9 +350,9 @@ def generate_chat_response(query, dataset, api_key=None):
             Provide accurate information about the database structure based on the information above.
             Be helpful and specific.
             """
-        else:
-            # For general questions, don't mention specific tables
-            conversation_prompt = f"""
+    
+    # For general questions, don't mention specific tables
+    return f"""
             You are a friendly assistant helping users query their database.
             
             USER: "{query}"
@@ -319,11 +365,46 @@ def generate_chat_response(query, dataset, api_key=None):
             
             Provide a helpful response:
             """
+
+
+def generate_chat_response(query, dataset, api_key=None, on_text=None):
+    """
+    Generate a friendly chat response using the configured LLM with database context.
+    With ``on_text``, the reply is streamed from the model and each piece passed to it as it arrives.
+    """
+    try:
+        llm = get_llm(api_key=api_key)
+        
+        # Get database context
+        with timed('schema'):
+            formatted_context = get_prompt_context(dataset)
+        
+        with timed('chat'):
+            prompt = build_chat_prompt(query, formatted_context)
+            if on_text is None:
+                response = llm.generate(prompt)
+            else:
+                pieces = []
+                for piece in llm.stream(prompt):
+                    pieces.append(piece)
+                    on_text(piece)
+                response = ''.join(pieces).strip()
+        
+        return f"<p>{response}</p>"
+    except Exception as e:
+        logger.error(f"Chat generation error: {str(e)}")
+        return f"<p>Sorry, I couldn't process that. Error: {str(e)}</p>"
+
+
+async def agenerate_chat_response(query, dataset, api_key=None):
+    """Async version of generate_chat_response."""
+    try:
+        llm = get_llm(api_key=api_key)
+        with timed('schema'):
+            formatted_context = await sync_to_async(get_prompt_context)(dataset)
         
-        chat_model = genai.GenerativeModel('gemini-2.0-flash')
-        response = chat_model.generate_content(
-            [{"role": "user", "parts": [conversation_prompt]}]
-        ).text.strip()
+        with timed('chat'):
+            response = await llm.agenerate(build_chat_prompt(query, formatted_context))
         
         return f"<p>{response}</p>"
     except Exception as e:
@@ -332,9 +413,9 @@ def generate_chat_response(query, dataset, api_key=None):
 
 
 def classify_query(query, dataset, api_key=None):
-    """Classify query as SQL or CHAT using Gemini AI."""
+    """Classify query as SQL or CHAT using the configured LLM."""
     try:
-        configure_genai(api_key=api_key)  # Use provided API key or default
+        llm = get_llm(api_key=api_key)  # Use provided API key or default
         
         classification_prompt = f"""
         Classify this user message: "{query}"
@@ -342,10 +423,8 @@ def classify_query(query, dataset, api_key=None):
         - Respond ONLY with "CHAT" for greetings, general questions, or metadata questions.
         """
         
-        classifier = genai.GenerativeModel('gemini-2.0-flash')
-        classification = classifier.generate_content(
-            [{"role": "user", "parts": [classification_prompt]}]
-        ).text.strip().upper()
+        with timed('classify'):
+            classification = llm.generate(classification_prompt).upper()
         
         return classification
     except Exception as e:
@@ -353,6 +432,196 @@ def classify_query(query, dataset, api_key=None):
         return "CHAT"
 
 
+# Phrasings that can be routed without asking the model to classify them
+GREETING_PATTERN = re.compile(
+    r"^(hi|hello|hey|hiya|greetings|thanks|thank you|thx|bye|goodbye|good (morning|afternoon|evening)|"
+    r"who are you|what can you do|help)( there| again| so much| a lot| everyone)?[\s!.?,]*$",
+    re.IGNORECASE
+)
+SQL_INTENT_PATTERN = re.compile(
+    r"^(please\s+)?(show|list|display|select|get|fetch|find|give me|count|sum|total|average|avg|"
+    r"top \d+|sort|order|group|filter|update|delete|remove|insert|add|set|change|increase|decrease)\b",
+    re.IGNORECASE
+)
+STRUCTURE_PATTERN = re.compile(r"\b(columns?|schema|structure|tables|databases?|data ?types?)\b", re.IGNORECASE)
+
+
+def preclassify_query(query):
+    """
+    Classify obvious queries locally without a model call.
+    Returns "SQL", "CHAT", or None when the phrasing is ambiguous.
+    """
+    text = query.strip()
+    if GREETING_PATTERN.match(text):
+        return "CHAT"
+    # Questions about columns/tables are answered from the schema by the chat path
+    if SQL_INTENT_PATTERN.match(text) and not STRUCTURE_PATTERN.search(text):
+        return "SQL"
+    return None
+
+
+def parse_plan_response(raw_response):
+    """Parse the planner's JSON reply into (classification, SQL or chat HTML)."""
+    text = raw_response.strip()
+    start, end = text.find('{'), text.rfind('}')
+    try:
+        plan = json.loads(text[start:end + 1]) if start != -1 else None
+    except ValueError:
+        plan = None
+    
+    if isinstance(plan, dict):
+        if str(plan.get('type', '')).upper() == 'SQL' and plan.get('sql'):
+            return "SQL", clean_sql_response(plan['sql'])
+        if plan.get('message'):
+            return "CHAT", f"<p>{plan['message']}</p>"
+    
+    # The model ignored the format: treat a bare statement as SQL, anything else as chat
+    if re.match(r'^(```sql\s*)?(SELECT|INSERT|UPDATE|DELETE|ALTER|WITH)\b', text, re.IGNORECASE):
+        return "SQL", clean_sql_response(text)
+    return "CHAT", f"<p>{text}</p>"
+
+
+# Start of the chat message in a planner reply, and a JSON string's body up to
+# its closing quote or an escape that hasn't fully arrived yet
+PLAN_MESSAGE_START = re.compile(r'"message"\s*:\s*"')
+JSON_STRING_BODY = re.compile(r'(?:[^"\\]|\\.)*', re.S)
+
+
+def stream_plan_response(pieces, on_text):
+    """
+    Collect a streamed planner reply, passing its chat message to ``on_text`` as it arrives.
+    
+    SQL replies, and replies that ignore the JSON format, are only collected.
+    
+    Returns:
+        The whole reply, for parse_plan_response.
+    """
+    raw_response, sent = '', 0
+    for piece in pieces:
+        raw_response += piece
+        match = PLAN_MESSAGE_START.search(raw_response)
+        if not match:
+            continue
+        body = JSON_STRING_BODY.match(raw_response, match.end()).group()
+        try:
+            message = json.loads(f'"{body}"', strict=False)
+        except ValueError:
+            # Cut inside a \u escape; the next piece completes it
+            continue
+        if len(message) > sent:
+            on_text(message[sent:])
+            sent = len(message)
+    return raw_response
+
+
+def build_plan_prompt(query, dataset, formatted_context):
+    """Prompt that classifies ``query`` and answers it (SQL or chat) in one reply."""
+    return f"""
+    You are a SQL expert and a friendly database assistant.
+    
+    AVAILABLE DATABASE STRUCTURE:
+    {formatted_context}
+    
+    Primary Table: {dataset.table_name}
+    
+    User Message: "{query}"
+    
+    Decide whether the message asks to SELECT, INSERT, UPDATE, DELETE, or ALTER data (SQL),
+    or is a greeting, general question, or question about the database structure (CHAT).
+    
+    Respond ONLY with a JSON object, no markdown:
+    - For SQL: {{"type": "SQL", "sql": "<a VALID SQLite query>"}}
+    - For CHAT: {{"type": "CHAT", "message": "<a helpful, friendly reply>"}}
+    
+    SQL RULES:
+    1. ONLY use the tables and columns listed above. Do not invent tables or columns.
+    2. Always quote table names and column names with double quotes.
+    3. If the user asks to show/display the table, use: SELECT * FROM "{dataset.table_name}" LIMIT 10
+    4. For joins, only use tables that exist in the available tables list.
+    
+    CHAT RULES:
+    - Answer structure questions accurately from the information above.
+    - Otherwise don't mention specific table names, and encourage questions about the data.
+    """
+
+
+def plan_query(query, dataset, api_key=None, on_text=None):
+    """
+    Decide how to answer a query using at most one model call.
+    
+    Questions answered before against the same schema come from the SQL cache.
+    Obvious phrasing is classified locally and goes straight to SQL or chat
+    generation; anything else gets a single combined prompt that returns the
+    classification together with the SQL or the chat reply. With ``on_text``,
+    a chat reply is streamed to it as the model writes it.
+    
+    Returns:
+        Tuple of ("SQL", sql_query) or ("CHAT", html_response).
+    """
+    # Questions already answered against this exact schema skip the model entirely
+    with timed('schema'):
+        catalog = get_schema_catalog(dataset)
+    db_context = catalog['context']
+    with timed('sql_cache'):
+        cached_sql = get_cached_sql(query, dataset, db_context)
+    if cached_sql:
+        return "SQL", cached_sql
+    
+    classification = preclassify_query(query)
+    if classification == "SQL":
+        sql_query = generate_sql_from_query(query, dataset, api_key=api_key)
+        cache_sql(query, dataset, db_context, sql_query)
+        return "SQL", sql_query
+    if classification == "CHAT":
+        return "CHAT", generate_chat_response(query, dataset, api_key=api_key, on_text=on_text)
+    
+    llm = get_llm(api_key=api_key)
+    # Structure questions are answered from the full schema; data questions get the relevant part
+    with timed('schema'):
+        schema = catalog['prompt'] if STRUCTURE_PATTERN.search(query) else get_prompt_context(dataset, query)
+    with timed('plan'):
+        plan_prompt = build_plan_prompt(query, dataset, schema)
+        if on_text is None:
+            raw_response = llm.generate(plan_prompt)
+        else:
+            raw_response = stream_plan_response(llm.stream(plan_prompt), on_text)
+    
+    classification, answer = parse_plan_response(raw_response)
+    if classification == "SQL":
+        cache_sql(query, dataset, db_context, answer)
+    return classification, answer
+
+
+async def aplan_query(query, dataset, api_key=None):
+    """Async version of plan_query: same cache and routing, awaiting the model call."""
+    with timed('schema'):
+        catalog = await sync_to_async(get_schema_catalog)(dataset)
+    db_context = catalog['context']
+    with timed('sql_cache'):
+        cached_sql = await sync_to_async(get_cached_sql)(query, dataset, db_context)
+    if cached_sql:
+        return "SQL", cached_sql
+    
+    classification = preclassify_query(query)
+    if classification == "SQL":
+        sql_query = await agenerate_sql_from_query(query, dataset, api_key=api_key)
+        await sync_to_async(cache_sql)(query, dataset, db_context, sql_query)
+        return "SQL", sql_query
+    if classification == "CHAT":
+        return "CHAT", await agenerate_chat_response(query, dataset, api_key=api_key)
+    
+    llm = get_llm(api_key=api_key)
+    with timed('schema'):
+        schema = catalog['prompt'] if STRUCTURE_PATTERN.search(query) else await sync_to_async(get_prompt_context)(dataset, query)
+    with timed('plan'):
+        raw_response = await llm.agenerate(build_plan_prompt(query, dataset, schema))
+    
+    classification, answer = parse_plan_response(raw_response)
+    if classification == "SQL":
+        await sync_to_async(cache_sql)(query, dataset, db_context, answer)
+    return classification, answer
+
+
 def process_query(request):
     """Main query processing view."""
     if request.method != 'POST':
@@ -374,15 +643,10 @@ def process_query(request):
         # Handle target database selection
         if upload_mode == 'existing' and target_database:
             user_filter = get_user_filter(request)
-            # Find existing dataset with matching base name
-            existing_datasets = Dataset.objects.filter(**user_filter)
-            matching_dataset = None
-            
-            for ds in existing_datasets:
-                base_name = ds.name.split('.')[0].rstrip('_0123456789')
-                if base_name.lower() == target_database.lower():
-                    matching_dataset = ds
-                    break
+            # Find an existing dataset in the chosen database
+            matching_dataset = Dataset.objects.filter(
+                database_group__iexact=target_database, **user_filter
+            ).order_by('name').first()
             
             if not matching_dataset:
                 return HttpResponse(f"Database '{target_database}' not found. Please check the name.", status=400)
@@ -404,9 +668,24 @@ def process_query(request):
         return redirect(f'/query/?dataset={dataset.id}&new_upload=true')
     
     # Handle natural language query
+    query, dataset, api_key, redirect_url = resolve_query_request(request)
+    if dataset is not None:
+        answer_query(query, dataset, api_key=api_key)
+    return redirect(redirect_url)
+
+
+def resolve_query_request(request):
+    """
+    Validate a natural language query POST and answer what needs no model.
+    
+    Returns:
+        Tuple of (query, dataset, api_key, redirect_url). dataset is None when
+        the request is invalid or was already answered (special queries, no
+        dataset selected); the caller should then just redirect.
+    """
     form = NaturalLanguageQueryForm(request.POST)
     if not form.is_valid():
-        return redirect('query_interface')
+        return None, None, None, reverse('query_interface')
     
     query = form.cleaned_data['query'].strip()
     dataset_id = request.POST.get('dataset')
@@ -418,9 +697,10 @@ def process_query(request):
         masked_key = 'NONE'
     logger.info("API key provided in POST (masked): %s", masked_key)
     user_filter = get_user_filter(request)
+    redirect_url = f'/query/?dataset={dataset_id}' if dataset_id else '/query/'
     
     if not query:
-        return redirect(f'/query/?dataset={dataset_id}' if dataset_id else '/query/')
+        return query, None, api_key, redirect_url
     
     # Check for special queries first
     special_response, special_dataset = handle_special_queries(query, dataset_id, request)
@@ -431,7 +711,7 @@ def process_query(request):
             sql_query="",
             response=special_response
         )
-        return redirect(f'/query/?dataset={dataset_id}' if dataset_id else '/query/')
+        return query, None, api_key, redirect_url
     
     # Get dataset
     try:
@@ -444,73 +724,616 @@ def process_query(request):
             sql_query="",
             response=error_msg
         )
-        return redirect(f'/query/?dataset={dataset_id}' if dataset_id else '/query/')
+        return query, None, api_key, redirect_url
+    
+    return query, dataset, api_key, f'/query/?dataset={dataset.id}'
+
+
+def get_engine_tables(dataset):
+    """Tables the columnar engine may read for questions about ``dataset``; None when it is off."""
+    if not engine_enabled():
+        return None
+    return list(get_related_datasets(dataset).values_list('table_name', flat=True))
+
+
+def record_data_change(dataset, sql_statements):
+    """After statements that may have modified data, drop the stored column profiles, catalogs and snapshots of the database."""
+    if all(is_read_statement(stmt) for stmt in sql_statements):
+        return
+    related = get_related_datasets(dataset)
+    related.update(profile=None)
+    # Catalogs carry frequent values from the profiles just dropped
+    invalidate_schema_catalog(dataset)
+    invalidate_snapshots(related.values_list('table_name', flat=True))
+
+
+def render_statement_results(sql_statements, is_read_op, results, columns, total_affected):
+    """
+    Turn execute_sql_statements' output into the bot's HTML reply and result handle.
+    
+    ``results`` holds at most RESULT_PAGE_SIZE + 1 rows: the first page is
+    rendered into the reply, and the extra row only tells whether more pages
+    exist. Further pages are fetched on demand by query_results_page.
+    
+    Returns:
+        Tuple of (HTML reply, dict of Conversation result_* fields).
+    """
+    handle = {'result_sql': None, 'result_columns': None, 'result_has_more': False}
+    if not is_read_op:
+        return f"<p>✓ Operation completed successfully. {total_affected} rows affected.</p>", handle
+    if not results:
+        return "<p>No results found for your query.</p>", handle
+    
+    page_size = settings.RESULT_PAGE_SIZE
+    has_more = len(results) > page_size
+    with timed('render'):
+        df = pd.DataFrame(results[:page_size], columns=columns)
+        html_table = df.to_html(index=False, classes='result-table')
+    ROWS_RETURNED.inc(len(df), source='answer')
+    RENDERED_BYTES.inc(len(html_table.encode()))
+    
+    # Only a trailing SELECT can be re-run for further pages (PRAGMA can't be wrapped)
+    read_sql = sql_statements[-1] if sql_statements and is_select(sql_statements[-1]) else None
+    if has_more and read_sql:
+        handle = {'result_sql': read_sql, 'result_columns': columns, 'result_has_more': True}
+        return f"<p>Here's your data (first {page_size} rows):</p>{html_table}", handle
+    return f"<p>Here's your data:</p>{html_table}", handle
+
+
+def get_result_row_cap(limits):
+    """Most rows a stored result can be paged through: RESULT_MAX_ROWS, or the user's max_rows if lower."""
+    return min(filter(None, [settings.RESULT_MAX_ROWS, limits['max_rows']]))
+
+
+def execute_question_statements(sql_statements, dataset, limits, job_id=None):
+    """
+    Run the statements answering a question about ``dataset`` for its first page
+    of results (see execute_sql_statements), serving reads from the result cache.
+    """
+    max_rows = settings.RESULT_PAGE_SIZE + 1
+    
+    def run():
+        return execute_sql_statements(
+            sql_statements, max_rows=max_rows, tables=get_engine_tables(dataset), limits=limits, job_id=job_id,
+        )
+    
+    with timed('execute'):
+        if not sql_statements or not all(is_select(stmt) for stmt in sql_statements):
+            return run()
+        row_limit = min(filter(None, [max_rows, limits['max_rows']]))
+        rows, columns = cached_select(sql_statements, row_limit, lambda: run()[1:3], analytics_connection())
+    return True, rows, columns, 0
+
+
+def fetch_result_page(result_sql, page, page_size=None, tables=None, limits=None):
+    """
+    Fetch one page of a stored result, capped at get_result_row_cap rows overall.
+    
+    With ``tables``, pages come from the columnar engine when it can run the
+    query, as the first page did, so unordered results page consistently.
+    The query is interrupted with QueryTimeout after the ``limits`` timeout.
+    Pages are served from the result cache while their tables are unchanged.
+    
+    Returns:
+        Tuple of (rows, has_more, truncated): truncated is True when more rows
+        exist past the cap.
+    """
+    limits = limits or get_query_limits()
+    row_cap = get_result_row_cap(limits)
+    page_size = page_size or settings.RESULT_PAGE_SIZE
+    offset = (page - 1) * page_size
+    limit = min(page_size, row_cap - offset)
+    if limit <= 0:
+        return [], False, True
+    
+    # Ask for one extra row to learn whether another page follows
+    page_sql = f'SELECT * FROM ({result_sql}) AS result_page LIMIT {limit + 1} OFFSET {offset}'
+    guard = QueryGuard(limits['timeout'])
+    connection = analytics_connection()
+    
+    def run():
+        result = run_select(page_sql, tables, limit + 1, guard=guard) if tables else None
+        if result is not None:
+            return result
+        with guard.running(connection), connection.cursor() as cursor:
+            cursor.execute(page_sql)
+            return cursor.fetchmany(limit + 1), [col[0] for col in cursor.description]
+    
+    rows, _ = cached_select([page_sql], limit + 1, run, connection)
+    
+    more_rows = len(rows) > limit
+    rows = rows[:limit]
+    at_cap = offset + len(rows) >= row_cap
+    return rows, more_rows and not at_cap, more_rows and at_cap
+
+
+def save_conversation(started, answer, **fields):
+    """Store a question's turn; ``answer`` ('sql', 'chat' or 'error') labels the question's total time."""
+    with timed('save'):
+        conversation = Conversation.objects.create(**fields)
+    QUESTION_SECONDS.observe(time.perf_counter() - started, answer=answer)
+    return conversation
+
+
+def answer_query(query, dataset, api_key=None, on_progress=None, job_id=None, on_text=None, on_sql=None):
+    """
+    Answer a natural language query against a dataset and store the turn.
+    
+    Args:
+        query: The user's question
+        dataset: Dataset the question is about
+        api_key: Optional Gemini API key from the user
+        on_progress: Optional callable receiving the stage name
+            ('planning', 'executing', 'saving') as work progresses
+        job_id: The QueryJob answering it, if any; cancelling the job
+            interrupts its SQL with QueryCancelled, which is raised
+        on_text: Optional callable receiving a chat reply in pieces as the
+            model streams it
+        on_sql: Optional callable receiving the SQL before it is executed
+    
+    Returns:
+        The created Conversation.
+    """
+    report = on_progress or (lambda stage: None)
+    started = time.perf_counter()
+    
+    # Classify the query and generate its SQL or chat reply in at most one model call,
+    # queued with the dataset owner's other calls
+    report('planning')
+    try:
+        with llm_user(dataset.user_id):
+            classification, answer = plan_query(query, dataset, api_key=api_key, on_text=on_text)
+    except Exception as e:
+        logger.error(f"Query planning error: {str(e)}")
+        classification, answer = "CHAT", f"<p>Sorry, I couldn't process that. Error: {str(e)}</p>"
+    
+    if classification == "CHAT":
+        report('saving')
+        return save_conversation(
+            started, 'chat',
+            dataset=dataset,
+            user_query=query,
+            sql_query="",
+            response=answer
+        )
+    
+    try:
+        sql_query = answer
+        sql_statements = [stmt.strip() for stmt in sql_query.split(';') if stmt.strip()]
+        if on_sql is not None:
+            on_sql(sql_query)
+        
+        report('executing')
+        statement_results = execute_question_statements(
+            sql_statements, dataset, get_query_limits(dataset.user_id), job_id=job_id
+        )
+        record_data_change(dataset, sql_statements)
+        bot_response, result_handle = render_statement_results(sql_statements, *statement_results)
+        
+        report('saving')
+        return save_conversation(
+            started, 'sql',
+            dataset=dataset,
+            user_query=query,
+            sql_query=sql_query,
+            response=bot_response,
+            **result_handle
+        )
+    except QueryCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"Query processing error: {str(e)}")
+        # Don't keep serving SQL that failed to execute
+        evict_question(query, dataset)
+        error_msg = f"<p>Error: {str(e)}</p>"
+        return save_conversation(
+            started, 'error',
+            dataset=dataset,
+            user_query=query,
+            sql_query="",
+            response=error_msg
+        )
+
+
+async def aanswer_query(query, dataset, api_key=None):
+    """
+    Async version of answer_query for ASGI deployments.
     
-    # Classify and process query
-    classification = classify_query(query, dataset, api_key=api_key)
+    The model call is awaited on the event loop; SQL execution and ORM writes
+    run in worker threads through sync_to_async.
+    """
+    started = time.perf_counter()
+    create_conversation = sync_to_async(save_conversation)
+    try:
+        with llm_user(dataset.user_id):
+            classification, answer = await aplan_query(query, dataset, api_key=api_key)
+    except Exception as e:
+        logger.error(f"Query planning error: {str(e)}")
+        classification, answer = "CHAT", f"<p>Sorry, I couldn't process that. Error: {str(e)}</p>"
     
     if classification == "CHAT":
-        bot_response = generate_chat_response(query, dataset, api_key=api_key)
-        Conversation.objects.create(
+        return await create_conversation(started, 'chat', dataset=dataset, user_query=query, sql_query="", response=answer)
+    
+    try:
+        sql_statements = [stmt.strip() for stmt in answer.split(';') if stmt.strip()]
+        limits = await sync_to_async(get_query_limits)(dataset.user_id)
+        statement_results = await sync_to_async(execute_question_statements)(sql_statements, dataset, limits)
+        await sync_to_async(record_data_change)(dataset, sql_statements)
+        bot_response, result_handle = render_statement_results(sql_statements, *statement_results)
+        return await create_conversation(
+            started, 'sql', dataset=dataset, user_query=query, sql_query=answer, response=bot_response, **result_handle
+        )
+    except Exception as e:
+        logger.error(f"Query processing error: {str(e)}")
+        await sync_to_async(evict_question)(query, dataset)
+        return await create_conversation(
+            started, 'error',
             dataset=dataset,
             user_query=query,
             sql_query="",
-            response=bot_response
+            response=f"<p>Error: {str(e)}</p>"
         )
-    else:  # SQL
+
+
+async def aprocess_query(request):
+    """
+    Async version of process_query, served when ASYNC_QUERY_VIEWS is on (the ASGI deployment).
+    
+    While a question waits on the model the event loop serves other requests,
+    so one worker can have many questions in flight.
+    """
+    if request.method != 'POST' or 'file' in request.FILES:
+        # Uploads are CPU/disk bound; keep them on the synchronous path
+        return await sync_to_async(process_query)(request)
+    
+    query, dataset, api_key, redirect_url = await sync_to_async(resolve_query_request)(request)
+    if dataset is not None:
+        await aanswer_query(query, dataset, api_key=api_key)
+    return redirect(redirect_url)
+
+
+@require_POST
+def process_query_async(request):
+    """
+    Queue a natural language query as a background job.
+    
+    Returns 202 with URLs to poll the job and to follow its progress events;
+    requests that need no model call are answered immediately.
+    """
+    query, dataset, api_key, redirect_url = resolve_query_request(request)
+    if dataset is None:
+        return JsonResponse({'status': 'done', 'redirect': redirect_url})
+    
+    job = submit_query_job(query, dataset, api_key=api_key)
+    return JsonResponse({
+        'job_id': str(job.id),
+        'status': job.status,
+        'status_url': reverse('query_job_status', args=[job.id]),
+        'events_url': reverse('query_job_events', args=[job.id]),
+        'cancel_url': reverse('cancel_query_job', args=[job.id]),
+        'poll_interval': settings.QUERY_JOB_POLL_INTERVAL,
+        'redirect': redirect_url,
+    }, status=202)
+
+
+def sse_event(event, data):
+    """One server-sent event carrying ``data`` as JSON."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream_response(events):
+    """Stream ``events`` (server-sent event strings) without buffering along the way."""
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def render_turn(conversation):
+    """HTML of one chat turn as the chat page shows it (see get_conversation_page)."""
+    collapse_chars = settings.CONVERSATION_COLLAPSE_CHARS
+    conversation.response_length = len(conversation.response)
+    conversation.response_preview = conversation.response[:collapse_chars]
+    conversation.collapsed = conversation.response_length > collapse_chars
+    return render_to_string('conversation_turns.html', {'conversations': [conversation]})
+
+
+def start_answer_stream(query, dataset, api_key, put):
+    """
+    Answer ``query`` on a new thread, handing ``put`` its server-sent events, then None.
+    
+    Events are ``progress`` (the stage), ``token`` (a piece of a chat reply as
+    the model writes it), ``sql`` (the generated SQL, before it runs) and
+    finally ``done`` (the stored turn as HTML) or ``error``. The answer is
+    worked out apart from the response, so the turn is still stored when the
+    client goes away mid-stream.
+    """
+    def run():
         try:
-            sql_query = generate_sql_from_query(query, dataset, api_key=api_key)
-            sql_statements = [stmt.strip() for stmt in sql_query.split(';') if stmt.strip()]
-            
-            is_read_op, results, columns, total_affected = execute_sql_statements(sql_statements)
-            
-            if is_read_op:
-                if results:
-                    df = pd.DataFrame(results, columns=columns)
-                    html_table = df.to_html(index=False, classes='result-table')
-                    bot_response = f"<p>Here's your data:</p>{html_table}"
-                else:
-                    bot_response = "<p>No results found for your query.</p>"
-            else:
-                bot_response = f"<p>✓ Operation completed successfully. {total_affected} rows affected.</p>"
-            
-            Conversation.objects.create(
-                dataset=dataset,
-                user_query=query,
-                sql_query=sql_query,
-                response=bot_response
+            conversation = answer_query(
+                query, dataset, api_key=api_key,
+                on_progress=lambda stage: put(sse_event('progress', {'stage': stage})),
+                on_text=lambda text: put(sse_event('token', {'text': text})),
+                on_sql=lambda sql: put(sse_event('sql', {'sql': sql})),
             )
+            put(sse_event('done', {'conversation_id': conversation.id, 'html': render_turn(conversation)}))
         except Exception as e:
-            logger.error(f"Query processing error: {str(e)}")
-            error_msg = f"<p>Error: {str(e)}</p>"
-            Conversation.objects.create(
-                dataset=dataset,
-                user_query=query,
-                sql_query="",
-                response=error_msg
+            logger.error(f"Streamed query failed: {str(e)}")
+            put(sse_event('error', {'error': str(e)}))
+        finally:
+            # The thread gets its own connections; don't leak them
+            connections.close_all()
+            put(None)
+    
+    threading.Thread(target=run, name='query-stream', daemon=True).start()
+
+
+@require_POST
+def process_query_stream(request):
+    """
+    Answer a natural language query, streaming the answer as server-sent events.
+    
+    Chat replies show as the model writes them and SQL shows before it runs,
+    instead of after the whole answer (see start_answer_stream). Requests
+    that need no model call get a single ``done`` event with the page to load.
+    This sync version holds its worker until the answer is done, which is why
+    the chat page only streams under ASGI by default (QUERY_STREAMING).
+    """
+    query, dataset, api_key, redirect_url = resolve_query_request(request)
+    if dataset is None:
+        return event_stream_response(iter([sse_event('done', {'redirect': redirect_url})]))
+    
+    events = queue.Queue()
+    start_answer_stream(query, dataset, api_key, events.put)
+    
+    def stream():
+        while True:
+            try:
+                event = events.get(timeout=settings.QUERY_STREAM_KEEPALIVE)
+            except queue.Empty:
+                # A comment line keeps proxies from dropping a quiet connection
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield event
+    
+    return event_stream_response(stream())
+
+
+async def aprocess_query_stream(request):
+    """
+    Async version of process_query_stream: the response waits for events on the
+    event loop (a sync iterator would be read to the end before anything is sent).
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    
+    query, dataset, api_key, redirect_url = await sync_to_async(resolve_query_request)(request)
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    if dataset is None:
+        events.put_nowait(sse_event('done', {'redirect': redirect_url}))
+        events.put_nowait(None)
+    else:
+        start_answer_stream(
+            query, dataset, api_key, lambda event: loop.call_soon_threadsafe(events.put_nowait, event)
+        )
+    
+    async def stream():
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), settings.QUERY_STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield event
+    
+    return event_stream_response(stream())
+
+
+def get_user_job(request, job_id):
+    """Fetch a job owned by the current user, or None."""
+    user_filter = {f'dataset__{key}': value for key, value in get_user_filter(request).items()}
+    job = QueryJob.objects.select_related('conversation').filter(id=job_id, **user_filter).first()
+    return expire_stale_job(job) if job else None
+
+
+def query_job_status(request, job_id):
+    """Report a query job's status, with the answer once it is done."""
+    job = get_user_job(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return JsonResponse(job_payload(job))
+
+
+def query_job_events(request, job_id):
+    """
+    Stream a query job's progress as server-sent events until it finishes.
+    
+    The stream holds its worker until the job is done, so under sync workers
+    the chat page polls query_job_status instead (see aquery_job_events).
+    """
+    job = get_user_job(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    
+    def events():
+        last_stage = None
+        current = job
+        while True:
+            if current.stage != last_stage:
+                last_stage = current.stage
+                yield sse_event('progress', {'stage': current.stage})
+            if current.is_finished:
+                yield sse_event('result', job_payload(current))
+                return
+            time.sleep(settings.QUERY_JOB_POLL_INTERVAL)
+            current = expire_stale_job(QueryJob.objects.select_related('conversation').get(id=job.id))
+    
+    return event_stream_response(events())
+
+
+async def aquery_job_events(request, job_id):
+    """Async version of query_job_events for ASGI: waits between polls on the event loop, not in a worker."""
+    job = await sync_to_async(get_user_job)(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    
+    def refresh():
+        return expire_stale_job(QueryJob.objects.select_related('conversation').get(id=job.id))
+    
+    async def events():
+        last_stage = None
+        current = job
+        while True:
+            if current.stage != last_stage:
+                last_stage = current.stage
+                yield sse_event('progress', {'stage': current.stage})
+            if current.is_finished:
+                yield sse_event('result', job_payload(current))
+                return
+            await asyncio.sleep(settings.QUERY_JOB_POLL_INTERVAL)
+            current = await sync_to_async(refresh)()
+    
+    return event_stream_response(events())
+
+
+@require_POST
+def cancel_query_job(request, job_id):
+    """Cancel a queued or running query job; its SQL is interrupted if it has started."""
+    job = get_user_job(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    if job.is_finished:
+        return JsonResponse(job_payload(job), status=409)
+    return JsonResponse(job_payload(cancel_job(job)))
+
+
+def query_results_page(request, conversation_id):
+    """Return one page of a conversation's query result as JSON (?page=N, 1-based)."""
+    user_filter = {f'dataset__{key}': value for key, value in get_user_filter(request).items()}
+    conversation = Conversation.objects.filter(id=conversation_id, **user_filter).first()
+    if conversation is None or not conversation.result_sql:
+        return JsonResponse({'error': 'Result not found'}, status=404)
+    
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid page'}, status=400)
+    
+    limits = get_query_limits(conversation.dataset.user_id)
+    try:
+        with timed('execute'):
+            rows, has_more, truncated = fetch_result_page(
+                conversation.result_sql, page, tables=get_engine_tables(conversation.dataset), limits=limits
             )
+    except DatabaseError as e:
+        # The table may have changed or been dropped since the question was asked
+        logger.error(f"Result page error: {str(e)}")
+        return JsonResponse({'error': f'Could not load results: {str(e)}'}, status=409)
+    except QueryTimeout as e:
+        logger.warning(f"Result page timed out: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=504)
+    
+    ROWS_RETURNED.inc(len(rows), source='page')
+    return JsonResponse({
+        'columns': conversation.result_columns,
+        'rows': [list(row) for row in rows],
+        'page': page,
+        'page_size': settings.RESULT_PAGE_SIZE,
+        'has_more': has_more,
+        'truncated': truncated,
+        'max_rows': get_result_row_cap(limits),
+    })
+
+
+def export_results(request, conversation_id):
+    """Stream the full result of a conversation's SELECT as CSV, NDJSON or Parquet (?format=)."""
+    user_filter = {f'dataset__{key}': value for key, value in get_user_filter(request).items()}
+    conversation = Conversation.objects.filter(id=conversation_id, **user_filter).first()
+    if conversation is None or not conversation.read_sql:
+        return HttpResponse("There is no query result to export.", status=404)
     
-    return redirect(f'/query/?dataset={dataset.id}')
+    export_format = request.GET.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponse(f"Unsupported export format '{export_format}'. Use csv, ndjson or parquet.", status=400)
+    
+    # The export re-runs the query, under the same guardrails as the question did
+    limits = get_query_limits(conversation.dataset.user_id)
+    sql = add_limit(conversation.read_sql, limits['max_rows'])
+    try:
+        check_cost(analytics_connection(), [sql], limits['max_cost'])
+    except QueryRejected as e:
+        return HttpResponse(str(e), status=400)
+    
+    try:
+        chunks = iter_export(sql, export_format, guard=QueryGuard(limits['timeout']))
+    except ImportError:
+        return HttpResponse("Parquet export requires the pyarrow package.", status=400)
+    
+    if settings.ASYNC_QUERY_VIEWS:
+        # Under ASGI a sync iterator would be read whole before the first byte is sent
+        chunks = aiter_chunks(chunks)
+    
+    content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{conversation.dataset.table_name}_{conversation.id}.{extension}"'
+    return response
+
+
+def get_conversation_page(dataset, before=None):
+    """
+    Return one page of a dataset's chat history, oldest turn first.
+    
+    The page holds the CONVERSATION_PAGE_SIZE turns just before the ``before``
+    conversation id (the latest turns when None). Responses are read up to
+    CONVERSATION_COLLAPSE_CHARS characters; longer ones are marked
+    ``collapsed`` and fetched on demand by conversation_response, so a page
+    costs the same however large the stored tables are.
+    
+    Returns:
+        Tuple of (conversations, cursor for the next older page or None).
+    """
+    page_size = settings.CONVERSATION_PAGE_SIZE
+    collapse_chars = settings.CONVERSATION_COLLAPSE_CHARS
+    conversations = Conversation.objects.filter(dataset=dataset)
+    if before is not None:
+        conversations = conversations.filter(id__lt=before)
+    conversations = list(
+        conversations.defer('response').annotate(
+            response_length=Length('response'),
+            response_preview=Substr('response', 1, collapse_chars),
+        ).order_by('-id')[:page_size + 1]
+    )
+    has_older = len(conversations) > page_size
+    conversations = conversations[:page_size][::-1]
+    for conv in conversations:
+        conv.collapsed = conv.response_length > collapse_chars
+    return conversations, (conversations[0].id if has_older else None)
 
 
 def query_interface(request):
-    """Display the query chat interface."""
+    """Display the query chat interface with the latest turns of the chat history."""
     user_filter = get_user_filter(request)
     datasets = Dataset.objects.filter(**user_filter).order_by('name')
     grouped_datasets = group_datasets_by_name(datasets)
     dataset_id = request.GET.get('dataset')
     selected_dataset = None
     conversations = []
+    history_cursor = None
     
     if dataset_id:
         try:
             selected_dataset = Dataset.objects.get(id=dataset_id, **user_filter)
-            conversations = Conversation.objects.filter(dataset=selected_dataset).order_by('created_at')
         except Dataset.DoesNotExist:
             selected_dataset = datasets.first() if datasets.exists() else None
     elif datasets.exists():
         selected_dataset = datasets.first()
-        conversations = Conversation.objects.filter(dataset=selected_dataset).order_by('created_at')
+    if selected_dataset is not None:
+        conversations, history_cursor = get_conversation_page(selected_dataset)
     
     query_form = NaturalLanguageQueryForm()
     return render(request, 'query.html', {
@@ -518,23 +1341,46 @@ def query_interface(request):
         'grouped_datasets': grouped_datasets,
         'current_dataset': selected_dataset,
         'conversations': conversations,
-        'query_form': query_form
+        'history_cursor': history_cursor,
+        'query_form': query_form,
+        'query_streaming': settings.QUERY_STREAMING,
+        # Only the async events view leaves workers free while a tab follows a job
+        'job_events': settings.ASYNC_QUERY_VIEWS,
+    })
+
+
+def conversation_history(request):
+    """Return older chat turns of a dataset as rendered HTML (?dataset=ID&before=CONVERSATION_ID)."""
+    user_filter = get_user_filter(request)
+    try:
+        dataset = Dataset.objects.get(id=int(request.GET.get('dataset', '')), **user_filter)
+        before = int(request.GET['before']) if request.GET.get('before') else None
+    except (ValueError, Dataset.DoesNotExist):
+        return JsonResponse({'error': 'Dataset not found'}, status=404)
+    
+    conversations, next_cursor = get_conversation_page(dataset, before)
+    return JsonResponse({
+        'html': render_to_string('conversation_turns.html', {'conversations': conversations}, request=request),
+        'next_cursor': next_cursor,
     })
 
 
+def conversation_response(request, conversation_id):
+    """Return the full reply of one chat turn (for results collapsed in the history)."""
+    user_filter = {f'dataset__{key}': value for key, value in get_user_filter(request).items()}
+    conversation = Conversation.objects.filter(id=conversation_id, **user_filter).first()
+    if conversation is None:
+        return JsonResponse({'error': 'Conversation not found'}, status=404)
+    return JsonResponse({'html': conversation.response})
+
+
 def upload_dataset(request):
     """Display the upload dataset page."""
     user_filter = get_user_filter(request)
-    datasets = Dataset.objects.filter(**user_filter).values_list('name', flat=True).distinct()
-    
-    # Extract base database names
-    database_names = set()
-    for name in datasets:
-        base_name = name.split('.')[0].rstrip('_0123456789')
-        database_names.add(base_name)
+    database_names = Dataset.objects.filter(**user_filter).values_list('database_group', flat=True).distinct()
     
     return render(request, 'upload.html', {
-        'existing_databases': sorted(list(database_names)),
+        'existing_databases': sorted(set(database_names)),
         'form': DatasetUploadWithTargetForm()
     })
 
@@ -564,19 +1410,25 @@ def delete_dataset(request):
             dataset = Dataset.objects.get(id=dataset_id, **user_filter)
             table_name = dataset.table_name
             
+            # Drop cached SQL for the whole database, which loses a table
+            invalidate_datasets(get_related_datasets(dataset))
+            
             # Delete conversations first
             Conversation.objects.filter(dataset=dataset).delete()
             
             # Drop the table from database
             try:
-                with connection.cursor() as cursor:
+                with analytics_connection().cursor() as cursor:
                     cursor.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+                invalidate_snapshots([table_name])
+                bump_table_versions([table_name])
                 logger.info(f"Dropped table {table_name}")
             except Exception as e:
                 logger.warning(f"Could not drop table {table_name}: {str(e)}")
             
             # Delete the dataset record
             dataset.delete()
+            invalidate_schema_catalog(dataset)
             logger.info(f"Deleted dataset {dataset_id}")
             
             return JsonResponse({'success': True, 'message': f'Database "{dataset.name}" deleted successfully'})
@@ -606,12 +1458,19 @@ def rename_dataset(request):
         dataset = Dataset.objects.get(id=dataset_id, **user_filter)
         new_table_name = sanitize_table_name(new_name)
         
-        with connection.cursor() as cursor:
+        # Cached SQL refers to the old table name
+        invalidate_datasets(get_related_datasets(dataset))
+        
+        with analytics_connection().cursor() as cursor:
             cursor.execute(f'ALTER TABLE "{dataset.table_name}" RENAME TO "{new_table_name}"')
+        rename_snapshot(dataset.table_name, new_table_name)
+        bump_table_versions([dataset.table_name, new_table_name])
         
+        # The dataset keeps its database_group, so it stays in the same database
         dataset.table_name = new_table_name
         dataset.name = new_name
         dataset.save()
+        invalidate_schema_catalog(dataset)
         
         logger.info(f"Renamed dataset {dataset_id} to {new_name}")
         return JsonResponse({'success': True, 'message': f'Table renamed to {new_name}'})
@@ -620,6 +1479,50 @@ def rename_dataset(request):
         return JsonResponse({'success': False, 'message': f'Error: {str(e)}'})
 
 
+def metrics(request):
+    """Prometheus metrics of this process; needs a staff login, or ``Authorization: Bearer <METRICS_TOKEN>`` when one is set."""
+    if not request.user.is_staff:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not settings.METRICS_TOKEN or not hmac.compare_digest(supplied, settings.METRICS_TOKEN):
+            return HttpResponse("Unauthorized", status=401, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def request_profiles(request):
+    """Admin page listing recent request profiles by view (?view=NAME for one view's)."""
+    view = request.GET.get('view') or None
+    all_profiles = list_profiles()
+    profiles = [profile for profile in all_profiles if view is None or profile['view'] == view]
+
+    durations = {}
+    for profile in all_profiles:
+        durations.setdefault(profile['view'], []).append(profile['duration_ms'])
+    view_summaries = [
+        {'view': name, 'count': len(values), 'median_ms': sorted(values)[len(values) // 2], 'slowest_ms': max(values)}
+        for name, values in sorted(durations.items())
+    ]
+
+    return render(request, 'profiles.html', {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': profiles,
+        'view_summaries': view_summaries,
+        'selected_view': view,
+        'profiling': settings.PROFILING,
+        'sample_rate': settings.PROFILING_SAMPLE_RATE,
+    })
+
+
+@staff_member_required
+def download_profile(request, profile_id):
+    """Download a profile's data: folded stacks (flame graphs) or a cProfile .prof file."""
+    path = profile_data_path(profile_id)
+    if path is None:
+        return HttpResponse("Profile not found.", status=404)
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))
+
+
 # Page Views
 def home(request):
     """Home page view."""
@@ -646,6 +1549,17 @@ def contact(request):
     return render(request, 'info.html', {'info_page': 'contact'})
 
 
+def get_dataset_profile(dataset):
+    """Return the dataset's column profile, computing and storing it if it isn't there yet."""
+    if not dataset.profile:
+        column_types = {c['name']: c.get('type', 'TEXT') for c in dataset.columns}
+        dataset.profile = profile_table(dataset.table_name, column_types)
+        Dataset.objects.filter(pk=dataset.pk).update(profile=dataset.profile)
+        invalidate_schema_catalog(dataset)
+        logger.info(f"Rebuilt column profile for dataset {dataset.id}")
+    return dataset.profile
+
+
 def visualize_data(request):
     """Visualize data from datasets with tables and charts."""
     user_filter = get_user_filter(request)
@@ -663,8 +1577,8 @@ def visualize_data(request):
         try:
             selected_dataset = Dataset.objects.get(id=dataset_id, **user_filter)
             
-            # Fetch data from the database
-            with connection.cursor() as cursor:
+            # Preview rows: a bounded read, not a scan
+            with analytics_connection().cursor() as cursor:
                 cursor.execute(f'SELECT * FROM "{selected_dataset.table_name}" LIMIT 1000')
                 rows = cursor.fetchall()
                 columns = [col[0] for col in cursor.description] if cursor.description else []
@@ -672,43 +1586,35 @@ def visualize_data(request):
                 # Convert to list of dicts for template
                 table_data = [dict(zip(columns, row)) for row in rows]
             
-            # Calculate statistics
-            with connection.cursor() as cursor:
-                # Count total records
-                cursor.execute(f'SELECT COUNT(*) FROM "{selected_dataset.table_name}"')
-                total_records = cursor.fetchone()[0]
-                
-                data_stats['total_records'] = total_records
-                data_stats['total_columns'] = len(columns)
-                
-                # Try to get numeric columns for statistics
-                numeric_data = {}
-                for col in selected_dataset.columns:
-                    if col.get('type') in ['INTEGER', 'REAL', 'FLOAT']:
-                        col_name = col['name']
-                        try:
-                            cursor.execute(f'SELECT MIN("{col_name}"), MAX("{col_name}"), AVG("{col_name}") FROM "{selected_dataset.table_name}"')
-                            min_val, max_val, avg_val = cursor.fetchone()
-                            numeric_data[col_name] = {
-                                'min': round(float(min_val), 2) if min_val else 0,
-                                'max': round(float(max_val), 2) if max_val else 0,
-                                'avg': round(float(avg_val), 2) if avg_val else 0
-                            }
-                        except:
-                            pass
-                
-                data_stats['numeric_columns'] = numeric_data
-                
-                # Get first text column for value counts (for pie/bar chart)
-                text_columns = [col['name'] for col in selected_dataset.columns if col.get('type') not in ['INTEGER', 'REAL', 'FLOAT', 'DATE', 'DATETIME']]
-                if text_columns and len(table_data) > 0:
-                    first_text_col = text_columns[0]
-                    cursor.execute(f'SELECT "{first_text_col}", COUNT(*) FROM "{selected_dataset.table_name}" GROUP BY "{first_text_col}" LIMIT 10')
-                    distribution = cursor.fetchall()
-                    if distribution:
-                        chart_data['distribution_column'] = first_text_col
-                        chart_data['distribution_labels'] = [str(row[0]) for row in distribution]
-                        chart_data['distribution_values'] = [int(row[1]) for row in distribution]
+            # Statistics come from the profile stored at ingest; rebuild it once if missing
+            profile = get_dataset_profile(selected_dataset)
+            column_stats = summarize_profile(profile)
+            
+            data_stats['total_records'] = profile['row_count']
+            data_stats['total_columns'] = len(columns)
+            data_stats['column_stats'] = column_stats
+            data_stats['numeric_columns'] = {
+                name: {
+                    'min': round(stats['min'], 2),
+                    'max': round(stats['max'], 2),
+                    'avg': round(stats['mean'], 2),
+                    'stddev': round(stats['stddev'], 2) if stats['stddev'] is not None else None,
+                }
+                for name, stats in column_stats.items()
+                if stats['type'] in ('INTEGER', 'REAL') and stats['mean'] is not None
+            }
+            
+            # Value counts of the first text column (for pie/bar chart)
+            text_columns = [
+                name for name, stats in column_stats.items()
+                if stats['type'] not in ('INTEGER', 'REAL', 'FLOAT', 'DATE', 'DATETIME') and stats['top']
+            ]
+            if text_columns and len(table_data) > 0:
+                first_text_col = text_columns[0]
+                distribution = column_stats[first_text_col]['top']
+                chart_data['distribution_column'] = first_text_col
+                chart_data['distribution_labels'] = [str(value) for value, _ in distribution]
+                chart_data['distribution_values'] = [int(count) for _, count in distribution]
         
         except Dataset.DoesNotExist:
             selected_dataset = datasets.first() if datasets.exists() else None
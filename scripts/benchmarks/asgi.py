@@ -0,0 +1,98 @@
+"""
+Concurrent question capacity: gunicorn sync workers (WSGI) vs one uvicorn worker (ASGI).
+
+Both deployments run against the same scratch database with the offline LLM
+provider sleeping ``--delay`` seconds per call. For each concurrency level the
+benchmark posts that many distinct questions to /process_query/ at once and
+reports how long the batch took and per-question latency. Under WSGI each
+worker holds one question at a time; under ASGI (asgi.py turns on
+ASYNC_QUERY_VIEWS) the model wait is awaited, so one worker overlaps them.
+
+    python -m scripts.benchmarks.asgi --concurrency 1 10 50 --delay 1 --wsgi-workers 2
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.benchmarks.common import (
+    HttpSession, create_dataset, percentile, print_table, remove_database, scratch_path, setup_django,
+    wait_for_server,
+)
+
+
+def server_command(deployment, port, wsgi_workers):
+    if deployment == 'wsgi':
+        return [sys.executable, '-m', 'gunicorn', 'nlq_project.wsgi:application', '-w', str(wsgi_workers),
+                '-b', f'127.0.0.1:{port}', '--timeout', '300', '--log-level', 'warning']
+    return [sys.executable, '-m', 'uvicorn', 'nlq_project.asgi:application', '--workers', '1',
+            '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+
+
+def fire(session, dataset_id, concurrency, label):
+    def ask(i):
+        start = time.perf_counter()
+        status, _, _ = session.request('/process_query/', {'query': f'show the rows for {label}-{i}', 'dataset': dataset_id})
+        return status == 302, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(ask, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for ok, latency in outcomes if ok]
+    return {
+        'answered': f'{len(latencies)}/{concurrency}',
+        'seconds': f'{elapsed:.1f}',
+        'questions/s': f'{len(latencies) / elapsed:.2f}',
+        'p50 (s)': f'{percentile(latencies, 50):.2f}',
+        'p95 (s)': f'{percentile(latencies, 95):.2f}',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--delay', type=float, default=1.0, help='Seconds the stub model sleeps per call')
+    parser.add_argument('--wsgi-workers', type=int, default=2, help='gunicorn sync workers')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    setup_django(db_path, migrate=True)
+    dataset = create_dataset(1000)
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{db_path}',
+        LLM_PROVIDER='offline',
+        OFFLINE_LLM_LATENCY=str(args.delay),
+        DEBUG='True',
+        ALLOWED_HOSTS='127.0.0.1,localhost',
+    )
+    # Let each deployment pick its own view (asgi.py defaults this to True)
+    env.pop('ASYNC_QUERY_VIEWS', None)
+
+    results = []
+    try:
+        for deployment in ('wsgi', 'asgi'):
+            server = subprocess.Popen(server_command(deployment, args.port, args.wsgi_workers), env=env)
+            try:
+                session = HttpSession(f'http://127.0.0.1:{args.port}')
+                wait_for_server(session)
+                session.fetch_csrf_token()
+                for concurrency in args.concurrency:
+                    row = fire(session, dataset.id, concurrency, f'{deployment}-{concurrency}')
+                    results.append({'deployment': deployment, 'concurrency': concurrency, **row})
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        remove_database(db_path)
+
+    print(f'{args.delay}s model latency; WSGI = gunicorn -w {args.wsgi_workers}, ASGI = uvicorn, 1 worker')
+    print_table(results, ['deployment', 'concurrency', 'answered', 'seconds', 'questions/s', 'p50 (s)', 'p95 (s)'])
+
+
+if __name__ == '__main__':
+    main()
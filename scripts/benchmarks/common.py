@@ -0,0 +1,213 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks run against a throwaway SQLite database so they never touch
+db.sqlite3. Run them from the repository root, e.g.:
+
+    python -m scripts.benchmarks.ingest --rows 1000000
+"""
+import csv
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+
+
+CITIES = ['New York', 'London', 'Paris', 'Tokyo', 'Berlin', 'Sydney', 'Toronto', 'Mumbai']
+DEPARTMENTS = ['Sales', 'Engineering', 'Marketing', 'Support', 'Finance']
+
+
+def setup_django(db_path=None, migrate=False, test_client=False):
+    """Point Django at a scratch database (if given) and initialise it.
+
+    ``test_client`` prepares the environment for django.test.Client
+    (adds 'testserver' to ALLOWED_HOSTS and so on).
+    """
+    if db_path:
+        os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nlq_project.settings')
+    import django
+    django.setup()
+    if migrate:
+        from django.core.management import call_command
+        call_command('migrate', verbosity=0)
+    if test_client:
+        from django.test.utils import setup_test_environment
+        setup_test_environment()
+
+
+def scratch_path(suffix):
+    """Return a path for a temporary file that the caller is responsible for removing."""
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix='nlq_bench_')
+    os.close(fd)
+    return path
+
+
+def remove_database(path):
+    """Remove a scratch SQLite database, its analytics sibling, their WAL and shared-memory files and snapshots."""
+    root, ext = os.path.splitext(path)
+    for database in (path, f'{root}_analytics{ext}'):
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+    shutil.rmtree(f'{root}_analytics_snapshots', ignore_errors=True)
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in megabytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def synthetic_row(i, rng, start=date(2020, 1, 1)):
+    """One row of the synthetic sales-style dataset."""
+    return [
+        i,
+        f'user_{i}',
+        rng.choice(CITIES),
+        rng.choice(DEPARTMENTS),
+        rng.randint(18, 70),
+        round(rng.uniform(10, 10000), 2),
+        (start + timedelta(days=i % 1500)).isoformat(),
+        rng.choice(['true', 'false']),
+    ]
+
+
+SYNTHETIC_HEADER = ['id', 'name', 'city', 'department', 'age', 'amount', 'order_date', 'active']
+
+
+def write_synthetic_csv(path, rows, seed=0):
+    """Stream ``rows`` synthetic rows to ``path`` without holding them in memory."""
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(SYNTHETIC_HEADER)
+        for i in range(rows):
+            writer.writerow(synthetic_row(i, rng))
+    return path
+
+
+def create_dataset(rows, name='bench_data.csv', seed=0):
+    """Ingest a synthetic CSV and register it as an anonymous Dataset."""
+    from query_app.ingest import ingest_file
+    from query_app.models import Dataset
+    from query_app.views import sanitize_table_name
+
+    csv_path = write_synthetic_csv(scratch_path('.csv'), rows, seed=seed)
+    try:
+        table_name = sanitize_table_name(name)
+        with open(csv_path, 'rb') as fh:
+            columns, _, profile = ingest_file(fh, table_name)
+    finally:
+        os.remove(csv_path)
+    return Dataset.objects.create(
+        name=name, table_name=table_name, columns=columns, profile=profile, file=f'datasets/{name}'
+    )
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_worker(module, args):
+    """Run ``python -m module args`` in a fresh process and return its JSON output.
+
+    A fresh interpreter per measurement keeps peak-RSS readings independent.
+    """
+    output = subprocess.run(
+        [sys.executable, '-m', module] + [str(a) for a in args],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def print_table(rows, columns):
+    """Print a list of dicts as an aligned text table."""
+    widths = {c: max(len(c), *(len(str(r.get(c, ''))) for r in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print('  '.join(str(row.get(c, '')).ljust(widths[c]) for c in columns))
+
+
+def encode_multipart(data, files):
+    """multipart/form-data body and content type for form fields and {field: file path}."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in data.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, path in files.items():
+        with open(path, 'rb') as fh:
+            content = fh.read()
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{os.path.basename(path)}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """Minimal HTTP client carrying Django's CSRF cookie."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(_NoRedirect)
+        self.csrf_token = None
+
+    def request(self, path, data=None, timeout=300, files=None):
+        """GET ``path``, or POST ``data`` (multipart when ``files`` maps field names to file paths)."""
+        headers = {}
+        if self.csrf_token:
+            headers['Cookie'] = f'csrftoken={self.csrf_token}'
+            headers['X-CSRFToken'] = self.csrf_token
+        if files:
+            body, headers['Content-Type'] = encode_multipart(data or {}, files)
+        else:
+            body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers)
+        try:
+            with self.opener.open(req, timeout=timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    def fetch_csrf_token(self):
+        _, headers, _ = self.request('/upload/')
+        for cookie in headers.get_all('Set-Cookie') or []:
+            if cookie.startswith('csrftoken='):
+                self.csrf_token = cookie.split(';', 1)[0].split('=', 1)[1]
+        if not self.csrf_token:
+            raise RuntimeError('Could not obtain a CSRF token from /upload/')
+
+
+def wait_for_server(session, timeout=60):
+    """Block until the server under test answers HTTP requests."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            session.request('/', timeout=2)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('The server under test did not start')
@@ -0,0 +1,444 @@
+"""
+End-to-end benchmark: upload, ask, page, visualize and export synthetic datasets.
+
+For every combination of ``--formats`` (csv, xlsx), ``--rows`` and
+``--columns`` a synthetic file is generated (the sales-style columns of the
+other benchmarks, widened with numeric and text columns) and driven through
+the app in a fresh process with its own scratch database, so each case's
+peak RSS is its own:
+
+- upload: the file posted to /process_query/ as a new database
+- page_load: the query page the upload redirects to
+- question_cold, question: a fixed list of questions posted to /process_query/,
+  first with empty caches, then ``--repeat`` - 1 more times with warm ones
+- result_page: pages of a ``SELECT *`` result from /conversations/<id>/results/
+- visualize: the data work of the visualize view (preview rows and a rebuilt
+  column profile), called directly because the view has no URL or template
+- export_<format>: the whole table from /conversations/<id>/export/
+
+Requests go through django.test.Client (``--server client``) or a live
+gunicorn (``wsgi``, one worker) or uvicorn (``asgi``) server started for the
+case; peak RSS is then the server's. The model is the offline provider,
+sleeping ``--llm-latency`` seconds per call, so runs are deterministic.
+
+Results are printed and, with ``--output``, written as JSON with the commit
+and environment; ``--compare BASELINE.json`` reports the change from an earlier
+run and exits with status 1 when a stage got slower by more than
+``--threshold`` percent. Two saved runs can be compared without running:
+
+    python -m scripts.benchmarks.e2e --rows 10000 100000 --columns 8 32 --output e2e.json
+    python -m scripts.benchmarks.e2e --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from scripts.benchmarks.common import (
+    SYNTHETIC_HEADER, HttpSession, peak_rss_mb, percentile, print_table, remove_database, run_worker,
+    scratch_path, setup_django, synthetic_row, wait_for_server,
+)
+
+
+QUESTIONS = [
+    'show the table',
+    'count rows by city',
+    'average amount by department',
+    'total amount per city',
+    'top 10 by amount',
+    'max age by department',
+    'how many columns are there',
+    'hello',
+]
+TAGS = ['alpha', 'beta', 'gamma', 'delta']
+RESULT_FORMAT_VERSION = 1
+
+
+def synthetic_header(columns):
+    """SYNTHETIC_HEADER widened (or cut) to ``columns`` columns."""
+    extra = [f'tag_{k}' if k % 3 == 0 else f'metric_{k}' for k in range(max(0, columns - len(SYNTHETIC_HEADER)))]
+    return (SYNTHETIC_HEADER + extra)[:columns]
+
+
+def synthetic_rows(rows, columns, seed):
+    rng = random.Random(seed)
+    for i in range(rows):
+        row = synthetic_row(i, rng)
+        for k in range(max(0, columns - len(row))):
+            row.append(rng.choice(TAGS) if k % 3 == 0 else round(rng.uniform(0, 1000), 3))
+        yield row[:columns]
+
+
+def write_dataset(path, file_format, rows, columns, seed=0):
+    """Write a synthetic CSV or Excel file of ``rows`` x ``columns`` to ``path``."""
+    header = synthetic_header(columns)
+    if file_format == 'xlsx':
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(header)
+        for row in synthetic_rows(rows, columns, seed):
+            sheet.append(row)
+        workbook.save(path)
+    else:
+        import csv
+
+        with open(path, 'w', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(header)
+            writer.writerows(synthetic_rows(rows, columns, seed))
+    return path
+
+
+class ClientDriver:
+    """Requests through django.test.Client in this process."""
+
+    def __init__(self):
+        from django.test import Client
+
+        self.client = Client()
+
+    @staticmethod
+    def _result(response):
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+            body = b''
+        else:
+            size, body = len(response.content), response.content
+        return response.status_code, response.get('Location', ''), size, body
+
+    def get(self, path, params=None):
+        return self._result(self.client.get(path, params or {}))
+
+    def post(self, path, data, file_path=None):
+        if file_path is None:
+            return self._result(self.client.post(path, data))
+        with open(file_path, 'rb') as fh:
+            return self._result(self.client.post(path, dict(data, file=fh)))
+
+
+class ServerDriver:
+    """Requests over HTTP to a live server."""
+
+    def __init__(self, base_url):
+        self.session = HttpSession(base_url)
+        wait_for_server(self.session)
+        self.session.fetch_csrf_token()
+
+    def get(self, path, params=None):
+        if params:
+            path += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        status, headers, body = self.session.request(path)
+        return status, headers.get('Location', ''), len(body), body
+
+    def post(self, path, data, file_path=None):
+        files = {'file': file_path} if file_path else None
+        status, headers, body = self.session.request(path, data, files=files)
+        return status, headers.get('Location', ''), len(body), body
+
+
+class Stage:
+    """Latencies and volumes of one stage of a case."""
+
+    def __init__(self):
+        self.latencies = []
+        self.rows = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def call(self, request, expected_status, rows=0):
+        start = time.perf_counter()
+        status, location, size, body = request()
+        self.latencies.append(time.perf_counter() - start)
+        if status != expected_status:
+            self.errors += 1
+        self.rows += rows
+        self.bytes += size
+        return location, body
+
+    def summary(self):
+        seconds = sum(self.latencies)
+        return {
+            'count': len(self.latencies),
+            'errors': self.errors,
+            'seconds': round(seconds, 4),
+            'ops_per_sec': round(len(self.latencies) / seconds, 2) if seconds else 0,
+            'rows_per_sec': int(self.rows / seconds) if seconds and self.rows else None,
+            'mb_per_sec': round(self.bytes / (1024 * 1024) / seconds, 2) if seconds and self.bytes else None,
+            'p50_ms': round(percentile(self.latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(self.latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(self.latencies, 99) * 1000, 2),
+        }
+
+
+def process_peak_rss_mb(pid):
+    """Highest peak RSS of ``pid`` and its children (Linux /proc), or None."""
+    peaks = []
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as fh:
+                match = re.search(r'^VmHWM:\s+(\d+) kB', fh.read(), re.M)
+            with open(f'/proc/{current}/task/{current}/children') as fh:
+                pending.extend(int(child) for child in fh.read().split())
+        except OSError:
+            continue
+        if match:
+            peaks.append(int(match.group(1)) / 1024)
+    return round(max(peaks), 1) if peaks else None
+
+
+def start_server(case, db_path):
+    from scripts.benchmarks.asgi import server_command
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{db_path}',
+        LLM_PROVIDER='offline',
+        OFFLINE_LLM_LATENCY=str(case['llm_latency']),
+        DEBUG='True',
+        ALLOWED_HOSTS='127.0.0.1,localhost',
+    )
+    # Let each deployment pick its own view (asgi.py defaults this to True)
+    env.pop('ASYNC_QUERY_VIEWS', None)
+    command = server_command(case['server'], case['port'], wsgi_workers=1)
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+
+
+def run_case(case, db_path):
+    """Drive one synthetic file through the app; prints the case's JSON result."""
+    live = case['server'] != 'client'
+    setup_django(db_path, migrate=True, test_client=not live)
+    from django.conf import settings
+    from query_app.db import analytics_connection
+    from query_app.models import Conversation, Dataset
+    from query_app.views import get_dataset_profile
+
+    settings.LLM_PROVIDER = 'offline'
+    settings.OFFLINE_LLM_LATENCY = case['llm_latency']
+    server = start_server(case, db_path) if live else None
+    stages = {}
+    dataset = None
+
+    def stage(name):
+        return stages.setdefault(name, Stage())
+
+    try:
+        driver = ServerDriver(f'http://127.0.0.1:{case["port"]}') if live else ClientDriver()
+        rows, repeat = case['rows'], case['repeat']
+
+        location, _ = stage('upload').call(
+            lambda: driver.post('/process_query/', {'upload_mode': 'new'}, case['file']), 302, rows=rows
+        )
+        match = re.search(r'dataset=(\d+)', location)
+        if not match:
+            raise RuntimeError(f'Upload of {case["file"]} failed')
+        dataset = Dataset.objects.get(id=int(match.group(1)))
+        table = dataset.table_name
+
+        for _ in range(repeat):
+            stage('page_load').call(lambda: driver.get('/query/', {'dataset': dataset.id}), 200)
+
+        for round_number in range(repeat):
+            name = 'question_cold' if round_number == 0 else 'question'
+            for question in QUESTIONS:
+                stage(name).call(
+                    lambda: driver.post('/process_query/', {'query': question, 'dataset': dataset.id}), 302
+                )
+
+        sql = f'SELECT * FROM "{table}"'
+        columns = [column['name'] for column in dataset.columns]
+        conversation = Conversation.objects.create(
+            dataset=dataset, user_query='benchmark', sql_query=sql, response='',
+            result_sql=sql, result_columns=columns, result_has_more=True,
+        )
+        page_size = settings.RESULT_PAGE_SIZE
+        pages = max(1, min(repeat, rows // page_size))
+        for page in range(1, pages + 1):
+            stage('result_page').call(
+                lambda: driver.get(f'/conversations/{conversation.id}/results/', {'page': page}), 200,
+                rows=min(page_size, rows - (page - 1) * page_size),
+            )
+
+        # The visualize view's reads: preview rows and a rebuilt column profile
+        for _ in range(repeat):
+            def visualize():
+                with analytics_connection().cursor() as cursor:
+                    cursor.execute(f'SELECT * FROM "{table}" LIMIT 1000')
+                    cursor.fetchall()
+                dataset.profile = None
+                get_dataset_profile(dataset)
+                return 200, '', 0, b''
+            stage('visualize').call(visualize, 200, rows=rows)
+
+        for export_format in case['exports']:
+            stage(f'export_{export_format}').call(
+                lambda: driver.get(f'/conversations/{conversation.id}/export/', {'format': export_format}), 200,
+                rows=rows,
+            )
+    finally:
+        # The upload kept a copy of the file under MEDIA_ROOT
+        if dataset is not None and dataset.file:
+            dataset.file.delete(save=False)
+        if server is not None:
+            peak = process_peak_rss_mb(server.pid)
+            server.terminate()
+            server.wait()
+
+    print(json.dumps({
+        'name': case['name'],
+        'format': case['format'],
+        'rows': rows,
+        'columns': case['columns'],
+        'server': case['server'],
+        'file_mb': round(os.path.getsize(case['file']) / (1024 * 1024), 2),
+        'peak_rss_mb': peak if live else round(peak_rss_mb(), 1),
+        'stages': {name: recorded.summary() for name, recorded in stages.items()},
+    }))
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(['git', *args], capture_output=True, text=True).stdout.strip()
+    return {
+        'commit': git('rev-parse', 'HEAD') or None,
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+    }
+
+
+def run_cases(args):
+    results = []
+    for file_format in args.formats:
+        for rows in args.rows:
+            for columns in args.columns:
+                name = f'{file_format}-{rows}x{columns}'
+                file_path = write_dataset(scratch_path(f'.{file_format}'), file_format, rows, columns, seed=args.seed)
+                db_path = scratch_path('.sqlite3')
+                case = {
+                    'name': name, 'format': file_format, 'rows': rows, 'columns': columns, 'file': file_path,
+                    'server': args.server, 'port': args.port, 'llm_latency': args.llm_latency,
+                    'repeat': args.repeat, 'exports': args.exports,
+                }
+                try:
+                    results.append(run_worker('scripts.benchmarks.e2e', ['--worker', json.dumps(case), db_path]))
+                finally:
+                    os.remove(file_path)
+                    remove_database(db_path)
+                print(f'{name}: done', file=sys.stderr)
+    return {
+        'benchmark': 'e2e',
+        'version': RESULT_FORMAT_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        **git_revision(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'config': {
+            'server': args.server, 'llm_latency': args.llm_latency, 'repeat': args.repeat,
+            'seed': args.seed, 'questions': QUESTIONS,
+        },
+        'cases': results,
+    }
+
+
+def print_results(report):
+    rows = []
+    for case in report['cases']:
+        for name, summary in case['stages'].items():
+            rows.append(dict(summary, case=case['name'], stage=name, peak_rss_mb=case['peak_rss_mb']))
+    print(f"{report['commit'] or 'unknown commit'}{' (dirty)' if report['dirty'] else ''}, "
+          f"{report['environment']['cpus']} CPUs, server={report['config']['server']}, "
+          f"llm_latency={report['config']['llm_latency']}s")
+    print_table(rows, ['case', 'stage', 'count', 'errors', 'ops_per_sec', 'rows_per_sec', 'p50_ms', 'p95_ms',
+                       'p99_ms', 'peak_rss_mb'])
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(baseline, current, threshold):
+    """Print the change of every stage from ``baseline``; returns True when one regressed past ``threshold``."""
+    base_stages = {
+        (case['name'], name): summary
+        for case in baseline['cases'] for name, summary in case['stages'].items()
+    }
+    base_rss = {case['name']: case['peak_rss_mb'] for case in baseline['cases']}
+    rows, regressed = [], False
+    for case in current['cases']:
+        for name, summary in case['stages'].items():
+            before = base_stages.get((case['name'], name))
+            if before is None:
+                continue
+            p50, p95 = change(before['p50_ms'], summary['p50_ms']), change(before['p95_ms'], summary['p95_ms'])
+            throughput = change(before['ops_per_sec'], summary['ops_per_sec'])
+            rss = change(base_rss.get(case['name']), case['peak_rss_mb'])
+            slower = (p95 or 0) > threshold or (throughput or 0) < -threshold
+            regressed = regressed or slower
+            rows.append({
+                'case': case['name'],
+                'stage': name,
+                'p50_ms': f"{before['p50_ms']} -> {summary['p50_ms']}" + (f' ({p50:+.0f}%)' if p50 is not None else ''),
+                'p95_ms': f"{before['p95_ms']} -> {summary['p95_ms']}" + (f' ({p95:+.0f}%)' if p95 is not None else ''),
+                'ops_per_sec': f'{throughput:+.0f}%' if throughput is not None else '',
+                'peak_rss': f'{rss:+.0f}%' if rss is not None else '',
+                'verdict': 'REGRESSION' if slower else '',
+            })
+    print(f"baseline {(baseline['commit'] or '?')[:12]} vs {(current['commit'] or '?')[:12]}")
+    print_table(rows, ['case', 'stage', 'p50_ms', 'p95_ms', 'ops_per_sec', 'peak_rss', 'verdict'])
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--columns', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--formats', nargs='+', choices=['csv', 'xlsx'], default=['csv', 'xlsx'])
+    parser.add_argument('--server', choices=['client', 'wsgi', 'asgi'], default='client')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='Seconds the stub model sleeps per call')
+    parser.add_argument('--repeat', type=int, default=5, help='Rounds of questions, page loads and result pages')
+    parser.add_argument('--exports', nargs='*', choices=['csv', 'ndjson', 'parquet'], default=['csv', 'ndjson', 'parquet'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help='Baseline results to compare with (and saved current results instead of running)')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Percent a p95 may grow (or throughput drop) before it counts as a regression')
+    parser.add_argument('--worker', nargs=2, metavar=('CASE', 'DB'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_case(json.loads(args.worker[0]), args.worker[1])
+        return
+
+    if args.compare and len(args.compare) > 1:
+        with open(args.compare[1]) as fh:
+            report = json.load(fh)
+    else:
+        report = run_cases(args)
+        print_results(report)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    if args.compare:
+        with open(args.compare[0]) as fh:
+            baseline = json.load(fh)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Typical generated queries on SQLite vs DuckDB over Parquet snapshots.
+
+For each ``--rows`` size a synthetic dataset is ingested into a scratch
+analytics database and its columnar snapshot is built (both timed). Each
+query below, written in the SQLite dialect the model produces, then runs
+through execute_sql_statements on SQLite and through the columnar engine;
+the best of ``--repeat`` runs is reported, with whether both engines returned
+the same rows. "fallback" means DuckDB could not run the query and it would
+have gone to SQLite. The last row rebuilds the column profile shown on the
+visualize page from the table and from the snapshot.
+
+    python -m scripts.benchmarks.engines --rows 1000000 10000000
+"""
+import argparse
+import datetime
+import decimal
+import os
+import time
+
+from scripts.benchmarks.common import create_dataset, print_table, remove_database, scratch_path, setup_django
+
+
+# (label, SQL with {table} for the table name)
+QUERIES = [
+    ('count with filter', 'SELECT COUNT(*) FROM "{table}" WHERE "age" > 30 AND "active" = 1'),
+    ('sum/avg amount', 'SELECT SUM("amount"), AVG("amount") FROM "{table}"'),
+    ('group by city', 'SELECT "city", COUNT(*) AS orders, AVG("amount") AS avg_amount FROM "{table}" '
+                      'GROUP BY "city" ORDER BY avg_amount DESC'),
+    ('group by 2 columns', 'SELECT "department", "city", SUM("amount") AS total FROM "{table}" '
+                           'GROUP BY "department", "city" ORDER BY total DESC'),
+    ('monthly totals', 'SELECT strftime(\'%Y-%m\', "order_date") AS month, SUM("amount") FROM "{table}" '
+                       'GROUP BY month ORDER BY month'),
+    ('date range', 'SELECT COUNT(*), AVG("amount") FROM "{table}" '
+                   'WHERE "order_date" BETWEEN \'2021-01-01\' AND \'2021-12-31\''),
+    ('age bands', 'SELECT ("age" / 10) * 10 AS band, COUNT(*) FROM "{table}" GROUP BY band ORDER BY band'),
+    ('top 10 by amount', 'SELECT "name", "city", "amount" FROM "{table}" ORDER BY "amount" DESC, "id" LIMIT 10'),
+    ('distinct count', 'SELECT COUNT(DISTINCT "name") FROM "{table}"'),
+    ('LIKE filter', 'SELECT "city", COUNT(*) FROM "{table}" WHERE "city" LIKE \'%ON%\' GROUP BY "city"'),
+    ('matching rows', 'SELECT * FROM "{table}" WHERE "amount" > 9990'),
+]
+
+
+def normalize(rows):
+    """Rows in a comparable form: floats rounded, dates as ISO text, order ignored."""
+    def value(v):
+        if isinstance(v, (float, decimal.Decimal)):
+            return round(float(v), 2)
+        if isinstance(v, (datetime.date, datetime.datetime)):
+            return v.isoformat(sep=' ') if isinstance(v, datetime.datetime) else v.isoformat()
+        return v
+    return sorted((tuple(value(v) for v in row) for row in rows), key=repr)
+
+
+def best_of(fn, repeat):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def directory_mb(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / 1e6
+
+
+def run(rows, repeat):
+    from django.conf import settings
+    from query_app import columnar
+    from query_app.column_stats import profile_table
+    from query_app.views import execute_sql_statements
+
+    start = time.perf_counter()
+    dataset = create_dataset(rows, name=f'engines_{rows}.csv')
+    ingest_s = time.perf_counter() - start
+    table = dataset.table_name
+    start = time.perf_counter()
+    columnar.build_snapshot(table)
+    snapshot_s = time.perf_counter() - start
+    print(f'{rows} rows: ingest {ingest_s:.1f}s, snapshot build {snapshot_s:.1f}s, '
+          f'snapshot {directory_mb(columnar.snapshot_path(table)):.1f}MB')
+
+    max_rows = settings.RESULT_PAGE_SIZE + 1
+    results = []
+    for label, template in QUERIES:
+        sql = template.replace('{table}', table)
+        settings.QUERY_ENGINE = 'sqlite'
+        sqlite_s, (_, sqlite_rows, _, _) = best_of(lambda: execute_sql_statements([sql], max_rows=max_rows), repeat)
+        settings.QUERY_ENGINE = 'duckdb'
+        duckdb_s, duckdb_result = best_of(lambda: columnar.run_select(sql, [table], max_rows), repeat)
+        ran = duckdb_result is not None
+        results.append({
+            'rows': rows,
+            'query': label,
+            'sqlite_ms': round(sqlite_s * 1000, 1),
+            'duckdb_ms': round(duckdb_s * 1000, 1) if ran else 'fallback',
+            'speedup': f'{sqlite_s / duckdb_s:.1f}x' if ran and duckdb_s else '-',
+            'same_rows': (normalize(sqlite_rows) == normalize(duckdb_result[0])) if ran else '-',
+        })
+
+    column_types = {c['name']: c['type'] for c in dataset.columns}
+    settings.QUERY_ENGINE = 'sqlite'
+    sqlite_s, sqlite_profile = best_of(lambda: profile_table(table, column_types), 1)
+    settings.QUERY_ENGINE = 'duckdb'
+    duckdb_s, duckdb_profile = best_of(lambda: profile_table(table, column_types), 1)
+    results.append({
+        'rows': rows,
+        'query': 'profile rebuild',
+        'sqlite_ms': round(sqlite_s * 1000, 1),
+        'duckdb_ms': round(duckdb_s * 1000, 1),
+        'speedup': f'{sqlite_s / duckdb_s:.1f}x',
+        'same_rows': sqlite_profile == duckdb_profile,
+    })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path, migrate=True)
+        results = []
+        for rows in args.rows:
+            results.extend(run(rows, args.repeat))
+        print(f'{os.cpu_count()} CPUs')
+        print_table(results, ['rows', 'query', 'sqlite_ms', 'duckdb_ms', 'speedup', 'same_rows'])
+    finally:
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Result export benchmark: streaming CSV/NDJSON/Parquet vs materializing the result.
+
+A synthetic table is ingested once into a scratch database; each format then
+runs in its own interpreter (so peak RSS belongs to that export alone) and
+downloads ``SELECT *`` through the export endpoint. "materialized" is the
+naive alternative for reference: fetchall into a DataFrame and to_csv.
+
+    python -m scripts.benchmarks.export --rows 1000000 --formats csv ndjson parquet materialized
+"""
+import argparse
+import json
+import time
+
+from scripts.benchmarks.common import (
+    create_dataset, peak_rss_mb, print_table, remove_database, run_worker, scratch_path, setup_django,
+)
+
+
+def worker(export_format, db_path):
+    setup_django(db_path, test_client=True)
+    from django.test import Client
+    from query_app.db import analytics_connection
+    from query_app.models import Conversation, Dataset
+
+    dataset = Dataset.objects.get()
+    sql = f'SELECT * FROM "{dataset.table_name}"'
+    connection = analytics_connection()
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) FROM "{dataset.table_name}"')
+        rows = cursor.fetchone()[0]
+    baseline_rss = peak_rss_mb()
+
+    start = time.perf_counter()
+    if export_format == 'materialized':
+        import pandas as pd
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            columns = [col[0] for col in cursor.description]
+            df = pd.DataFrame(cursor.fetchall(), columns=columns)
+        size = len(df.to_csv(index=False).encode())
+    else:
+        conversation = Conversation.objects.create(dataset=dataset, user_query='export', sql_query=sql, response='')
+        response = Client().get(f'/conversations/{conversation.id}/export/', {'format': export_format})
+        assert response.status_code == 200, response.status_code
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        'format': export_format,
+        'rows': rows,
+        'output_mb': round(size / (1024 * 1024), 1),
+        'seconds': round(elapsed, 2),
+        'rows_per_sec': int(rows / elapsed) if elapsed else 0,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'rss_growth_mb': round(peak_rss_mb() - baseline_rss, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    parser.add_argument('--formats', nargs='+', default=['csv', 'ndjson', 'parquet', 'materialized'])
+    parser.add_argument('--worker', nargs=2, metavar=('FORMAT', 'DB'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    results = []
+    for rows in args.rows:
+        db_path = scratch_path('.sqlite3')
+        try:
+            setup_django(db_path, migrate=True)
+            from query_app.models import Dataset
+            Dataset.objects.all().delete()
+            create_dataset(rows)
+            for export_format in args.formats:
+                results.append(run_worker('scripts.benchmarks.export', ['--worker', export_format, db_path]))
+        finally:
+            remove_database(db_path)
+
+    print_table(results, ['format', 'rows', 'output_mb', 'seconds', 'rows_per_sec', 'peak_rss_mb', 'rss_growth_mb'])
+
+
+if __name__ == '__main__':
+    main()
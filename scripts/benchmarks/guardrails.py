@@ -0,0 +1,99 @@
+"""
+Overhead of the query guardrails, and how fast they stop runaway queries.
+
+A synthetic dataset of ``--rows`` rows is ingested into a scratch analytics
+database. The typical generated queries from the engines benchmark then run
+through execute_sql_statements without guardrails (no cost check, LIMIT or
+time limit) and with the defaults, alternately; the best of ``--repeat``
+runs is reported. Then a cross join (refused by the cost check), an unbounded
+recursive query (stopped by the time limit) and the same query in a
+cancelled job show how long each takes to fail.
+
+    python -m scripts.benchmarks.guardrails --rows 1000000
+"""
+import argparse
+import os
+import threading
+import time
+
+from scripts.benchmarks.common import create_dataset, print_table, remove_database, scratch_path, setup_django
+from scripts.benchmarks.engines import QUERIES, best_of
+
+RUNAWAY_SQL = 'WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT COUNT(*) FROM n'
+
+
+def time_failure(fn):
+    start = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        return time.perf_counter() - start, type(e).__name__
+    return time.perf_counter() - start, 'finished'
+
+
+def run(rows, repeat, timeout):
+    from django.conf import settings
+    from query_app.guardrails import get_query_limits, request_cancel
+    from query_app.views import execute_sql_statements
+
+    table = create_dataset(rows, name=f'guardrails_{rows}.csv').table_name
+    unguarded = {'timeout': 0, 'max_rows': 0, 'max_cost': 0}
+    guarded = dict(get_query_limits(), timeout=timeout)
+    max_rows = settings.RESULT_PAGE_SIZE + 1
+
+    results = []
+    for label, template in QUERIES:
+        sql = template.replace('{table}', table)
+        # Interleaved, so both see the same cache state
+        off_timings, on_timings = [], []
+        for _ in range(repeat):
+            for timings, limits in ((off_timings, unguarded), (on_timings, guarded)):
+                timings.append(best_of(lambda: execute_sql_statements([sql], max_rows=max_rows, limits=limits), 1)[0])
+        off_s, on_s = min(off_timings), min(on_timings)
+        results.append({
+            'rows': rows,
+            'query': label,
+            'off_ms': round(off_s * 1000, 1),
+            'on_ms': round(on_s * 1000, 1),
+            'overhead': f'{(on_s / off_s - 1) * 100:+.1f}%',
+        })
+
+    cross_join = f'SELECT COUNT(*) FROM "{table}" a, "{table}" b'
+    failures = [
+        ('cross join', lambda: execute_sql_statements([cross_join], limits=guarded)),
+        ('runaway query', lambda: execute_sql_statements([RUNAWAY_SQL], limits=guarded)),
+    ]
+    cancel_after = timeout / 4
+
+    def cancelled_job():
+        threading.Timer(cancel_after, request_cancel, ['benchmark-job']).start()
+        execute_sql_statements([RUNAWAY_SQL], limits=dict(guarded, timeout=0), job_id='benchmark-job')
+
+    failures.append((f'cancelled after {cancel_after:g}s', cancelled_job))
+    for label, fn in failures:
+        elapsed, outcome = time_failure(fn)
+        results.append({'rows': rows, 'query': label, 'on_ms': round(elapsed * 1000, 1), 'overhead': outcome})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=5, help="QUERY_TIMEOUT for the guarded runs")
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path, migrate=True)
+        results = []
+        for rows in args.rows:
+            results.extend(run(rows, args.repeat, args.timeout))
+        print(f'{os.cpu_count()} CPUs')
+        print_table(results, ['rows', 'query', 'off_ms', 'on_ms', 'overhead'])
+    finally:
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Chat page load time as the conversation history grows: full history vs paginated.
+
+A dataset is given ``--turns`` stored conversations, each answered with a
+``--result-rows``-row HTML table; every tenth one holds a ``--large-rows``-row
+table, like replies stored before results were paged. "full" renders every
+turn with its whole reply (the previous behaviour, reproduced by lifting the
+page size and collapse limits); "paginated" is the current page.
+
+    python -m scripts.benchmarks.history --turns 100 1000 5000
+"""
+import argparse
+import statistics
+import time
+
+from scripts.benchmarks.common import (
+    create_dataset, percentile, print_table, remove_database, scratch_path, setup_django,
+)
+
+
+def result_html(rows):
+    import pandas as pd
+
+    df = pd.DataFrame({'id': range(rows), 'name': [f'customer {i}' for i in range(rows)], 'amount': range(rows)})
+    return f"<p>Here's your data:</p>{df.to_html(index=False, classes='result-table')}"
+
+
+def fill_history(dataset, turns, result_rows, large_rows):
+    from django.db import transaction
+    from query_app.models import Conversation
+
+    Conversation.objects.filter(dataset=dataset).delete()
+    small, large = result_html(result_rows), result_html(large_rows)
+    sql = f'SELECT * FROM "{dataset.table_name}"'
+    with transaction.atomic():
+        Conversation.objects.bulk_create(
+            Conversation(
+                dataset=dataset, user_query=f'question {i}', sql_query=sql,
+                response=large if i % 10 == 0 else small,
+            )
+            for i in range(turns)
+        )
+
+
+def run(mode, dataset, turns, repeat):
+    from django.conf import settings
+    from django.test import Client
+
+    page_size, collapse_chars = settings.CONVERSATION_PAGE_SIZE, settings.CONVERSATION_COLLAPSE_CHARS
+    if mode == 'full':
+        settings.CONVERSATION_PAGE_SIZE = settings.CONVERSATION_COLLAPSE_CHARS = 10 ** 9
+    client = Client()
+    latencies = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get('/query/', {'dataset': dataset.id})
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+    finally:
+        settings.CONVERSATION_PAGE_SIZE, settings.CONVERSATION_COLLAPSE_CHARS = page_size, collapse_chars
+
+    return {
+        'mode': mode,
+        'turns': turns,
+        'page_kb': round(len(response.content) / 1024, 1),
+        'median_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--result-rows', type=int, default=50)
+    parser.add_argument('--large-rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--modes', nargs='+', default=['full', 'paginated'])
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path, migrate=True, test_client=True)
+        dataset = create_dataset(1000)
+        results = []
+        for turns in args.turns:
+            fill_history(dataset, turns, args.result_rows, args.large_rows)
+            for mode in args.modes:
+                results.append(run(mode, dataset, turns, args.repeat))
+        print_table(results, ['mode', 'turns', 'page_kb', 'median_ms', 'p95_ms'])
+    finally:
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Page view latency on a large metadata database, with and without the access-path indexes.
+
+A scratch database gets ``--datasets`` Dataset rows spread over ``--users``
+users and ``--conversations`` Conversation rows spread over the datasets of
+the first user, whose pages and individual lookups are then timed. "before" migrates back to
+0008 (without the access-path indexes of 0009); "after" is the current
+schema. ``--explain`` also prints the ``explain_queries`` audit of each.
+
+    python -m scripts.benchmarks.indexes --datasets 10000 --conversations 100000
+"""
+import argparse
+import statistics
+import time
+
+from scripts.benchmarks.common import percentile, print_table, remove_database, scratch_path, setup_django
+
+
+def build_database(dataset_count, user_count, conversation_count):
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from query_app.models import Conversation, Dataset
+
+    with transaction.atomic():
+        users = User.objects.bulk_create(User(username=f'bench_user_{i}') for i in range(user_count))
+        datasets = Dataset.objects.bulk_create(
+            Dataset(
+                user=users[i % user_count], name=f'table_{i}.csv', table_name=f'table_{i}',
+                database_group=f'database_{i // 5}', columns=[{'name': 'id', 'type': 'INTEGER'}],
+                file=f'datasets/table_{i}.csv',
+            )
+            for i in range(dataset_count)
+        )
+        owned = [ds for ds in datasets if ds.user_id == users[0].id]
+        batch = []
+        for i in range(conversation_count):
+            batch.append(Conversation(
+                dataset=owned[i % len(owned)], user_query=f'question {i}',
+                sql_query=f'SELECT * FROM "{owned[i % len(owned)].table_name}" LIMIT 10',
+                response="<p>Here's your data:</p><table class=\"result-table\"></table>",
+            ))
+            if len(batch) == 10000:
+                Conversation.objects.bulk_create(batch)
+                batch = []
+        Conversation.objects.bulk_create(batch)
+    return users[0], owned[0]
+
+
+def timed(mode, name, func, repeat):
+    func()  # warm-up: templates, connection, catalog caches
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return {
+        'mode': mode,
+        'target': name,
+        'median_ms': round(statistics.median(latencies) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+    }
+
+
+def run(mode, user, dataset, repeat):
+    from django.core.management import call_command
+    from django.test import Client
+    from query_app.models import Conversation, Dataset
+    from query_app.schema_catalog import group_datasets
+    from query_app.views import get_conversation_page
+
+    if mode == 'before':
+        call_command('migrate', 'query_app', '0008_dataset_database_group', verbosity=0)
+
+    latest = Conversation.objects.filter(dataset=dataset).order_by('-id').first()
+    client = Client()
+    client.force_login(user)
+    pages = {
+        'chat page': f'/query/?dataset={dataset.id}',
+        'older turns': f'/conversations/?dataset={dataset.id}&before={latest.id}',
+        'upload page': '/upload/',
+    }
+    lookups = {
+        'datasets by name': lambda: Dataset.objects.filter(user=user).order_by('name').first(),
+        'dataset by table': lambda: Dataset.objects.filter(user=user, table_name=dataset.table_name).first(),
+        'database tables': lambda: list(group_datasets(dataset).only('table_name', 'columns', 'profile')),
+        'history page': lambda: get_conversation_page(dataset, latest.id),
+    }
+    results = [timed(mode, page, lambda url=url: client.get(url), repeat) for page, url in pages.items()]
+    results += [timed(mode, name, func, repeat) for name, func in lookups.items()]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--conversations', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--explain', action='store_true', help='Print the explain_queries audit for each mode')
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path, migrate=True, test_client=True)
+        from django.core.management import call_command
+
+        # No ANALYZE: like a default deployment, the planner has no table statistics
+        user, dataset = build_database(args.datasets, args.users, args.conversations)
+        results = []
+        for mode in ('after', 'before'):
+            if args.explain:
+                print(f'--- explain_queries ({mode}) ---')
+            results += run(mode, user, dataset, args.repeat)
+            if args.explain:
+                call_command('explain_queries', dataset=dataset.id)
+        print_table(results, ['mode', 'target', 'median_ms', 'p95_ms'])
+    finally:
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Upload ingestion benchmark: legacy read-everything + to_sql vs streaming ingest.
+
+Each (path, size) pair runs in its own interpreter so the reported peak RSS
+belongs to that path alone.
+
+    python -m scripts.benchmarks.ingest --rows 1000000 10000000
+"""
+import argparse
+import json
+import os
+import time
+
+from scripts.benchmarks.common import (
+    peak_rss_mb, print_table, remove_database, run_worker, scratch_path, setup_django, write_synthetic_csv,
+)
+
+
+def _legacy_ingest(path, table_name):
+    """The original process_file_upload path: pd.read_csv + a single to_sql."""
+    import pandas as pd
+    from query_app.db import analytics_connection
+
+    connection = analytics_connection()
+    df = pd.read_csv(path)
+    with connection.cursor():
+        df.to_sql(table_name, connection.connection, if_exists='replace', index=False)
+    return len(df)
+
+
+def _streaming_ingest(path, table_name):
+    from query_app.ingest import ingest_file
+
+    with open(path, 'rb') as fh:
+        _, rows, _ = ingest_file(fh, table_name)
+    return rows
+
+
+def worker(mode, csv_path):
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path)
+        start = time.perf_counter()
+        if mode == 'legacy':
+            rows = _legacy_ingest(csv_path, 'bench_table')
+        else:
+            rows = _streaming_ingest(csv_path, 'bench_table')
+        elapsed = time.perf_counter() - start
+    finally:
+        remove_database(db_path)
+    print(json.dumps({
+        'mode': mode,
+        'rows': rows,
+        'seconds': round(elapsed, 2),
+        'rows_per_sec': int(rows / elapsed) if elapsed else 0,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--modes', nargs='+', default=['legacy', 'streaming'])
+    parser.add_argument('--worker', nargs=2, metavar=('MODE', 'CSV'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    results = []
+    for rows in args.rows:
+        csv_path = write_synthetic_csv(scratch_path('.csv'), rows)
+        try:
+            size_mb = round(os.path.getsize(csv_path) / (1024 * 1024), 1)
+            for mode in args.modes:
+                result = run_worker('scripts.benchmarks.ingest', ['--worker', mode, csv_path])
+                result['file_mb'] = size_mb
+                results.append(result)
+        finally:
+            os.remove(csv_path)
+
+    print_table(results, ['mode', 'rows', 'file_mb', 'seconds', 'rows_per_sec', 'peak_rss_mb'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Throughput of slow questions under gunicorn: answering in the request vs job mode.
+
+Starts gunicorn (sync workers, as in the Procfile) against a scratch database
+with the offline LLM provider sleeping ``--delay`` seconds per call, then fires
+``--concurrency`` questions at once. "sync" posts to /process_query/, which
+holds a worker until the answer is saved; "async" posts to
+/process_query/async/ and polls the job status, as the chat page does under
+sync workers (it only follows the events stream under ASGI). While the questions run, a
+probe thread keeps loading /query/ to show how responsive the site stays.
+
+    python -m scripts.benchmarks.jobs --concurrency 50 --delay 1 --workers 2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.benchmarks.common import (
+    HttpSession, create_dataset, percentile, print_table, remove_database, scratch_path, setup_django,
+    wait_for_server,
+)
+
+
+def ask_sync(session, dataset_id, question):
+    status, _, _ = session.request('/process_query/', {'query': question, 'dataset': dataset_id})
+    return status == 302
+
+
+def ask_async(session, dataset_id, question, poll_interval):
+    status, _, body = session.request('/process_query/async/', {'query': question, 'dataset': dataset_id})
+    if status not in (200, 202):
+        return False
+    job = json.loads(body)
+    if 'status_url' not in job:
+        return True
+    while True:
+        time.sleep(poll_interval)
+        _, _, body = session.request(job['status_url'])
+        state = json.loads(body)['status']
+        if state in ('done', 'failed'):
+            return state == 'done'
+
+
+def run(mode, session, dataset_id, concurrency, poll_interval):
+    probe_latencies = []
+    stop = threading.Event()
+
+    def probe():
+        while not stop.is_set():
+            start = time.perf_counter()
+            session.request(f'/query/?dataset={dataset_id}')
+            probe_latencies.append(time.perf_counter() - start)
+            time.sleep(0.1)
+
+    # Distinct questions so the SQL cache can't answer any of them
+    questions = [f'show the rows for customer {mode}-{i}' for i in range(concurrency)]
+    probe_thread = threading.Thread(target=probe)
+    probe_thread.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if mode == 'sync':
+            ok = list(pool.map(lambda q: ask_sync(session, dataset_id, q), questions))
+        else:
+            ok = list(pool.map(lambda q: ask_async(session, dataset_id, q, poll_interval), questions))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    probe_thread.join()
+
+    return {
+        'mode': mode,
+        'answered': f'{sum(ok)}/{len(ok)}',
+        'seconds': f'{elapsed:.1f}',
+        'questions/s': f'{sum(ok) / elapsed:.2f}',
+        'page p50 (ms)': f'{percentile(probe_latencies, 50) * 1000:.0f}',
+        'page p95 (ms)': f'{percentile(probe_latencies, 95) * 1000:.0f}',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--delay', type=float, default=1.0, help='Seconds the stub model sleeps per call')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn sync workers')
+    parser.add_argument('--job-workers', type=int, default=16, help='QUERY_JOB_WORKERS per gunicorn worker')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--poll-interval', type=float, default=0.25)
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    setup_django(db_path, migrate=True)
+    dataset = create_dataset(1000)
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{db_path}',
+        LLM_PROVIDER='offline',
+        OFFLINE_LLM_LATENCY=str(args.delay),
+        QUERY_JOB_WORKERS=str(args.job_workers),
+        DEBUG='True',
+        ALLOWED_HOSTS='127.0.0.1,localhost',
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'nlq_project.wsgi:application',
+         '-w', str(args.workers), '-b', f'127.0.0.1:{args.port}', '--timeout', '300', '--log-level', 'warning'],
+        env=env,
+    )
+    try:
+        session = HttpSession(f'http://127.0.0.1:{args.port}')
+        wait_for_server(session)
+        session.fetch_csrf_token()
+        results = [
+            run(mode, session, dataset.id, args.concurrency, args.poll_interval)
+            for mode in ('sync', 'async')
+        ]
+    finally:
+        server.terminate()
+        server.wait()
+        remove_database(db_path)
+
+    print(f'{args.concurrency} concurrent questions, {args.delay}s model latency, '
+          f'{args.workers} gunicorn sync workers')
+    print_table(results, ['mode', 'answered', 'seconds', 'questions/s', 'page p50 (ms)', 'page p95 (ms)'])
+
+
+if __name__ == '__main__':
+    main()
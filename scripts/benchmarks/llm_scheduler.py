@@ -0,0 +1,157 @@
+"""
+Model call scheduling: coalescing, fair queueing across users and rate limiting.
+
+Calls go to the offline provider, sleeping ``--delay`` seconds per call,
+from threads (and, for the async row, event-loop tasks) as views make them:
+
+- coalescing: ``--identical`` callers send the same prompt at once, with
+  LLM_COALESCE off and on; reports model calls made and the wall time
+- fairness: with LLM_MAX_CONCURRENCY=``--concurrency``, one user sends a
+  burst of ``--burst`` calls and a second user then sends ``--light`` calls.
+  "fifo" queues every call as the same user (one queue in arrival order);
+  "fair" queues them per user. Reports the light user's waits and when the
+  burst finished
+- rate limit: ``--rate-calls`` calls under LLM_RATE_PER_MINUTE=``--rate``
+  (burst LLM_RATE_BURST=5); reports the achieved calls a second
+
+    python -m scripts.benchmarks.llm_scheduler --delay 0.2 --concurrency 2 --burst 40 --light 4
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.benchmarks.common import percentile, print_table, setup_django
+
+
+def calls_for(user):
+    from query_app.llm import get_llm
+    from query_app.llm_scheduler import llm_user
+
+    def call(prompt):
+        start = time.perf_counter()
+        with llm_user(user):
+            get_llm().generate(prompt)
+        return time.perf_counter() - start, time.perf_counter()
+    return call
+
+
+def coalescing(identical):
+    from django.conf import settings
+    from query_app.llm import get_llm
+
+    results = []
+    for enabled in (False, True):
+        settings.LLM_COALESCE = enabled
+        llm = get_llm()
+        calls_before = llm.call_count
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=identical) as pool:
+            list(pool.map(calls_for(None), ['Classify this user message: "show the table"'] * identical))
+        results.append({
+            'scenario': f'coalescing {"on" if enabled else "off"}',
+            'calls': identical,
+            'model_calls': llm.call_count - calls_before,
+            'seconds': round(time.perf_counter() - start, 2),
+        })
+    settings.LLM_COALESCE = True
+    return results
+
+
+def fairness(mode, concurrency, burst, light, delay):
+    from django.conf import settings
+
+    settings.LLM_MAX_CONCURRENCY = concurrency
+    heavy_user, light_user = 1, (1 if mode == 'fifo' else 2)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=burst + light) as pool:
+        heavy = [pool.submit(calls_for(heavy_user), f'heavy {mode} {i}') for i in range(burst)]
+        # The light user asks just after the burst has queued
+        time.sleep(delay / 2)
+        light_calls = [pool.submit(calls_for(light_user), f'light {mode} {i}') for i in range(light)]
+        light_waits = [future.result()[0] for future in light_calls]
+        heavy_done = max(future.result()[1] for future in heavy) - start
+    settings.LLM_MAX_CONCURRENCY = 0
+    return summarize(f'fairness {mode}', light_waits, heavy_done, burst + light)
+
+
+async def afairness(concurrency, burst, light, delay):
+    from django.conf import settings
+    from query_app.llm import get_llm
+    from query_app.llm_scheduler import llm_user
+
+    settings.LLM_MAX_CONCURRENCY = concurrency
+    llm = get_llm()
+
+    async def call(user, prompt):
+        started = time.perf_counter()
+        with llm_user(user):
+            await llm.agenerate(prompt)
+        return time.perf_counter() - started, time.perf_counter()
+
+    start = time.perf_counter()
+    heavy = [asyncio.create_task(call(1, f'heavy async {i}')) for i in range(burst)]
+    await asyncio.sleep(delay / 2)
+    light_waits = [wait for wait, _ in await asyncio.gather(*(call(2, f'light async {i}') for i in range(light)))]
+    heavy_done = max(finished for _, finished in await asyncio.gather(*heavy)) - start
+    settings.LLM_MAX_CONCURRENCY = 0
+    return summarize('fairness fair (async)', light_waits, heavy_done, burst + light)
+
+
+def summarize(scenario, light_waits, heavy_done, calls):
+    return {
+        'scenario': scenario,
+        'calls': calls,
+        'light_p50_s': round(percentile(light_waits, 50), 2),
+        'light_max_s': round(max(light_waits), 2),
+        'burst_done_s': round(heavy_done, 2),
+    }
+
+
+def rate_limit(rate, calls):
+    from django.conf import settings
+
+    settings.LLM_RATE_PER_MINUTE, settings.LLM_RATE_BURST = rate, 5
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=calls) as pool:
+        list(pool.map(calls_for(None), [f'rate {i}' for i in range(calls)]))
+    elapsed = time.perf_counter() - start
+    settings.LLM_RATE_PER_MINUTE = 0
+    return {
+        'scenario': f'rate limit {rate:g}/min',
+        'calls': calls,
+        'seconds': round(elapsed, 2),
+        'calls_per_s': round(calls / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--delay', type=float, default=0.2, help='Seconds the stub model sleeps per call')
+    parser.add_argument('--identical', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--burst', type=int, default=40)
+    parser.add_argument('--light', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=600, help='LLM_RATE_PER_MINUTE for the rate limit row')
+    parser.add_argument('--rate-calls', type=int, default=30)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+
+    settings.LLM_PROVIDER = 'offline'
+    settings.OFFLINE_LLM_LATENCY = args.delay
+    settings.LLM_MAX_CONCURRENCY = settings.LLM_RATE_PER_MINUTE = 0
+
+    results = coalescing(args.identical)
+    for mode in ('fifo', 'fair'):
+        results.append(fairness(mode, args.concurrency, args.burst, args.light, args.delay))
+    results.append(asyncio.run(afairness(args.concurrency, args.burst, args.light, args.delay)))
+    results.append(rate_limit(args.rate, args.rate_calls))
+    print(f'{args.delay}s model latency; {args.concurrency} calls in flight per key for the fairness rows')
+    print_table(results, ['scenario', 'calls', 'model_calls', 'seconds', 'light_p50_s', 'light_max_s', 'burst_done_s',
+                          'calls_per_s'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+End-to-end latency of process_query: classify-then-generate vs single-call planning.
+
+Gemini is replaced by the offline LLM provider sleeping ``--delay`` seconds
+per call, so the numbers show how many serial model round trips each question
+pays (``--delay 0`` leaves only the non-LLM overhead of the request path). "before"
+reproduces the old flow (a classify_query call followed by SQL or chat
+generation); "after" is the current plan_query path with the local
+pre-classifier, with the SQL cache emptied before every question; "cached"
+repeats the same questions against a warm SQL cache.
+
+    python -m scripts.benchmarks.planning --delay 0.5 --repeat 5
+"""
+import argparse
+import statistics
+import time
+
+from scripts.benchmarks.common import (
+    create_dataset, percentile, print_table, remove_database, scratch_path, setup_django,
+)
+
+
+QUESTIONS = [
+    'show the table',
+    'top 10 by amount',
+    'count orders by city',
+    'what is the average amount per department',
+    'which customers are older than 60',
+    'hello',
+    'thanks a lot',
+    'how many columns are there',
+    'what can I ask about this data',
+    'list the names of active users in Paris',
+]
+
+
+def legacy_plan(query, dataset, api_key=None):
+    """The original flow: one call to classify, a second to generate."""
+    from query_app import views
+
+    classification = views.classify_query(query, dataset, api_key=api_key)
+    if classification == 'CHAT':
+        return 'CHAT', views.generate_chat_response(query, dataset, api_key=api_key)
+    return 'SQL', views.generate_sql_from_query(query, dataset, api_key=api_key)
+
+
+def run(mode, dataset, repeat):
+    from django.test import Client
+    from query_app import views
+    from query_app.llm import get_llm
+    from query_app.models import CachedQuery
+
+    original_plan = views.plan_query
+    views.plan_query = legacy_plan if mode == 'before' else original_plan
+    client = Client()
+    latencies = []
+    llm = get_llm()
+    calls_before = llm.call_count
+    try:
+        for _ in range(repeat):
+            for question in QUESTIONS:
+                if mode != 'cached':
+                    CachedQuery.objects.all().delete()
+                start = time.perf_counter()
+                client.post('/process_query/', {'query': question, 'dataset': dataset.id, 'api_key': 'stub'})
+                latencies.append(time.perf_counter() - start)
+    finally:
+        views.plan_query = original_plan
+
+    return {
+        'mode': mode,
+        'questions': len(latencies),
+        'model_calls': llm.call_count - calls_before,
+        'median_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--delay', type=float, default=0.5, help='Injected seconds per model call')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path, migrate=True, test_client=True)
+        from django.conf import settings
+
+        settings.LLM_PROVIDER = 'offline'
+        settings.OFFLINE_LLM_LATENCY = args.delay
+
+        dataset = create_dataset(1000)
+        results = [run(mode, dataset, args.repeat) for mode in ('before', 'after')]
+        run('cached', dataset, 1)  # warms the SQL cache
+        results.append(run('cached', dataset, args.repeat))
+        print_table(results, ['mode', 'questions', 'model_calls', 'median_ms', 'p95_ms'])
+    finally:
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()
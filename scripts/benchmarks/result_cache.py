@@ -0,0 +1,105 @@
+"""
+Repeated read queries with and without the result cache.
+
+A synthetic dataset of ``--rows`` rows is ingested into a scratch analytics
+database. Each typical generated query (the engines benchmark's, plus a
+table's first rows) runs through execute_question_statements, as a
+question's answer does, with RESULT_CACHING off and then again once the
+cache is warm; the best of ``--repeat`` runs is reported, with the size of
+the cached entry and of the same rows as Arrow IPC (when pyarrow is
+installed). Finally an UPDATE of one row shows the next run missing the
+cache and returning the new value.
+
+    python -m scripts.benchmarks.result_cache --rows 1000000
+"""
+import argparse
+import os
+
+from scripts.benchmarks.common import create_dataset, print_table, remove_database, scratch_path, setup_django
+from scripts.benchmarks.engines import QUERIES, best_of
+
+FIRST_ROWS = ('first rows', 'SELECT * FROM "{table}" LIMIT 10')
+
+
+def arrow_bytes(rows):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return '-'
+    arrays = [pa.array(values) for values in zip(*rows)]
+    batch = pa.RecordBatch.from_arrays(arrays, names=[f'c{i}' for i in range(len(arrays))])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return len(sink.getvalue())
+
+
+def run(rows, repeat):
+    from django.conf import settings
+    from query_app import result_cache
+    from query_app.guardrails import get_query_limits
+    from query_app.views import execute_question_statements, execute_sql_statements
+
+    dataset = create_dataset(rows, name=f'result_cache_{rows}.csv')
+    table = dataset.table_name
+    limits = get_query_limits()
+
+    results = []
+    for label, template in [FIRST_ROWS] + QUERIES:
+        statements = [template.replace('{table}', table)]
+        settings.RESULT_CACHING = False
+        off_s, (_, result_rows, _, _) = best_of(
+            lambda: execute_question_statements(statements, dataset, limits), repeat
+        )
+        settings.RESULT_CACHING = True
+        result_cache.clear_local_results()
+        execute_question_statements(statements, dataset, limits)
+        on_s, (_, cached_rows, _, _) = best_of(lambda: execute_question_statements(statements, dataset, limits), repeat)
+        assert list(map(tuple, result_rows)) == cached_rows, label
+        result_format, payload = result_cache.encode_result(result_rows)
+        results.append({
+            'rows': rows,
+            'query': label,
+            'uncached_ms': round(off_s * 1000, 2),
+            'cached_ms': round(on_s * 1000, 2),
+            'speedup': f'{off_s / on_s:.0f}x',
+            'entry_bytes': f'{len(payload)} ({result_format})',
+            'arrow_bytes': arrow_bytes(result_rows),
+        })
+
+    # A write to the table must make the next read miss
+    top_sql = [f'SELECT "amount" FROM "{table}" WHERE "id" = 1']
+    before = execute_question_statements(top_sql, dataset, limits)[1]
+    execute_sql_statements([f'UPDATE "{table}" SET "amount" = "amount" + 1 WHERE "id" = 1'])
+    misses = result_cache.cache_stats()['misses']
+    after = execute_question_statements(top_sql, dataset, limits)[1]
+    missed = result_cache.cache_stats()['misses'] - misses
+    results.append({
+        'rows': rows,
+        'query': 'after UPDATE',
+        'speedup': 'miss' if missed else 'HIT (stale)',
+        'entry_bytes': f'{before[0][0]} -> {after[0][0]}',
+    })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path, migrate=True)
+        results = []
+        for rows in args.rows:
+            results.extend(run(rows, args.repeat))
+        print(f'{os.cpu_count()} CPUs')
+        print_table(results, ['rows', 'query', 'uncached_ms', 'cached_ms', 'speedup', 'entry_bytes', 'arrow_bytes'])
+    finally:
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()
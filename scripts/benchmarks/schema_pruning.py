@@ -0,0 +1,134 @@
+"""
+SQL prompt size and latency on wide schemas: full schema vs pruned schema.
+
+A synthetic database of ``--tables`` tables with ``--columns`` columns each is
+registered as Dataset rows (the tables themselves are never queried). Each
+question names a table and two of its columns; the benchmark reports the SQL
+prompt size with and without schema pruning, how often both columns survived
+pruning (recall), and generation latency with the offline provider charging
+``--token-latency`` seconds per 1,000 prompt tokens.
+
+    python -m scripts.benchmarks.schema_pruning --tables 20 --columns 300
+"""
+import argparse
+import random
+import statistics
+import time
+
+from scripts.benchmarks.common import (
+    CITIES, percentile, print_table, remove_database, scratch_path, setup_django,
+)
+
+
+TABLES = [
+    'orders', 'customers', 'shipments', 'invoices', 'products', 'suppliers', 'employees', 'payments',
+    'returns', 'warehouses', 'campaigns', 'tickets', 'subscriptions', 'refunds', 'stores', 'vehicles',
+    'contracts', 'claims', 'visits', 'devices', 'licenses', 'budgets', 'leads', 'audits',
+]
+QUALIFIERS = [
+    'gross', 'net', 'total', 'base', 'discount', 'tax', 'shipping', 'handling', 'estimated', 'actual',
+    'planned', 'adjusted', 'monthly', 'quarterly', 'annual', 'daily', 'first', 'last', 'average', 'peak',
+]
+NOUNS = [
+    'amount', 'revenue', 'cost', 'price', 'weight', 'duration', 'score', 'rating', 'quantity', 'margin',
+    'distance', 'volume', 'balance', 'fee', 'rate', 'count', 'date', 'region', 'channel', 'status',
+]
+
+
+def build_database(table_count, column_count, seed):
+    """Register ``table_count`` wide tables in one database group; return {table_name: dataset}."""
+    from query_app.models import Dataset
+
+    rng = random.Random(seed)
+    names = [f'{q}_{n}' for q in QUALIFIERS for n in NOUNS]
+    datasets = {}
+    for index in range(table_count):
+        table = TABLES[index % len(TABLES)] + (f'_{index // len(TABLES)}' if index >= len(TABLES) else '')
+        columns = ['id', f'{table}_id'] + rng.sample(names, min(column_count - 2, len(names)))
+        columns += [f'attribute_{i}' for i in range(column_count - len(columns))]
+        # Frequent values for the region columns, as ingest would record them
+        profile = {'version': 1, 'row_count': 1000, 'columns': {
+            c: {'type': 'TEXT', 'top': [[city, 100] for city in CITIES]} for c in columns if c.endswith('_region')
+        }}
+        datasets[table] = Dataset.objects.create(
+            name=f'{table}.csv', table_name=table, database_group='warehouse', profile=profile,
+            columns=[{'name': c, 'type': 'TEXT'} for c in columns], file=f'datasets/{table}.csv',
+        )
+    return datasets
+
+
+def build_questions(datasets, count, seed):
+    """(question, dataset, table, [target columns]) tuples naming two columns of one table."""
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        table = rng.choice(list(datasets))
+        metric, group = rng.sample([c for c in datasets[table].columns[2:] if '_' in c['name']], 2)
+        metric, group = metric['name'], group['name']
+        question = f"what is the {metric.replace('_', ' ')} by {group.replace('_', ' ')} in {table}"
+        # Questions are asked from a different table's page half of the time
+        current = datasets[rng.choice(list(datasets))] if rng.random() < 0.5 else datasets[table]
+        questions.append((question, current, table, [metric, group]))
+    return questions
+
+
+def run(mode, questions):
+    from django.conf import settings
+    from query_app import views
+    from query_app.llm import OfflineProvider
+    from query_app.schema_catalog import clear_local_catalogs
+
+    settings.SCHEMA_PRUNING = mode == 'pruned'
+    clear_local_catalogs()
+    tokens, latencies, found = [], [], 0
+    for question, dataset, table, targets in questions:
+        schema = views.get_prompt_context(dataset, question)
+        prompt = views.build_sql_prompt(question, dataset, schema)
+        tokens.append(len(prompt) / 4)
+        shown = OfflineProvider._tables(schema).get(table, [])
+        found += all(target in shown for target in targets)
+
+        start = time.perf_counter()
+        views.generate_sql_from_query(question, dataset, api_key='stub')
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        'mode': mode,
+        'questions': len(questions),
+        'median_tokens': int(statistics.median(tokens)),
+        'max_tokens': int(max(tokens)),
+        'recall': f'{found / len(questions):.0%}',
+        'median_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tables', type=int, default=20)
+    parser.add_argument('--columns', type=int, default=300)
+    parser.add_argument('--questions', type=int, default=50)
+    parser.add_argument('--token-latency', type=float, default=0.05,
+                        help='Injected seconds per 1,000 prompt tokens')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path, migrate=True)
+        from django.conf import settings
+
+        settings.LLM_PROVIDER = 'offline'
+        settings.OFFLINE_LLM_LATENCY = 0
+        settings.OFFLINE_LLM_TOKEN_LATENCY = args.token_latency
+
+        datasets = build_database(args.tables, args.columns, args.seed)
+        questions = build_questions(datasets, args.questions, args.seed)
+        results = [run(mode, questions) for mode in ('full', 'pruned')]
+        print_table(results, ['mode', 'questions', 'median_tokens', 'max_tokens', 'recall', 'median_ms', 'p95_ms'])
+    finally:
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Reads from the Parquet snapshot written at ingest vs from the SQLite table.
+
+A synthetic CSV of ``--rows`` rows is ingested into a scratch analytics
+database with and without DATASET_SNAPSHOTS (timed), and the disk footprint of
+the CSV, the SQLite table and the snapshot is reported. Then each reader that
+uses the snapshot runs once against it and once with it moved aside (falling
+back to SQLite): a profile rebuild, CSV exports of ``SELECT *`` and of two
+columns, and re-creating the table (re-ingesting the CSV vs reingest_table
+from the snapshot), with whether both sources produced the same output.
+
+    python -m scripts.benchmarks.snapshots --rows 1000000
+"""
+import argparse
+import contextlib
+import os
+import time
+
+from scripts.benchmarks.common import (
+    print_table, remove_database, scratch_path, setup_django, write_synthetic_csv,
+)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def directory_mb(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / 1e6
+
+
+def analytics_mb():
+    from query_app.db import analytics_connection
+
+    connection = analytics_connection()
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return os.path.getsize(connection.settings_dict['NAME']) / 1e6
+
+
+def ingest(csv_path, table_name, snapshots):
+    from django.conf import settings
+    from query_app.ingest import ingest_file
+
+    settings.DATASET_SNAPSHOTS = snapshots
+    try:
+        with open(csv_path, 'rb') as fh:
+            return ingest_file(fh, table_name)
+    finally:
+        settings.DATASET_SNAPSHOTS = True
+
+
+@contextlib.contextmanager
+def without_snapshot(table_name):
+    """Move the table's snapshot aside so readers fall back to SQLite."""
+    from query_app.snapshots import snapshot_path
+
+    path = snapshot_path(table_name)
+    os.rename(path, f'{path}.aside')
+    try:
+        yield
+    finally:
+        os.rename(f'{path}.aside', path)
+
+
+def compare(label, fn, table_name):
+    with without_snapshot(table_name):
+        sqlite_s, sqlite_result = timed(fn)
+    snapshot_s, snapshot_result = timed(fn)
+    return {
+        'reader': label,
+        'sqlite_ms': round(sqlite_s * 1000, 1),
+        'snapshot_ms': round(snapshot_s * 1000, 1),
+        'speedup': f'{sqlite_s / snapshot_s:.1f}x',
+        'same_output': sqlite_result == snapshot_result,
+    }
+
+
+def run(rows):
+    from query_app import export
+    from query_app.column_stats import profile_table
+    from query_app.db import analytics_connection
+    from query_app.ingest import reingest_table
+    from query_app.snapshots import snapshot_path
+
+    csv_path = write_synthetic_csv(scratch_path('.csv'), rows)
+    try:
+        csv_mb = os.path.getsize(csv_path) / 1e6
+        empty_mb = analytics_mb()
+        start = time.perf_counter()
+        ingest(csv_path, 'plain_upload', snapshots=False)
+        plain_s = time.perf_counter() - start
+        table_mb = analytics_mb() - empty_mb
+        # Freed pages are reused by the next table
+        with analytics_connection().cursor() as cursor:
+            cursor.execute('DROP TABLE plain_upload')
+
+        table = 'snapshot_upload'
+        start = time.perf_counter()
+        columns, _, profile = ingest(csv_path, table, snapshots=True)
+        snapshot_ingest_s = time.perf_counter() - start
+        print(f'{rows} rows: ingest {plain_s:.1f}s without snapshot, {snapshot_ingest_s:.1f}s with; '
+              f'CSV {csv_mb:.1f}MB, SQLite table {table_mb:.1f}MB, '
+              f'snapshot {directory_mb(snapshot_path(table)):.1f}MB')
+
+        column_types = {c['name']: c['type'] for c in columns}
+
+        def export_csv(sql):
+            return lambda: sum(len(chunk) for chunk in export.iter_csv(sql))
+
+        def recreate_from_csv():
+            with without_snapshot(table):
+                ingest(csv_path, table, snapshots=False)
+
+        results = [
+            compare('profile rebuild', lambda: profile_table(table, column_types), table),
+            compare('CSV export SELECT *', export_csv(f'SELECT * FROM "{table}"'), table),
+            compare('CSV export 2 columns', export_csv(f'SELECT "city", "amount" FROM "{table}"'), table),
+        ]
+        reingest_csv_s, _ = timed(recreate_from_csv)
+        reingest_snapshot_s, _ = timed(lambda: reingest_table(table, column_types))
+        results.append({
+            'reader': 're-create table',
+            'sqlite_ms': f'{reingest_csv_s * 1000:.1f} (from CSV)',
+            'snapshot_ms': round(reingest_snapshot_s * 1000, 1),
+            'speedup': f'{reingest_csv_s / reingest_snapshot_s:.1f}x',
+            'same_output': '-',
+        })
+        for result in results:
+            result['rows'] = rows
+        return results
+    finally:
+        os.remove(csv_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path, migrate=True)
+        results = []
+        for rows in args.rows:
+            results.extend(run(rows))
+        print_table(results, ['rows', 'reader', 'sqlite_ms', 'snapshot_ms', 'speedup', 'same_output'])
+    finally:
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Mixed reads and writes from several processes on SQLite: default, tuned and shared.
+
+Each mode gets a fresh scratch database holding a ``--rows``-row dataset and
+some chat history. ``--processes`` worker processes (like gunicorn workers)
+then run for ``--seconds``: every operation is a write with probability
+``--write-ratio`` (a saved conversation, or one in ten an append of
+``--append-rows`` rows to the dataset's table, as an upload does) and
+otherwise a read (an aggregate over the table, a history page or a dataset
+lookup). "default" is SQLite as Django opens it (rollback journal, FULL
+fsyncs); "tuned" applies SQLITE_PRAGMAS (WAL, NORMAL, page cache, mmap,
+busy timeout). Both keep uploaded tables in the separate analytics database;
+"shared" is "tuned" with the analytics alias pointed at the default database
+file, so table appends and ORM writes share one write lock.
+
+    python -m scripts.benchmarks.sqlite_concurrency --processes 4 --seconds 20
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from scripts.benchmarks.common import (
+    CITIES, create_dataset, percentile, print_table, remove_database, scratch_path, setup_django, synthetic_row,
+)
+
+
+MODULE = 'scripts.benchmarks.sqlite_concurrency'
+
+
+def configure(mode, db_path):
+    os.environ['SQLITE_TUNING'] = str(mode != 'default')
+    if mode == 'shared':
+        os.environ['ANALYTICS_DATABASE_URL'] = f'sqlite:///{db_path}'
+
+
+def prepare(mode, db_path, rows):
+    configure(mode, db_path)
+    setup_django(db_path, migrate=True)
+    from query_app.models import Conversation
+
+    dataset = create_dataset(rows)
+    Conversation.objects.bulk_create(
+        Conversation(dataset=dataset, user_query=f'question {i}', response='<p>ok</p>') for i in range(1000)
+    )
+    print(json.dumps({'dataset': dataset.id}))
+
+
+def worker(mode, db_path, dataset_id, seconds, write_ratio, append_rows, start_at, seed):
+    configure(mode, db_path)
+    setup_django(db_path)
+    from django.conf import settings
+    from django.db import OperationalError, transaction
+    from query_app.db import analytics_connection
+    from query_app.models import Conversation, Dataset
+    from query_app.views import get_conversation_page
+
+    rng = random.Random(seed)
+    connection = analytics_connection()
+    dataset = Dataset.objects.get(id=dataset_id)
+    table = f'"{dataset.table_name}"'
+    placeholders = ', '.join(['%s'] * 8)
+
+    def read():
+        choice = rng.random()
+        if choice < 0.4:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT city, AVG(amount), COUNT(*) FROM {table} WHERE city = %s GROUP BY city',
+                               [rng.choice(CITIES)])
+                cursor.fetchall()
+        elif choice < 0.8:
+            get_conversation_page(dataset)
+        else:
+            Dataset.objects.filter(table_name=dataset.table_name).first()
+
+    def write():
+        if rng.random() < 0.1:
+            with transaction.atomic(using=settings.ANALYTICS_DATABASE), connection.cursor() as cursor:
+                cursor.executemany(f'INSERT INTO {table} VALUES ({placeholders})',
+                                   [synthetic_row(i, rng) for i in range(append_rows)])
+        else:
+            Conversation.objects.create(dataset=dataset, user_query='benchmark', response='<p>ok</p>')
+
+    connection.ensure_connection()
+    time.sleep(max(0, start_at - time.time()))
+    latencies = {'read': [], 'write': []}
+    errors = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        kind = 'write' if rng.random() < write_ratio else 'read'
+        start = time.perf_counter()
+        try:
+            (write if kind == 'write' else read)()
+        except OperationalError:
+            # "database is locked": the busy timeout ran out or a lock upgrade deadlocked
+            errors += 1
+            continue
+        latencies[kind].append(time.perf_counter() - start)
+    print(json.dumps({'latencies': latencies, 'errors': errors}))
+
+
+def run(mode, args):
+    db_path = scratch_path('.sqlite3')
+    try:
+        prepared = subprocess.run(
+            [sys.executable, '-m', MODULE, '--prepare', mode, db_path, str(args.rows)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        dataset_id = json.loads(prepared.strip().splitlines()[-1])['dataset']
+        start_at = time.time() + 5
+        workers = [
+            subprocess.Popen(
+                [sys.executable, '-m', MODULE, '--worker', mode, db_path, str(dataset_id), str(args.seconds),
+                 str(args.write_ratio), str(args.append_rows), str(start_at), str(seed)],
+                stdout=subprocess.PIPE, text=True,
+            )
+            for seed in range(args.processes)
+        ]
+        outputs = [json.loads(proc.communicate()[0].strip().splitlines()[-1]) for proc in workers]
+    finally:
+        remove_database(db_path)
+
+    reads = [latency for out in outputs for latency in out['latencies']['read']]
+    writes = [latency for out in outputs for latency in out['latencies']['write']]
+    return {
+        'mode': mode,
+        'processes': args.processes,
+        'ops_per_sec': round((len(reads) + len(writes)) / args.seconds, 1),
+        'read_p50_ms': round(percentile(reads, 50) * 1000, 1),
+        'read_p95_ms': round(percentile(reads, 95) * 1000, 1),
+        'write_p50_ms': round(percentile(writes, 50) * 1000, 1),
+        'write_p95_ms': round(percentile(writes, 95) * 1000, 1),
+        'locked_errors': sum(out['errors'] for out in outputs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, nargs='+', default=[4])
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--append-rows', type=int, default=1000)
+    parser.add_argument('--modes', nargs='+', default=['default', 'tuned', 'shared'])
+    parser.add_argument('--prepare', nargs=3, metavar=('MODE', 'DB', 'ROWS'), help=argparse.SUPPRESS)
+    parser.add_argument('--worker', nargs=8, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.prepare:
+        mode, db_path, rows = args.prepare
+        prepare(mode, db_path, int(rows))
+        return
+    if args.worker:
+        mode, db_path, dataset_id, seconds, write_ratio, append_rows, start_at, seed = args.worker
+        worker(mode, db_path, int(dataset_id), float(seconds), float(write_ratio), int(append_rows),
+               float(start_at), int(seed))
+        return
+
+    results = []
+    for processes in args.processes:
+        for mode in args.modes:
+            results.append(run(mode, argparse.Namespace(**dict(vars(args), processes=processes))))
+    print_table(results, ['mode', 'processes', 'ops_per_sec', 'read_p50_ms', 'read_p95_ms',
+                          'write_p50_ms', 'write_p95_ms', 'locked_errors'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Time until a question's answer starts to show: process_query vs the streaming endpoint.
+
+Gemini is replaced by the offline provider taking ``--delay`` seconds per
+reply. process_query shows nothing until the whole answer is stored and the
+page reloads; /process_query/stream/ sends chat text as the model writes it
+and the SQL before it runs. For each kind of question the table gives the
+time to the first answer text (the first chat token, or the SQL) and to the
+stored turn, with the SQL cache emptied before every question.
+
+    python -m scripts.benchmarks.streaming --delay 1 --repeat 5
+"""
+import argparse
+import statistics
+import time
+
+from scripts.benchmarks.common import create_dataset, print_table, remove_database, scratch_path, setup_django
+
+
+QUESTIONS = [
+    ('chat', 'hello'),
+    ('chat (planned)', 'what can I ask about this data'),
+    ('sql', 'count orders by city'),
+]
+
+
+def blocking(client, dataset, question):
+    start = time.perf_counter()
+    client.post('/process_query/', {'query': question, 'dataset': dataset.id})
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed
+
+
+def streamed(client, dataset, question):
+    start = time.perf_counter()
+    response = client.post('/process_query/stream/', {'query': question, 'dataset': dataset.id})
+    first = None
+    for event in response.streaming_content:
+        if first is None and event.startswith((b'event: token', b'event: sql')):
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def run(mode, kind, question, dataset, repeat):
+    from django.test import Client
+    from query_app.models import CachedQuery
+
+    client = Client()
+    measure = blocking if mode == 'process_query' else streamed
+    firsts, totals = [], []
+    for _ in range(repeat):
+        CachedQuery.objects.all().delete()
+        first, total = measure(client, dataset, question)
+        firsts.append(first)
+        totals.append(total)
+    return {
+        'question': kind,
+        'mode': mode,
+        'first_text_ms': round(statistics.median(firsts) * 1000, 1),
+        'stored_ms': round(statistics.median(totals) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--delay', type=float, default=1.0, help='Injected seconds per model reply')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    try:
+        setup_django(db_path, migrate=True, test_client=True)
+        from django.conf import settings
+
+        settings.LLM_PROVIDER = 'offline'
+        settings.OFFLINE_LLM_LATENCY = args.delay
+
+        dataset = create_dataset(1000)
+        results = [
+            run(mode, kind, question, dataset, args.repeat)
+            for kind, question in QUESTIONS
+            for mode in ('process_query', 'stream')
+        ]
+        print(f'{args.delay}s per model reply')
+        print_table(results, ['question', 'mode', 'first_text_ms', 'stored_ms'])
+    finally:
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()
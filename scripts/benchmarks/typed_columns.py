@@ -0,0 +1,121 @@
+"""
+Typed vs text column benchmark for numeric filters and aggregates.
+
+Loads the same synthetic CSV twice: once with every column declared TEXT
+(numbers stored as strings, so correct queries need CASTs) and once through
+query_app.ingest with inferred column types. The same questions are then
+timed against both tables.
+
+    python -m scripts.benchmarks.typed_columns --rows 1000000
+"""
+import argparse
+import os
+import time
+
+from scripts.benchmarks.common import (
+    print_table, remove_database, scratch_path, setup_django, write_synthetic_csv,
+)
+
+
+# (label, SQL over the text table, SQL over the typed table)
+QUERIES = [
+    (
+        'filter age > 30',
+        'SELECT COUNT(*) FROM "text_table" WHERE CAST("age" AS INTEGER) > 30',
+        'SELECT COUNT(*) FROM "typed_table" WHERE "age" > 30',
+    ),
+    (
+        'sum/avg amount',
+        'SELECT SUM(CAST("amount" AS REAL)), AVG(CAST("amount" AS REAL)) FROM "text_table"',
+        'SELECT SUM("amount"), AVG("amount") FROM "typed_table"',
+    ),
+    (
+        'group by city, avg amount',
+        'SELECT "city", AVG(CAST("amount" AS REAL)) FROM "text_table" GROUP BY "city"',
+        'SELECT "city", AVG("amount") FROM "typed_table" GROUP BY "city"',
+    ),
+    (
+        'top 10 by amount',
+        'SELECT * FROM "text_table" ORDER BY CAST("amount" AS REAL) DESC LIMIT 10',
+        'SELECT * FROM "typed_table" ORDER BY "amount" DESC LIMIT 10',
+    ),
+    (
+        'amount range filter',
+        'SELECT COUNT(*) FROM "text_table" WHERE CAST("amount" AS REAL) BETWEEN 100 AND 500',
+        'SELECT COUNT(*) FROM "typed_table" WHERE "amount" BETWEEN 100 AND 500',
+    ),
+]
+
+
+def _load_text_table(cursor, csv_path):
+    """Load every column as TEXT, as uploads were recorded before type inference."""
+    import csv
+    from query_app.ingest import quote_identifier
+
+    with open(csv_path, newline='') as fh:
+        reader = csv.reader(fh)
+        header = next(reader)
+        column_defs = ', '.join(f'{quote_identifier(h)} TEXT' for h in header)
+        cursor.execute(f'CREATE TABLE "text_table" ({column_defs})')
+        placeholders = ', '.join(['%s'] * len(header))
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= 50000:
+                cursor.executemany(f'INSERT INTO "text_table" VALUES ({placeholders})', batch)
+                batch = []
+        if batch:
+            cursor.executemany(f'INSERT INTO "text_table" VALUES ({placeholders})', batch)
+
+
+def _time_query(cursor, sql, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql)
+        cursor.fetchall()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = scratch_path('.sqlite3')
+    csv_path = write_synthetic_csv(scratch_path('.csv'), args.rows)
+    try:
+        setup_django(db_path)
+        from django.conf import settings
+        from django.db import transaction
+        from query_app.db import analytics_connection
+        from query_app.ingest import ingest_file
+
+        connection = analytics_connection()
+        with transaction.atomic(using=settings.ANALYTICS_DATABASE), connection.cursor() as cursor:
+            _load_text_table(cursor, csv_path)
+        with open(csv_path, 'rb') as fh:
+            columns, _, _ = ingest_file(fh, 'typed_table')
+        print('Inferred types:', ', '.join(f"{c['name']}={c['type']}" for c in columns))
+
+        results = []
+        with connection.cursor() as cursor:
+            for label, text_sql, typed_sql in QUERIES:
+                text_s = _time_query(cursor, text_sql, args.repeat)
+                typed_s = _time_query(cursor, typed_sql, args.repeat)
+                results.append({
+                    'query': label,
+                    'text_ms': round(text_s * 1000, 1),
+                    'typed_ms': round(typed_s * 1000, 1),
+                    'speedup': f'{text_s / typed_s:.2f}x' if typed_s else '-',
+                })
+        print_table(results, ['query', 'text_ms', 'typed_ms', 'speedup'])
+    finally:
+        os.remove(csv_path)
+        remove_database(db_path)
+
+
+if __name__ == '__main__':
+    main()